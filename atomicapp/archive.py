@@ -0,0 +1,303 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import shutil
+import tarfile
+import posixpath
+
+import logging
+
+from constants import APP_ENT_PATH
+
+logger = logging.getLogger(__name__)
+
+OCI_LAYOUT = "oci-layout"
+OCI_REF_NAME = "org.opencontainers.image.ref.name"
+WHITEOUT_PREFIX = ".wh."
+WHITEOUT_OPAQUE = ".wh..wh..opq"
+ARCHIVE_EXTENSIONS = (".tar", ".tar.gz", ".tgz")
+
+
+def normalizeReference(reference):
+    """Canonical form of an image reference, f.e. docker.io/library/x -> x:latest"""
+    for prefix in ("docker://", "docker.io/", "index.docker.io/", "library/"):
+        if reference.startswith(prefix):
+            reference = reference[len(prefix):]
+    if ":" not in reference.rsplit("/", 1)[-1] and "@" not in reference:
+        reference = "%s:latest" % reference
+
+    return reference
+
+
+def _cleanPath(name):
+    path = posixpath.normpath(name.lstrip("/"))
+    if path == ".." or path.startswith("../"):
+        return None
+    return path
+
+
+def _ancestors(path):
+    while True:
+        path = posixpath.dirname(path)
+        if not path:
+            return
+        yield path
+
+
+def openLayerFiles(paths):
+    """Yield the layer tarballs at paths as tarfile streams."""
+    for path in paths:
+        with open(path, "rb") as fp:
+            stream = tarfile.open(fileobj=fp, mode="r|*")
+            yield stream
+            stream.close()
+
+
+def extractLayers(layers, dst, prefix=APP_ENT_PATH):
+    """
+    Apply layers, tarfile streams ordered top-down, to dst and return the
+    number of files written. Only paths under prefix are written: the first
+    layer providing a path wins and whiteout files (.wh.<name> and opaque
+    .wh..wh..opq directories) hide the content of the layers below them,
+    so every file is written once.
+    """
+    written = set()
+    hidden = set()
+    for layer in layers:
+        # Whiteouts hide paths of lower layers only
+        layer_hidden = set()
+        for member in layer:
+            path = _cleanPath(member.name)
+            if not path or path == ".":
+                continue
+            name = posixpath.basename(path)
+            if name == WHITEOUT_OPAQUE:
+                layer_hidden.add(posixpath.dirname(path) + "/")
+                continue
+            if name.startswith(WHITEOUT_PREFIX):
+                layer_hidden.add(posixpath.join(
+                    posixpath.dirname(path), name[len(WHITEOUT_PREFIX):]))
+                continue
+
+            if path != prefix and not path.startswith(prefix + "/"):
+                continue
+            if path in written or path in hidden or \
+                    any(parent in hidden or parent + "/" in hidden
+                        for parent in _ancestors(path)):
+                continue
+
+            _extractMember(layer, member, os.path.join(dst, path))
+            written.add(path)
+
+        hidden |= layer_hidden
+
+    return len([item for item in written if os.path.isfile(os.path.join(dst, item))])
+
+
+def _extractMember(layer, member, target):
+    if member.isdir():
+        if not os.path.isdir(target):
+            os.makedirs(target)
+        return
+
+    if not member.isfile():
+        logger.debug("Skipping %s, only files are extracted", member.name)
+        return
+
+    if not os.path.isdir(os.path.dirname(target)):
+        os.makedirs(os.path.dirname(target))
+    source = layer.extractfile(member)
+    with open(target, "wb") as fp:
+        shutil.copyfileobj(source, fp)
+    os.chmod(target, member.mode & 0777)
+
+
+class ImageArchive(object):
+    """
+    Image stored on disk, either as a tarball created by 'docker save' or
+    as an OCI image layout directory, read without a Docker daemon. The
+    layers are applied with extractLayers.
+    """
+
+    path = None
+    reference = None
+
+    def __init__(self, path, reference=None):
+        self.path = path
+        self.oci = os.path.isdir(path)
+        self.images = self._readImages(path)
+        if not self.images:
+            raise ValueError("No image found in %s" % path)
+
+        if reference:
+            self.reference, self.layers = self._select(normalizeReference(reference))
+        elif len(self.images) == 1:
+            self.reference, self.layers = self.images[0]
+        else:
+            raise ValueError("Archive %s contains several images (%s), choose one"
+                             % (path, ", ".join(ref for ref, _ in self.images)))
+
+    @staticmethod
+    def isArchive(path):
+        if os.path.isdir(path):
+            return os.path.isfile(os.path.join(path, OCI_LAYOUT))
+        return os.path.isfile(path) and tarfile.is_tarfile(path)
+
+    @classmethod
+    def find(cls, archive_dir, reference, cache=None):
+        """Return the ImageArchive in archive_dir containing reference, or None."""
+        reference = normalizeReference(reference)
+        index = cls._indexDir(archive_dir, cache)
+        if reference not in index:
+            return None
+
+        logger.info("Using %s for image %s", index[reference], reference)
+        return cls(index[reference], reference)
+
+    @classmethod
+    def _indexDir(cls, archive_dir, cache=None):
+        key = (os.path.realpath(archive_dir), os.stat(archive_dir).st_mtime)
+        if cache is not None:
+            index = cache.get(key)
+            if index is not None:
+                return index
+
+        index = {}
+        for name in sorted(os.listdir(archive_dir)):
+            path = os.path.join(archive_dir, name)
+            if not cls.isArchive(path):
+                continue
+            try:
+                references = [reference for reference, _ in cls._readImages(path) if reference]
+            except (ValueError, KeyError, tarfile.TarError, IOError) as ex:
+                logger.warning("Skipping broken image archive %s: %s", path, ex)
+                continue
+
+            # Archives can also be named after the image, f.e. "org-app.tar"
+            stem = name
+            for extension in ARCHIVE_EXTENSIONS:
+                if stem.endswith(extension):
+                    stem = stem[:-len(extension)]
+            for reference in references + [normalizeReference(stem),
+                                           normalizeReference(stem.replace("-", "/", 1))]:
+                index.setdefault(reference, path)
+
+        if cache is not None:
+            cache[key] = index
+        return index
+
+    def _select(self, reference):
+        for image_reference, layers in self.images:
+            if image_reference == reference:
+                return image_reference, layers
+        if len(self.images) == 1:
+            # Tag-less archives or archives named after the image
+            return reference, self.images[0][1]
+
+        raise ValueError("Image %s not found in %s" % (reference, self.path))
+
+    @classmethod
+    def _readImages(cls, path):
+        if os.path.isdir(path):
+            return cls._readOCI(path)
+        return cls._readDockerSave(path)
+
+    @staticmethod
+    def _readDockerSave(path):
+        """List of (reference, layers top-down) of a 'docker save' tarball."""
+        images = []
+        with tarfile.open(path) as archive:
+            names = archive.getnames()
+            if "manifest.json" in names:
+                for image in json.load(archive.extractfile("manifest.json")):
+                    layers = list(reversed(image["Layers"]))
+                    for tag in image.get("RepoTags") or [None]:
+                        images.append((tag and normalizeReference(tag), layers))
+                return images
+
+            # Archives of Docker < 1.10 only link each layer to its parent
+            if "repositories" not in names:
+                raise ValueError("%s is not a docker save archive" % path)
+            repositories = json.load(archive.extractfile("repositories"))
+            for repository, tags in sorted(repositories.iteritems()):
+                for tag, layer_id in sorted(tags.iteritems()):
+                    layers = []
+                    while layer_id:
+                        layers.append("%s/layer.tar" % layer_id)
+                        layer_id = json.load(
+                            archive.extractfile("%s/json" % layer_id)).get("parent")
+                    images.append((normalizeReference("%s:%s" % (repository, tag)), layers))
+
+        return images
+
+    @classmethod
+    def _readOCI(cls, path):
+        """List of (reference, layers top-down) of an OCI image layout."""
+        images = []
+        with open(os.path.join(path, "index.json")) as fp:
+            index = json.load(fp)
+
+        for descriptor in index.get("manifests", []):
+            reference = (descriptor.get("annotations") or {}).get(OCI_REF_NAME)
+            manifest = cls._readBlob(path, descriptor["digest"])
+            while "manifests" in manifest:
+                # Image index of a multi-arch image, use the first image
+                manifest = cls._readBlob(path, manifest["manifests"][0]["digest"])
+            layers = [cls._blobPath(path, layer["digest"])
+                      for layer in reversed(manifest["layers"])]
+            # A bare tag is only meaningful inside this layout
+            if reference and ":" not in reference and "/" not in reference:
+                reference = None
+            images.append((reference and normalizeReference(reference), layers))
+
+        return images
+
+    @staticmethod
+    def _blobPath(path, digest):
+        algorithm, digest_hex = digest.split(":", 1)
+        return os.path.join(path, "blobs", algorithm, digest_hex)
+
+    @classmethod
+    def _readBlob(cls, path, digest):
+        with open(cls._blobPath(path, digest)) as fp:
+            return json.load(fp)
+
+    def _openLayers(self):
+        """Yield the layers top-down as tarfile streams."""
+        if self.oci:
+            for stream in openLayerFiles(self.layers):
+                yield stream
+            return
+
+        with tarfile.open(self.path) as archive:
+            for layer in self.layers:
+                stream = tarfile.open(fileobj=archive.extractfile(layer), mode="r|*")
+                yield stream
+                stream.close()
+
+    def extract(self, dst, prefix=APP_ENT_PATH):
+        """
+        Write the files under prefix in the image to dst/prefix, return the
+        number of files written.
+        """
+        files = extractLayers(self._openLayers(), dst, prefix)
+        logger.info("Extracted %s files of %s from %s", files, self.reference, self.path)
+        return files
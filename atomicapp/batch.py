@@ -0,0 +1,154 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import copy
+import time
+from multiprocessing.pool import ThreadPool
+
+import anymarkup
+import logging
+
+from context import RunContext
+from lock import AppLock
+from plugin import Plugin
+from run import Run
+from utils import Utils, printStatus, printErrorStatus
+from constants import GLOBAL_CONF, DEFAULT_ANSWERS, WORKDIR, \
+    ANSWERS_FILE_SAMPLE_FORMAT
+
+logger = logging.getLogger(__name__)
+
+
+class Batch(object):
+    """
+    Run one or more apps with many answer sets in a single process.
+
+    The manifest is a list of entries, each with an "app" path and an
+    optional "answers" file and "namespace". Every entry is rendered into
+    its own working directory (.workdir/batch/<entry>) so entries for the
+    same app do not overwrite each other's artifacts, and entries are
+    deployed by a pool of worker threads. Nulecule files and artifact
+    sources are read once per app and shared by all entries, in caches
+    living as long as the batch (see RunContext.getCache).
+    """
+
+    entries = None
+    workers = 1
+    dryrun = False
+    stop = False
+
+    def __init__(self, manifest, workers=1, dryrun=False, stop=False,
+                 answers_format=ANSWERS_FILE_SAMPLE_FORMAT, lock_timeout=0, **kwargs):
+        self.entries = self.loadManifest(manifest)
+        self.workers = max(1, int(workers))
+        self.dryrun = dryrun
+        self.stop = stop
+        self.lock_timeout = lock_timeout
+        self.answers_format = answers_format
+
+        self.plugin = Plugin()
+        self.plugin.load_plugins()
+        self.docker_cli = Utils.getDockerCli(dryrun, required=False)
+        self.cache = {}
+
+    @staticmethod
+    def loadManifest(path):
+        if not os.path.isfile(path):
+            raise Exception("Batch manifest %s not found" % path)
+
+        entries = anymarkup.parse_file(path)
+        if type(entries) != list:
+            raise ValueError("Batch manifest %s has to contain a list of entries" % path)
+
+        for index, entry in enumerate(entries):
+            if type(entry) != dict or not entry.get("app"):
+                raise ValueError("Entry %s in %s is missing the app path" % (index, path))
+            entry["app"] = os.path.abspath(entry["app"])
+
+        return entries
+
+    def getAppPaths(self):
+        return sorted(set(entry["app"] for entry in self.entries))
+
+    def _loadAnswers(self, entry):
+        answers = entry.get("answers")
+        if answers and os.path.isfile(answers):
+            data = anymarkup.parse_file(answers)
+        elif answers:
+            raise Exception("Answers file %s not found" % answers)
+        else:
+            data = copy.deepcopy(DEFAULT_ANSWERS)
+
+        if entry.get("namespace"):
+            data.setdefault(GLOBAL_CONF, {})["namespace"] = entry["namespace"]
+
+        return data
+
+    def _workdir(self, index, entry):
+        name = Utils.sanitizeName(str(entry.get("namespace") or index))
+        return os.path.join(entry["app"], WORKDIR, "batch", "%s-%s" % (index, name))
+
+    def _runEntry(self, item):
+        index, entry = item
+        result = {"index": index, "app": entry["app"],
+                  "namespace": entry.get("namespace"), "success": False}
+        start = time.time()
+        try:
+            context = RunContext(
+                self.dryrun, plugin=self.plugin, docker_cli=self.docker_cli, cache=self.cache)
+            run = Run(self._loadAnswers(entry), entry["app"], self.dryrun, stop=self.stop,
+                      answers_format=self.answers_format, context=context,
+                      workdir=self._workdir(index, entry))
+            run.run()
+            result["success"] = True
+        except Exception as ex:
+            logger.error("Batch entry %s (%s) failed: %s", index, entry["app"], repr(ex))
+            result["error"] = str(ex)
+        result["duration"] = time.time() - start
+
+        return result
+
+    def run(self):
+        printStatus("Processing %s batch entries with %s workers."
+                    % (len(self.entries), self.workers))
+        # Entries only write to their own working directories, so entries for
+        # the same app can run in parallel - lock out other atomicapp processes
+        locks = []
+        pool = ThreadPool(self.workers)
+        try:
+            for app_path in self.getAppPaths():
+                lock = AppLock(app_path, self.lock_timeout)
+                lock.acquire()
+                locks.append(lock)
+            results = pool.map(self._runEntry, list(enumerate(self.entries)), 1)
+        finally:
+            pool.close()
+            pool.join()
+            for lock in locks:
+                lock.release()
+
+        for result in results:
+            msg = "Batch entry %(index)s %(app)s (namespace %(namespace)s)" % result
+            if result["success"]:
+                printStatus("%s: OK in %.2fs." % (msg, result["duration"]))
+            else:
+                printErrorStatus("%s: FAILED in %.2fs: %s" % (msg, result["duration"], result["error"]))
+
+        return results
@@ -0,0 +1,310 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import mmap
+import stat
+import shutil
+import struct
+import hashlib
+import zipfile
+import tempfile
+
+import anymarkup
+import logging
+
+from constants import MAIN_FILE, WORKDIR, ANSWERS_FILE, BUNDLE_INDEX, BUNDLE_EXTENSION, \
+    BUNDLE_FILE
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_VERSION = 1
+# Reproducible bundles - zip can not store dates before 1980
+BUNDLE_DATE = (1980, 1, 1, 0, 0, 0)
+LOCAL_HEADER = struct.Struct("<4s5H3I2H")
+LOCAL_HEADER_SIGNATURE = "PK\003\004"
+
+# Bundles of installed apps, opened once per version of the file. Evicted
+# ones are unmapped and closed once the last reader drops them.
+_installed = LRUCache(maxsize=16)
+
+
+class Bundle(object):
+    """
+    An app packed into a single file.
+
+    A bundle is an uncompressed zip archive of an installed app (Nulecule,
+    artifacts and external apps) with an index as its last member. The
+    index maps every file to the offset of its data in the bundle, its size,
+    mode and sha256, so files are read straight from a memory map of the
+    bundle without going through zipfile - any zip tool can still list or
+    unpack a bundle.
+
+    Installing a bundle copies it into the app directory as one file (see
+    install), the Nulecule files and artifacts of the app are then read
+    from it and only rendered artifacts are written to disk.
+    """
+
+    path = None
+    index = None
+
+    def __init__(self, path):
+        self.path = path
+        with zipfile.ZipFile(path) as archive:
+            try:
+                self.index = json.loads(archive.read(BUNDLE_INDEX))
+            except KeyError:
+                raise ValueError("%s is not an Atomic App bundle, %s is missing"
+                                 % (path, BUNDLE_INDEX))
+
+        if self.index.get("version") != BUNDLE_VERSION:
+            raise ValueError("Unsupported bundle version %s in %s"
+                             % (self.index.get("version"), path))
+
+        self.fp = open(path, "rb")
+        self.data = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def isBundle(path):
+        return os.path.isfile(path) and zipfile.is_zipfile(path)
+
+    @property
+    def app_id(self):
+        return self.index["id"]
+
+    @property
+    def files(self):
+        return self.index["files"]
+
+    def close(self):
+        """Unmap and close the bundle file, files can not be read after it."""
+        self.data.close()
+        self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def read(self, name, verify=False):
+        if name not in self.files:
+            raise KeyError("%s is not part of bundle %s" % (name, self.path))
+        entry = self.files[name]
+
+        content = self.data[entry["offset"]:entry["offset"] + entry["size"]]
+        if verify and "sha256:%s" % hashlib.sha256(content).hexdigest() != entry["sha256"]:
+            raise ValueError("File %s in bundle %s is corrupted" % (name, self.path))
+        return content
+
+    def getMainfile(self):
+        return anymarkup.parse(self.read(MAIN_FILE))
+
+    def extract(self, dst, update=False):
+        """
+        Write the files of the bundle to dst. Files which already exist are
+        only replaced with update. Returns the number of files written.
+        """
+        dst = os.path.abspath(dst)
+        written = 0
+        for name in sorted(self.files):
+            entry = self.files[name]
+            path = os.path.abspath(os.path.join(dst, name))
+            if not path.startswith(dst + os.sep):
+                raise ValueError("Bundle %s contains file %s outside of the app"
+                                 % (self.path, name))
+            if os.path.exists(path) and not update:
+                continue
+
+            content = self.read(name, verify=True)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, "wb") as fp:
+                fp.write(content)
+            os.chmod(path, entry["mode"])
+            written += 1
+
+        logger.info("Extracted %s of %s files from %s to %s",
+                    written, len(self.files), self.path, dst)
+        return written
+
+    def install(self, app_path, update=False):
+        """
+        Install the bundle into app_path as a single file, BUNDLE_FILE. The
+        files of the app are read from it there (see readAppFile), they are
+        not unpacked. An app already in app_path is only replaced with
+        update. Returns whether the bundle was installed.
+        """
+        dst = os.path.join(app_path, BUNDLE_FILE)
+        if os.path.exists(dst) and os.path.samefile(self.path, dst):
+            return False
+        if isAppFile(os.path.join(app_path, MAIN_FILE)) and not update:
+            logger.info("An app is already installed in %s, keeping it", app_path)
+            return False
+
+        # Replaced at once, other processes may be reading the installed one
+        fd, tmp_path = tempfile.mkstemp(dir=app_path, prefix=".%s-" % BUNDLE_FILE)
+        try:
+            with os.fdopen(fd, "wb") as fp, open(self.path, "rb") as src:
+                shutil.copyfileobj(src, fp)
+            os.chmod(tmp_path, 0644)
+            os.rename(tmp_path, dst)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+        logger.info("Installed bundle %s into %s", self.path, app_path)
+        return True
+
+    @staticmethod
+    def defaultPath(app_path):
+        app_id = anymarkup.parse(readAppFile(os.path.join(app_path, MAIN_FILE)))["id"]
+        return "%s%s" % (app_id.replace("/", "-"), BUNDLE_EXTENSION)
+
+    @classmethod
+    def pack(cls, app_path, path=None):
+        """
+        Pack the app installed in app_path into a bundle at path. Working
+        directories and answers files are left out. Returns the Bundle, open
+        for reading until it is closed.
+        """
+        mainfile = os.path.join(app_path, MAIN_FILE)
+        if not isAppFile(mainfile):
+            raise Exception("%s not found in %s" % (MAIN_FILE, app_path))
+        if not path:
+            path = cls.defaultPath(app_path)
+
+        installed = installedBundle(app_path)
+        if installed is not None:
+            # The app was installed from a bundle, it is that bundle
+            shutil.copyfile(installed.path, path)
+            logger.info("Copied bundle of %s into %s", installed.app_id, path)
+            return cls(path)
+
+        app_id = anymarkup.parse_file(mainfile)["id"]
+
+        files = {}
+        # Opened for reading as well, see _dataOffset
+        with open(path, "w+b") as bundle_fp, \
+                zipfile.ZipFile(bundle_fp, "w", zipfile.ZIP_STORED) as archive:
+            for name in cls._listApp(app_path):
+                with open(os.path.join(app_path, name), "rb") as fp:
+                    content = fp.read()
+                mode = stat.S_IMODE(os.stat(os.path.join(app_path, name)).st_mode)
+
+                info = zipfile.ZipInfo(name, BUNDLE_DATE)
+                info.external_attr = mode << 16
+                archive.writestr(info, content)
+                files[name] = {
+                    "offset": cls._dataOffset(archive, info),
+                    "size": len(content),
+                    "mode": mode,
+                    "sha256": "sha256:%s" % hashlib.sha256(content).hexdigest()}
+
+            index = {"version": BUNDLE_VERSION, "id": app_id, "files": files}
+            info = zipfile.ZipInfo(BUNDLE_INDEX, BUNDLE_DATE)
+            info.external_attr = 0644 << 16
+            archive.writestr(info, json.dumps(index, sort_keys=True))
+
+        logger.info("Packed %s files of %s into %s", len(files), app_id, path)
+        return cls(path)
+
+    @staticmethod
+    def _listApp(app_path):
+        names = []
+        for root, dirs, filenames in os.walk(app_path):
+            dirs[:] = sorted(d for d in dirs if d != WORKDIR)
+            for filename in filenames:
+                if filename == ANSWERS_FILE or filename.endswith(BUNDLE_EXTENSION):
+                    continue
+                names.append(os.path.relpath(os.path.join(root, filename), app_path))
+
+        return sorted(names)
+
+    @staticmethod
+    def _dataOffset(archive, info):
+        # The data of a member follows its local header, read it back to
+        # get the actual length of the name and extra fields
+        position = archive.fp.tell()
+        archive.fp.seek(info.header_offset)
+        header = LOCAL_HEADER.unpack(archive.fp.read(LOCAL_HEADER.size))
+        archive.fp.seek(position)
+        if header[0] != LOCAL_HEADER_SIGNATURE:
+            raise ValueError("Broken zip header of %s" % info.filename)
+
+        return info.header_offset + LOCAL_HEADER.size + header[-2] + header[-1]
+
+
+def installedBundle(app_path):
+    """The bundle installed in app_path (see Bundle.install), None if there is none."""
+    path = os.path.join(app_path, BUNDLE_FILE)
+    try:
+        info = os.stat(path)
+    except OSError:
+        return None
+
+    key = (os.path.realpath(path), info.st_mtime, info.st_size)
+    bundle = _installed.get(key)
+    if bundle is None:
+        bundle = _installed[key] = Bundle(path)
+    return bundle
+
+
+def _member(path):
+    """(bundle, name) of the installed bundle holding the app file at path, or None."""
+    path = os.path.abspath(path)
+    app_path = os.path.dirname(path)
+    while True:
+        bundle = installedBundle(app_path)
+        if bundle is not None:
+            name = os.path.relpath(path, app_path)
+            return (bundle, name) if name in bundle.files else None
+        parent = os.path.dirname(app_path)
+        if parent == app_path:
+            return None
+        app_path = parent
+
+
+def isAppFile(path):
+    """Whether the app file at path exists, in an installed bundle or on disk."""
+    return _member(path) is not None or os.path.isfile(path)
+
+
+def readAppFile(path):
+    """
+    Content of an app file: from the memory map of the bundle installed
+    in the app (or an app it is external to), else from disk.
+    """
+    member = _member(path)
+    if member is not None:
+        return member[0].read(member[1], verify=True)
+    with open(path, "r") as fp:
+        return fp.read()
+
+
+def appFileKey(path):
+    """Key to cache what is read from an app file with, changes with its content."""
+    member = _member(path)
+    if member is not None:
+        bundle, name = member
+        return (os.path.realpath(path), bundle.files[name]["sha256"])
+    info = os.stat(path)
+    return (os.path.realpath(path), info.st_mtime, info.st_size)
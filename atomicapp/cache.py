@@ -0,0 +1,68 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import threading
+import collections
+
+# Entries kept by each cache, a long-running process works with any number
+# of apps and versions of their files
+CACHE_SIZE = 256
+
+
+class LRUCache(collections.MutableMapping):
+    """
+    Mapping keeping the maxsize most recently used entries, safe to share
+    between threads. Entries may be evicted at any time, look them up with
+    get() instead of checking for them first.
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __getitem__(self, key):
+        with self.lock:
+            value = self.entries.pop(key)
+            self.entries[key] = value
+            return value
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def __delitem__(self, key):
+        with self.lock:
+            del self.entries[key]
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def __iter__(self):
+        with self.lock:
+            keys = list(self.entries)
+        return iter(keys)
+
+    def __len__(self):
+        return len(self.entries)
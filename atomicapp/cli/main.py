@@ -20,22 +20,35 @@
 """
 
 from atomicapp.run import Run
+from atomicapp.render import Render
 from atomicapp.install import Install
+from atomicapp.server import Server
+from atomicapp.batch import Batch
+from atomicapp.context import RunContext
+from atomicapp.plan import Plan
+from atomicapp.bundle import Bundle
+from atomicapp.archive import ImageArchive
+from atomicapp.nulecule_base import Nulecule_Base
+from atomicapp.health import HealthCheck, HEALTHY
 import os
 import sys
+import json
 
 from argparse import ArgumentParser
 from argparse import RawDescriptionHelpFormatter
 import logging
-from lockfile import LockFile
 from lockfile import AlreadyLocked
+from lockfile import LockTimeout
 
 from atomicapp import set_logging
 from atomicapp.constants import \
-    ANSWERS_FILE, __ATOMICAPPVERSION__, \
-    __NULECULESPECVERSION__, ANSWERS_FILE_SAMPLE_FORMAT, \
-    LOCK_FILE
-from atomicapp.utils import Utils
+    ANSWERS_FILE, __ATOMICAPPVERSION__, WORKDIR, BUNDLE_EXTENSION, GLOBAL_CONF, \
+    __NULECULESPECVERSION__, ANSWERS_FILE_SAMPLE_FORMAT, SERVER_SOCKET, REGISTRY_CACHE_DIR
+from atomicapp.lock import AppLock
+from atomicapp.tracing import tracer
+from atomicapp.events import events
+from atomicapp.command import runner
+from atomicapp.utils import printStatus, printErrorStatus
 
 logger = logging.getLogger(__name__)
 
@@ -66,6 +79,98 @@ def cli_stop(args):
         sys.exit(False)
 
 
+def cli_status(args):
+    # Checked first, loading the answers would create the directory
+    if not os.path.isdir(args.APP):
+        printErrorStatus("App %s does not exist." % args.APP)
+        sys.exit(True)
+    answers = Nulecule_Base(target_path=args.APP, dryrun=args.dryrun).loadAnswers(args.answers)
+    check = HealthCheck(os.path.join(args.APP, WORKDIR), answers.get(GLOBAL_CONF),
+                        args.dryrun, args.targets, RunContext(args.dryrun))
+    report = check.check()
+
+    if args.json_output:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+    else:
+        sys.stdout.write(HealthCheck.formatReport(report) + "\n")
+    sys.exit(report["health"] != HEALTHY)
+
+
+def cli_pack(args):
+    with Bundle.pack(args.APP, args.output) as bundle:
+        printStatus("Packed %s files into %s." % (len(bundle.files), bundle.path))
+    sys.exit(False)
+
+
+def cli_plan(args):
+    context = RunContext(args.dryrun)
+    context.plan = Plan()
+    Run(context=context, **vars(args)).run()
+
+    if args.output:
+        context.plan.write(args.output)
+    else:
+        context.plan.dump(sys.stdout)
+    sys.exit(False)
+
+
+def cli_render(args):
+    render = Render(**vars(args))
+    render.run()
+    printStatus("Rendered %s artifacts into %s." % (len(render.rendered), render.output))
+    sys.exit(False)
+
+
+def cli_apply(args):
+    plan = Plan.load(args.plan)
+    plan.apply(apply_workdir(args), args.dryrun)
+    sys.exit(False)
+
+
+def apply_workdir(args):
+    return args.workdir or os.path.join(os.path.dirname(os.path.abspath(args.plan)), WORKDIR)
+
+
+def cli_batch(args):
+    batch = Batch(**vars(args))
+
+    results = batch.run()
+    if all(result["success"] for result in results):
+        sys.exit(False)
+    else:
+        sys.exit(True)
+
+
+def cli_serve(args):
+    server = Server(args.socket)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def lock_path(args):
+    """Return the directory the given command is going to write to."""
+    if args.action in ("serve", "batch", "status"):
+        # requests served by the daemon are locked one by one,
+        # batch locks all the apps it works with itself and status
+        # only reads the state, also while the app is being deployed
+        return None
+
+    if args.action == "install":
+        return args.target_path or os.getcwd()
+
+    if args.action == "apply":
+        return apply_workdir(args)
+
+    if os.path.isdir(args.APP) and not ImageArchive.isArchive(args.APP):
+        return args.APP
+
+    # run/stop of an image or bundle installs it into the current directory
+    return os.getcwd()
+
+
 class CLI():
 
     def __init__(self):
@@ -127,6 +232,70 @@ class CLI():
                 "The format for the answers.conf.sample file.Default is "
                 "'ini', Valid formats are 'ini', 'json', 'xml', 'yaml'."))
 
+        self.parser.add_argument(
+            "--trace",
+            dest="trace",
+            default=None,
+            help=(
+                "Record how long each phase, component and artifact took and write "
+                "it to the given file in Chrome trace event format."))
+
+        self.parser.add_argument(
+            "--events",
+            dest="events",
+            default=None,
+            help=(
+                "Write progress as JSON lines (phases, components, status messages, "
+                "answers and errors) to this file, to fd:N (an open file descriptor) "
+                "or to unix:PATH (a unix socket)."))
+
+        self.parser.add_argument(
+            "--max-procs",
+            dest="max_procs",
+            default=runner.max_procs,
+            type=int,
+            help="Maximum number of external commands run at the same time (default %s)" % runner.max_procs)
+
+        self.parser.add_argument(
+            "--command-timeout",
+            dest="command_timeout",
+            default=0,
+            type=float,
+            help="Kill external commands (docker, kubectl, oc) running longer than this many seconds")
+
+        self.parser.add_argument(
+            "--archive-dir",
+            dest="archive_dir",
+            default=None,
+            help=(
+                "Directory with 'docker save' archives and OCI image layouts to "
+                "install images (including external apps) from instead of pulling them"))
+
+        self.parser.add_argument(
+            "--from-registry",
+            dest="from_registry",
+            default=False,
+            action="store_true",
+            help=(
+                "Fetch images straight from their registry without Docker, downloading "
+                "only the layers with the app. Layers are cached in %s" % REGISTRY_CACHE_DIR))
+
+        self.parser.add_argument(
+            "--insecure-registry",
+            dest="insecure_registries",
+            action="append",
+            help="Use plain HTTP for this registry with --from-registry, can be repeated")
+
+        self.parser.add_argument(
+            "--lock-timeout",
+            dest="lock_timeout",
+            default=0,
+            type=float,
+            help=(
+                "Seconds to wait for another Atomic App working on the same "
+                "app to finish. Default is 0 (fail immediately), a negative "
+                "value waits forever."))
+
         subparsers = self.parser.add_subparsers(dest="action")
 
         parser_run = subparsers.add_parser("run")
@@ -141,6 +310,31 @@ class CLI():
             action="store_true",
             help="Ask for params even if the defaul value is provided")
 
+        parser_run.add_argument(
+            "--target",
+            dest="targets",
+            action="append",
+            help=(
+                "Deploy to this target instead of the one in the answers file: a "
+                "namespace for Kubernetes, a config file for OpenShift. Repeat to "
+                "render once and deploy to several targets concurrently."))
+
+        parser_run.add_argument(
+            "--resume",
+            default=False,
+            action="store_true",
+            help=(
+                "Continue the last run of the app: skip the artifacts it deployed "
+                "if they render to the same content, deploy the rest."))
+
+        parser_run.add_argument(
+            "--prune",
+            default=False,
+            action="store_true",
+            help=(
+                "Delete the objects of components that were deployed before "
+                "but are no longer in the Nulecule."))
+
         parser_run.add_argument(
             "APP",
             help="Path to the directory where the image is installed.")
@@ -173,12 +367,19 @@ class CLI():
         parser_install.add_argument(
             "APP",
             help=(
-                "Application to run. This is a container image or a path "
-                "that contains the metadata describing the whole application."))
+                "Application to run. This is a container image, a bundle created "
+                "by 'atomicapp pack' or a path that contains the metadata "
+                "describing the whole application."))
 
         parser_install.set_defaults(func=cli_install)
 
         parser_stop = subparsers.add_parser("stop")
+        parser_stop.add_argument(
+            "--target",
+            dest="targets",
+            action="append",
+            help="Stop the app in this target, can be repeated (see 'run --target').")
+
         parser_stop.add_argument(
             "APP",
             help=(
@@ -187,6 +388,145 @@ class CLI():
 
         parser_stop.set_defaults(func=cli_stop)
 
+        parser_status = subparsers.add_parser("status")
+        parser_status.add_argument(
+            "--json",
+            dest="json_output",
+            default=False,
+            action="store_true",
+            help="Print the health of all components and objects as JSON")
+
+        parser_status.add_argument(
+            "--target",
+            dest="targets",
+            action="append",
+            help="Only check objects deployed to this target, can be repeated (see 'run --target').")
+
+        parser_status.add_argument(
+            "APP",
+            help="Path to the directory where the Atomic App is installed")
+
+        parser_status.set_defaults(func=cli_status)
+
+        parser_pack = subparsers.add_parser("pack")
+        parser_pack.add_argument(
+            "-o",
+            "--output",
+            dest="output",
+            default=None,
+            help="Bundle file to create (default <app id>%s in the current directory)" % BUNDLE_EXTENSION)
+
+        parser_pack.add_argument(
+            "APP",
+            help="Path to the directory where the Atomic App is installed")
+
+        parser_pack.set_defaults(func=cli_pack)
+
+        parser_plan = subparsers.add_parser("plan")
+        parser_plan.add_argument(
+            "-o",
+            "--output",
+            dest="output",
+            default=None,
+            help=(
+                "File to write the plan to instead of stdout. The plan contains "
+                "all resolved params, keep it as safe as your answers file."))
+
+        parser_plan.add_argument(
+            "--stop",
+            dest="stop",
+            default=False,
+            action="store_true",
+            help="Plan stopping the app instead of running it")
+
+        parser_plan.add_argument(
+            "--target",
+            dest="targets",
+            action="append",
+            help="Plan deploying to this target, can be repeated (see 'run --target').")
+
+        parser_plan.add_argument(
+            "APP",
+            help="Path to the directory where the Atomic App is installed or an image to install it from.")
+
+        parser_plan.set_defaults(func=cli_plan)
+
+        parser_render = subparsers.add_parser("render")
+        parser_render.add_argument(
+            "-o",
+            "--output",
+            dest="output",
+            default=None,
+            help=(
+                "Directory to render the artifacts into, one tree per provider "
+                "(default ./rendered)"))
+
+        parser_render.add_argument(
+            "--provider",
+            dest="providers",
+            action="append",
+            help="Only render the artifacts of this provider, can be repeated (default all providers)")
+
+        parser_render.add_argument(
+            "-j",
+            "--processes",
+            dest="processes",
+            default=None,
+            type=int,
+            help="Number of processes rendering artifacts (default the number of CPUs)")
+
+        parser_render.add_argument(
+            "APP",
+            help="Path to the directory where the Atomic App is installed or an image to install it from.")
+
+        parser_render.set_defaults(func=cli_render)
+
+        parser_apply = subparsers.add_parser("apply")
+        parser_apply.add_argument(
+            "--workdir",
+            dest="workdir",
+            default=None,
+            help="Directory to write the artifacts of the plan to (default %s next to the plan)" % WORKDIR)
+
+        parser_apply.add_argument(
+            "plan",
+            help="Plan created by 'atomicapp plan'")
+
+        parser_apply.set_defaults(func=cli_apply)
+
+        parser_batch = subparsers.add_parser("batch")
+        parser_batch.add_argument(
+            "-w",
+            "--workers",
+            dest="workers",
+            default=4,
+            type=int,
+            help="Number of entries processed in parallel (default 4)")
+
+        parser_batch.add_argument(
+            "--stop",
+            dest="stop",
+            default=False,
+            action="store_true",
+            help="Stop the apps listed in the manifest instead of running them")
+
+        parser_batch.add_argument(
+            "manifest",
+            help=(
+                "File with a list of entries to process, each with an 'app' path "
+                "and optionally an 'answers' file and a 'namespace'."))
+
+        parser_batch.set_defaults(func=cli_batch)
+
+        parser_serve = subparsers.add_parser("serve")
+        parser_serve.add_argument(
+            "--socket",
+            dest="socket",
+            default=SERVER_SOCKET,
+            help="Unix socket to accept install, run and stop requests on (default %s)" % SERVER_SOCKET)
+
+        parser_serve.set_defaults(func=cli_serve)
+
     def run(self):
         self.set_arguments()
         args = self.parser.parse_args()
@@ -197,9 +537,17 @@ class CLI():
         else:
             set_logging(level=logging.INFO)
 
-        lock = LockFile(os.path.join(Utils.getRoot(), LOCK_FILE))
+        if args.trace:
+            tracer.enable()
+        if args.events:
+            events.open(args.events)
+        runner.configure(args.max_procs, args.command_timeout)
+
+        lock = None
         try:
-            lock.acquire(timeout=-1)
+            if hasattr(args, "func") and lock_path(args):
+                lock = AppLock(lock_path(args), args.lock_timeout)
+                lock.acquire()
             args.func(args)
         except AttributeError:
             if hasattr(args, 'func'):
@@ -208,9 +556,12 @@ class CLI():
                 self.parser.print_help()
         except KeyboardInterrupt:
             pass
-        except AlreadyLocked:
-            logger.error("Could not proceed - there is probably another instance of Atomic App running on this machine.")
+        except (AlreadyLocked, LockTimeout) as ex:
+            # Raised by the lock of the app or by any lock taken while working on it
+            logger.error("Could not proceed - there is probably another instance of Atomic App "
+                         "working with %s on this machine.", getattr(ex, "locked", "it"))
         except Exception as ex:
+            events.emit("error", message=str(ex), exception=ex.__class__.__name__)
             if args.verbose:
                 raise
             else:
@@ -218,8 +569,13 @@ class CLI():
                 logger.error(
                     "Run the command again with -v option to get more information.")
         finally:
-            if lock.i_am_locking():
+            if lock:
                 lock.release()
+            runner.logSummary()
+            if args.trace:
+                tracer.write(args.trace)
+                tracer.printSummary()
+            events.close()
 
 
 def main():
@@ -0,0 +1,198 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from subprocess import Popen, PIPE
+from multiprocessing.pool import ThreadPool
+
+import logging
+
+from tracing import tracer
+import scope
+
+logger = logging.getLogger(__name__)
+
+# How many of the last commands the runner keeps, without their output
+RECENT_RECORDS = 100
+
+
+class CommandFailedException(Exception):
+
+    """External command failed, timed out or could not be started"""
+
+    def __init__(self, msg, result=None):
+        Exception.__init__(self, msg)
+        self.result = result
+
+
+class CommandResult(object):
+
+    def __init__(self, cmd, returncode=0, stdout="", stderr="", duration=0.0,
+                 dryrun=False, timed_out=False):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.duration = duration
+        self.dryrun = dryrun
+        self.timed_out = timed_out
+
+    def __str__(self):
+        return " ".join(self.cmd)
+
+
+class CommandRunner(object):
+    """
+    Single place through which Atomic App runs external commands.
+
+    It limits how many commands run at once (max_procs), kills commands
+    running longer than their timeout, turns every failure into a
+    CommandFailedException and counts the commands run per executable with
+    their failures and duration. Only the last RECENT_RECORDS commands are
+    kept, without their output, so a long-running process does not grow
+    with every command. In dry-run mode commands are only logged.
+    """
+
+    max_procs = 4
+    timeout = None
+
+    def __init__(self, max_procs=4, timeout=None):
+        self.records = deque(maxlen=RECENT_RECORDS)
+        # executable -> [count, failures, seconds]
+        self.totals = {}
+        self.records_lock = threading.Lock()
+        self.configure(max_procs, timeout)
+
+    def configure(self, max_procs=None, timeout=None):
+        if max_procs:
+            self.max_procs = max(1, int(max_procs))
+            self.slots = threading.BoundedSemaphore(self.max_procs)
+        if timeout is not None:
+            self.timeout = timeout if timeout > 0 else None
+
+    def run(self, cmd, dryrun=False, check=True, capture=True, timeout=None):
+        """
+        Run cmd and return its CommandResult.
+
+        capture=False lets the command write to our stdout/stderr (e.g. for
+        progress output of docker pull). With check, a non-zero exit code
+        raises CommandFailedException.
+        """
+        cmd = [str(arg) for arg in cmd]
+        if dryrun:
+            logger.info("DRY-RUN: %s", " ".join(cmd))
+            result = CommandResult(cmd, dryrun=True)
+            self._record(result)
+            return result
+
+        timeout = timeout or self.timeout
+        with tracer.span("command", command=os.path.basename(cmd[0])):
+            with self.slots:
+                result = self._execute(cmd, capture, timeout)
+
+        return self.finish(result, check, timeout)
+
+    def finish(self, result, check=True, timeout=None):
+        """Record the CommandResult of a finished command and check it like run."""
+        self._record(result)
+
+        if result.timed_out:
+            raise CommandFailedException(
+                "Command %s timed out after %ss" % (result, timeout), result)
+        if check and result.returncode != 0:
+            raise CommandFailedException(
+                "Command %s failed with exit code %s: %s"
+                % (result, result.returncode, (result.stderr or "").strip()), result)
+
+        return result
+
+    def map(self, cmds, **kwargs):
+        """Run several commands concurrently, return results in order."""
+        if len(cmds) < 2:
+            return [self.run(cmd, **kwargs) for cmd in cmds]
+
+        pool = ThreadPool(min(len(cmds), self.max_procs))
+        try:
+            return pool.map(scope.inherit(lambda cmd: self.run(cmd, **kwargs)), cmds, 1)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _execute(self, cmd, capture, timeout):
+        logger.debug("Running %s", " ".join(cmd))
+        start = time.time()
+        pipe = PIPE if capture else None
+        try:
+            process = Popen(cmd, stdout=pipe, stderr=pipe)
+        except OSError as ex:
+            result = CommandResult(cmd, returncode=127, stderr=str(ex))
+            self._record(result)
+            raise CommandFailedException("Could not execute %s: %s" % (result, ex), result)
+
+        timer = None
+        killed = []
+        if timeout:
+            def kill():
+                killed.append(True)
+                process.kill()
+            timer = threading.Timer(timeout, kill)
+            timer.start()
+
+        try:
+            stdout, stderr = process.communicate()
+        finally:
+            if timer:
+                timer.cancel()
+
+        result = CommandResult(cmd, process.returncode, stdout or "", stderr or "",
+                               time.time() - start, timed_out=bool(killed))
+        logger.debug("%s exited with %s in %.3fs", result, result.returncode, result.duration)
+        if result.stdout:
+            logger.debug("stdout = %s", result.stdout)
+        if result.stderr:
+            logger.debug("stderr = %s", result.stderr)
+
+        return result
+
+    def _record(self, result):
+        record = CommandResult(result.cmd, result.returncode, duration=result.duration,
+                               dryrun=result.dryrun, timed_out=result.timed_out)
+        with self.records_lock:
+            self.records.append(record)
+            if result.dryrun:
+                return
+            totals = self.totals.setdefault(os.path.basename(result.cmd[0]), [0, 0, 0.0])
+            totals[0] += 1
+            totals[1] += result.returncode != 0
+            totals[2] += result.duration
+
+    def summary(self):
+        """Return (command, count, failures, seconds) per executable."""
+        with self.records_lock:
+            return sorted((name,) + tuple(values) for name, values in self.totals.iteritems())
+
+    def logSummary(self):
+        for name, count, failures, seconds in self.summary():
+            logger.info("Ran %s %s time(s) in %.2fs, %s failed", name, count, seconds, failures)
+
+
+runner = CommandRunner()
@@ -36,7 +36,13 @@ ANSWERS_FILE = "answers.conf"
 ANSWERS_FILE_SAMPLE = "answers.conf.sample"
 ANSWERS_FILE_SAMPLE_FORMAT = 'ini'
 WORKDIR = ".workdir"
-LOCK_FILE = "/run/lock/atomicapp.lock"
+STATE_FILE = "state.db"
+BUNDLE_EXTENSION = ".atomicapp"
+BUNDLE_INDEX = ".atomicapp-index.json"
+BUNDLE_FILE = "app.atomicapp"
+LOCK_DIR = "/run/lock/atomicapp"
+REGISTRY_CACHE_DIR = "/var/cache/atomicapp/registry"
+SERVER_SOCKET = "/run/atomicapp.sock"
 
 DEFAULT_PROVIDER = "kubernetes"
 DEFAULT_NAMESPACE = "default"
@@ -0,0 +1,125 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import copy
+import logging
+
+from plugin import Plugin
+from utils import Utils
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class RunContext(object):
+    """
+    State shared by a Run and every nested Run it spawns for external
+    components, so that setup is done once per invocation instead of
+    once per level of the application graph.
+
+    cache holds the named caches of getCache. A batch or the server passes
+    the same dict to all of its contexts, so their caches live as long as
+    the batch or the server, each bounded to its most recently used entries.
+    """
+
+    root = None
+    answers = None
+    plugin = None
+    docker_cli = None
+    providers = None
+    cache = None
+    checked_apps = None
+    validated_apps = None
+    # Real paths of the apps whose Nulecule was checked, see schema.checkApp
+    schema_checked = None
+    # When set to a Plan, provider calls are recorded in it instead of made
+    plan = None
+    # StateStore of the working directory and the id of the current run,
+    # set by the top-level Run unless in dry-run
+    state = None
+    run_id = None
+    # Instance label of what the run deploys, recorded in the state
+    instance = None
+    # app id -> names of the components of its graph processed in the run
+    components = None
+    # Checkpoints of the run being resumed, see StateStore.getCheckpoints
+    checkpoints = None
+    # Components rendered by the run and its nested runs, see Run._deploy
+    deployments = None
+    # Whether params without a value may be asked for on the terminal
+    interactive = True
+
+    def __init__(self, dryrun=False, plugin=None, docker_cli=None, cache=None,
+                 interactive=True):
+        if not plugin:
+            plugin = Plugin()
+            plugin.load_plugins()
+        self.plugin = plugin
+
+        self.docker_cli = docker_cli or Utils.getDockerCli(dryrun, required=False)
+        self.providers = {}
+        self.cache = cache if cache is not None else {}
+        self.checked_apps = set()
+        self.validated_apps = set()
+        self.schema_checked = set()
+        self.components = {}
+        self.deployments = []
+        self.interactive = interactive
+
+    def getCache(self, name):
+        """Cache of parsed files, templates etc. shared through self.cache."""
+        return self.cache.setdefault(name, LRUCache())
+
+    def isNested(self, run):
+        # The first Run to use a context is the top-level one
+        if self.root is None:
+            self.root = run
+        return self.root is not run
+
+    def setAnswers(self, answers_data):
+        self.answers = copy.deepcopy(answers_data)
+
+    def getAnswers(self):
+        # Every nested Run gets its own copy - values resolved for one
+        # component must not leak into the answers of a sibling app
+        return copy.deepcopy(self.answers)
+
+    def getProvider(self, key):
+        if key not in self.providers:
+            self.providers[key] = self.plugin.getProvider(key)
+        return self.providers[key]
+
+    def markChecked(self, app_path):
+        self.checked_apps.add(os.path.realpath(app_path))
+
+    def needsArtifactCheck(self, app_path):
+        if os.path.realpath(app_path) in self.checked_apps:
+            logger.debug("Artifacts in %s already checked", app_path)
+            return False
+        self.markChecked(app_path)
+        return True
+
+    def needsValidation(self, app_path):
+        app_path = os.path.realpath(app_path)
+        if app_path in self.validated_apps:
+            logger.debug("Values of %s already validated", app_path)
+            return False
+        self.validated_apps.add(app_path)
+        return True
@@ -0,0 +1,406 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import time
+import types
+import select
+import Queue
+import threading
+from collections import deque
+from subprocess import Popen, PIPE
+from multiprocessing.pool import ThreadPool
+
+import logging
+
+from command import runner, CommandResult, CommandFailedException
+from tracing import tracer
+import scope
+
+logger = logging.getLogger(__name__)
+
+# How often queued commands look for a free slot taken by a blocking run
+SLOT_POLL_INTERVAL = 0.05
+
+
+class Return(Exception):
+    """Raised by a task to finish with a value, generators can not return one."""
+
+    def __init__(self, value=None):
+        Exception.__init__(self)
+        self.value = value
+
+
+class Command(object):
+    """Run an external command, the task gets its CommandResult (see runner.run)."""
+
+    def __init__(self, cmd, dryrun=False, check=True, timeout=None):
+        self.cmd = [str(arg) for arg in cmd]
+        self.dryrun = dryrun
+        self.check = check
+        self.timeout = timeout
+
+
+class Call(object):
+    """Call a blocking function in a worker thread, the task gets what it returns."""
+
+    def __init__(self, func, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+
+class All(object):
+    """
+    Run operations and tasks concurrently, the task gets their results in
+    order. Once all have finished the first error, if any, is raised.
+    """
+
+    def __init__(self, operations):
+        self.operations = list(operations)
+
+
+class Graph(object):
+    """
+    Run operations and tasks as soon as those they depend on are done,
+    concurrently otherwise. depends_on holds the indexes each operation
+    depends on, the task gets the results in order. An operation whose
+    dependency failed is not run (its result is None), once every other
+    one has finished the first error is raised.
+    """
+
+    def __init__(self, operations, depends_on):
+        self.operations = list(operations)
+        self.depends_on = [sorted(set(deps)) for deps in depends_on]
+        if len(self.depends_on) != len(self.operations):
+            raise ValueError("Every operation needs its list of dependencies")
+        self.order = self._sort()
+
+    def _sort(self):
+        """
+        Indexes of the operations, each after those it depends on and in
+        the given order otherwise. Raises ValueError for unknown
+        dependencies and cycles.
+        """
+        remaining = dict((index, set(deps)) for index, deps in enumerate(self.depends_on))
+        for index, deps in remaining.iteritems():
+            unknown = [dep for dep in deps if dep not in remaining or dep == index]
+            if unknown:
+                raise ValueError("Operation %s depends on unknown operations %s"
+                                 % (index, unknown))
+        order = []
+        while remaining:
+            done = sorted(index for index, deps in remaining.iteritems() if not deps)
+            if not done:
+                raise ValueError("Operations %s depend on each other" % sorted(remaining))
+            for index in done:
+                del remaining[index]
+            for deps in remaining.itervalues():
+                deps.difference_update(done)
+            order += done
+        return order
+
+
+class _Process(object):
+
+    def __init__(self, operation, process, started, timeout, callback):
+        self.operation = operation
+        self.process = process
+        self.started = started
+        self.deadline = started + timeout if timeout else None
+        self.timeout = timeout
+        self.callback = callback
+        self.output = {process.stdout.fileno(): [], process.stderr.fileno(): []}
+        self.open = set(self.output)
+        self.timed_out = False
+
+
+class Engine(object):
+    """
+    Event loop running provider tasks concurrently in a single thread.
+
+    A task is a generator yielding operations - Command, Call, All or
+    another task - and getting their results back (errors are raised in
+    the task). Commands are started without a thread each and their output
+    is read with select; at most runner.max_procs commands run at a time,
+    shared with commands run by runner.run in other threads, the rest wait
+    their turn. Call is the adapter for blocking code like providers that
+    only implement the synchronous deploy, it runs in a worker thread of a
+    pool shared by all engines of the process.
+
+    This is a generator based loop, asyncio is not available in the Python
+    versions Atomic App supports.
+    """
+
+    def __init__(self, max_threads=None):
+        self.max_threads = max_threads or runner.max_procs
+        self.ready = deque()
+        self.queued = deque()
+        self.processes = {}
+        self.calls = Queue.Queue()
+        self.pending_calls = 0
+        self.wakeup = None
+
+    def run(self, operation):
+        """Run an operation or task to completion and return its result."""
+        outcome = []
+        self.wakeup = os.pipe()
+        try:
+            self._start(operation, lambda value, error: outcome.append((value, error)))
+            while not outcome:
+                self._loop()
+        finally:
+            os.close(self.wakeup[0])
+            os.close(self.wakeup[1])
+
+        value, error = outcome[0]
+        if error:
+            raise error[0], error[1], error[2]
+        return value
+
+    def _start(self, operation, callback):
+        if isinstance(operation, types.GeneratorType):
+            self._step(operation, callback, None, None)
+        elif isinstance(operation, Command):
+            if operation.dryrun:
+                logger.info("DRY-RUN: %s", " ".join(operation.cmd))
+                self._finish(operation, CommandResult(operation.cmd, dryrun=True), callback)
+            else:
+                self.queued.append((operation, callback))
+        elif isinstance(operation, Call):
+            self._call(operation, callback)
+        elif isinstance(operation, All):
+            self._graph(operation.operations, [[]] * len(operation.operations), callback)
+        elif isinstance(operation, Graph):
+            self._graph(operation.operations, operation.depends_on, callback)
+        else:
+            self.ready.append((callback, None, (TypeError, TypeError(
+                "Tasks can not yield %r" % (operation,)), None)))
+
+    def _step(self, task, callback, value, error):
+        try:
+            if error:
+                operation = task.throw(*error)
+            else:
+                operation = task.send(value)
+        except StopIteration:
+            callback(None, None)
+        except Return as ret:
+            callback(ret.value, None)
+        except Exception:
+            callback(None, sys.exc_info())
+        else:
+            self._start(operation, lambda value, error: self.ready.append(
+                (lambda value, error: self._step(task, callback, value, error),
+                 value, error)))
+
+    def _graph(self, operations, depends_on, callback):
+        if not operations:
+            self.ready.append((callback, [], None))
+            return
+
+        results = [None] * len(operations)
+        errors = []
+        waiting = dict((index, set(deps)) for index, deps in enumerate(depends_on) if deps)
+        dependents = {}
+        for index, deps in waiting.iteritems():
+            for dep in deps:
+                dependents.setdefault(dep, []).append(index)
+        pending = [len(operations)]
+
+        def skip(index):
+            # Dependencies failed, dependents of dependents are not run either
+            waiting.pop(index, None)
+            pending[0] -= 1
+            for dependent in dependents.get(index, []):
+                if dependent in waiting:
+                    skip(dependent)
+
+        def done(index, value, error):
+            results[index] = value
+            pending[0] -= 1
+            if error:
+                errors.append(error)
+            for dependent in dependents.get(index, []):
+                if dependent not in waiting:
+                    continue
+                if error:
+                    skip(dependent)
+                    continue
+                waiting[dependent].discard(index)
+                if not waiting[dependent]:
+                    del waiting[dependent]
+                    start(dependent)
+            if not pending[0]:
+                callback(None if errors else results, errors[0] if errors else None)
+
+        def start(index):
+            self._start(operations[index],
+                        lambda value, error, index=index: done(index, value, error))
+
+        for index in range(len(operations)):
+            if index not in waiting:
+                start(index)
+
+    def _call(self, operation, callback):
+        def call():
+            try:
+                result = (operation.func(*operation.args, **operation.kwargs), None)
+            except Exception:
+                result = (None, sys.exc_info())
+            return result
+
+        if getattr(_worker, "busy", False):
+            # An engine run from a worker thread must not wait for another
+            # worker, the shared pool could be taken by its callers
+            self.ready.append((callback,) + call())
+            return
+
+        def work():
+            _worker.busy = True
+            try:
+                self.calls.put((callback,) + call())
+            finally:
+                _worker.busy = False
+            os.write(self.wakeup[1], "x")
+
+        self.pending_calls += 1
+        _workers(self.max_threads).apply_async(scope.inherit(work))
+
+    def _finish(self, operation, result, callback):
+        try:
+            value = runner.finish(result, operation.check, operation.timeout)
+        except CommandFailedException:
+            self.ready.append((callback, None, sys.exc_info()))
+        else:
+            self.ready.append((callback, value, None))
+
+    def _spawn(self):
+        while self.queued and runner.slots.acquire(False):
+            operation, callback = self.queued.popleft()
+            logger.debug("Running %s", " ".join(operation.cmd))
+            started = time.time()
+            try:
+                process = Popen(operation.cmd, stdout=PIPE, stderr=PIPE)
+            except OSError as ex:
+                runner.slots.release()
+                result = CommandResult(operation.cmd, returncode=127, stderr=str(ex))
+                runner.finish(result, check=False)
+                self.ready.append((callback, None, (CommandFailedException, CommandFailedException(
+                    "Could not execute %s: %s" % (result, ex), result), None)))
+                continue
+
+            entry = _Process(operation, process, started,
+                             operation.timeout or runner.timeout, callback)
+            for fd in entry.output:
+                self.processes[fd] = entry
+
+    def _exited(self, entry):
+        runner.slots.release()
+        entry.process.wait()
+        result = CommandResult(
+            entry.operation.cmd, entry.process.returncode, "".join(entry.output[
+                entry.process.stdout.fileno()]), "".join(entry.output[
+                    entry.process.stderr.fileno()]),
+            time.time() - entry.started, timed_out=entry.timed_out)
+        entry.process.stdout.close()
+        entry.process.stderr.close()
+        logger.debug("%s exited with %s in %.3fs", result, result.returncode, result.duration)
+        tracer.addSpan("command", entry.started, time.time(),
+                       command=os.path.basename(result.cmd[0]))
+        self._finish(entry.operation, result, entry.callback)
+
+    def _wait(self):
+        """Wait for output of the running commands, finished calls or a timeout."""
+        timeout = None
+        now = time.time()
+        deadlines = [entry.deadline for entry in self.processes.itervalues()
+                     if entry.deadline and not entry.timed_out]
+        if deadlines:
+            timeout = max(0, min(deadlines) - now)
+        if self.queued:
+            timeout = min(timeout, SLOT_POLL_INTERVAL) if timeout is not None \
+                else SLOT_POLL_INTERVAL
+
+        fds = list(self.processes) + [self.wakeup[0]]
+        readable = select.select(fds, [], [], timeout)[0]
+        for fd in readable:
+            if fd == self.wakeup[0]:
+                os.read(fd, 4096)
+                continue
+            entry = self.processes[fd]
+            data = os.read(fd, 65536)
+            if data:
+                entry.output[fd].append(data)
+                continue
+            del self.processes[fd]
+            entry.open.discard(fd)
+            if not entry.open:
+                self._exited(entry)
+
+        now = time.time()
+        for entry in set(self.processes.itervalues()):
+            if entry.deadline and not entry.timed_out and now >= entry.deadline:
+                logger.warning("Killing %s after %ss", " ".join(entry.operation.cmd),
+                               entry.timeout)
+                entry.timed_out = True
+                entry.process.kill()
+
+    def _loop(self):
+        while True:
+            try:
+                callback, value, error = self.calls.get_nowait()
+            except Queue.Empty:
+                break
+            self.pending_calls -= 1
+            self.ready.append((callback, value, error))
+
+        if self.ready:
+            callback, value, error = self.ready.popleft()
+            callback(value, error)
+            return
+
+        self._spawn()
+        if self.processes or self.queued or self.pending_calls:
+            self._wait()
+        else:
+            raise RuntimeError("Tasks are waiting for nothing")
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_worker = threading.local()
+
+
+def _workers(max_threads):
+    """
+    Worker threads Calls run in, created once for the process: starting and
+    joining a pool per run costs more than most provider calls take.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPool(max_threads)
+        return _pool
+
+
+def runTask(operation):
+    """Run a task (or operation) synchronously, the adapter for synchronous callers."""
+    return Engine().run(operation)
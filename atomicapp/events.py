@@ -0,0 +1,124 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import time
+import socket
+import threading
+from contextlib import contextmanager
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class EventStream(object):
+    """
+    Typed events of an Atomic App invocation, written as JSON lines to the
+    sinks opened with --events, so that management tools can follow
+    progress without parsing log output. Every event is one JSON object
+    with "event" and "time":
+
+        {"event": "phase_start", "phase": "run", ...}
+        {"event": "phase_end", "phase": "run", "success": true, "duration": 1.2, ...}
+        {"event": "status", "message": ...}
+        {"event": "error", "message": ...}
+        {"event": "answers", "answers": {...}}
+
+    Phases are install, run, stop, component (with "app", "component",
+    "index" and "total" for progress), target, status and apply. The
+    atomicapp.status.* log messages are still logged for compatibility.
+    Without sinks emitting events is a no-op.
+    """
+
+    def __init__(self):
+        self.sinks = []
+        self.lock = threading.Lock()
+
+    def open(self, target):
+        """
+        Add a sink for target: fd:N for an open file descriptor, unix:PATH
+        for a unix socket to connect to, else the path of a file to append to.
+        """
+        if target.startswith("fd:"):
+            sink = os.fdopen(int(target[len("fd:"):]), "w")
+        elif target.startswith("unix:"):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(target[len("unix:"):])
+            sink = sock.makefile("w")
+            sock.close()
+        else:
+            sink = open(target, "a")
+        self.addSink(sink)
+        return sink
+
+    def addSink(self, sink):
+        with self.lock:
+            self.sinks.append(sink)
+
+    def removeSink(self, sink):
+        with self.lock:
+            if sink in self.sinks:
+                self.sinks.remove(sink)
+
+    def close(self):
+        with self.lock:
+            sinks, self.sinks = self.sinks, []
+        for sink in sinks:
+            try:
+                sink.close()
+            except (IOError, OSError, socket.error) as ex:
+                logger.debug("Could not close event sink: %s", ex)
+
+    def emit(self, event, **fields):
+        if not self.sinks:
+            return
+
+        fields["event"] = event
+        fields["time"] = time.time()
+        line = json.dumps(fields, default=str) + "\n"
+        with self.lock:
+            for sink in list(self.sinks):
+                try:
+                    sink.write(line)
+                    sink.flush()
+                except (IOError, OSError, ValueError, socket.error) as ex:
+                    # A consumer going away must not fail the run
+                    logger.warning("Not sending events any more: %s", ex)
+                    self.sinks.remove(sink)
+
+    @contextmanager
+    def phase(self, name, **attrs):
+        if not self.sinks:
+            yield
+            return
+
+        self.emit("phase_start", phase=name, **attrs)
+        start = time.time()
+        try:
+            yield
+        except Exception as ex:
+            self.emit("phase_end", phase=name, success=False, error=str(ex),
+                      duration=time.time() - start, **attrs)
+            raise
+        self.emit("phase_end", phase=name, success=True, duration=time.time() - start, **attrs)
+
+
+events = EventStream()
@@ -0,0 +1,182 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+import logging
+
+from constants import STATE_FILE
+from state import StateStore
+from stop import recordedProvider
+from plugin import ProviderFailedException
+from labels import appSelector
+from events import events
+from command import runner, CommandFailedException
+
+logger = logging.getLogger(__name__)
+
+HEALTHY = "healthy"
+UNHEALTHY = "unhealthy"
+MISSING = "missing"
+UNKNOWN = "unknown"
+
+
+def objectHealth(kind, item):
+    """(health, state) of a Kubernetes or OpenShift object as listed, None if not found."""
+    if item is None:
+        return MISSING, "not found"
+
+    status = item.get("status") or item.get("currentState") or {}
+    if kind == "pod":
+        phase = status.get("phase") or status.get("status")
+        return (HEALTHY if phase == "Running" else UNHEALTHY), phase or UNKNOWN
+
+    if kind in ("replicationcontroller", "rc"):
+        spec = item.get("spec") or item.get("desiredState") or {}
+        desired = spec.get("replicas") or 0
+        current = status.get("replicas") or 0
+        return (HEALTHY if current >= desired else UNHEALTHY), \
+            "%s/%s replicas" % (current, desired)
+
+    return HEALTHY, "exists"
+
+
+def combineHealth(healths):
+    """Health of a component or app from the health of its parts."""
+    healths = set(healths)
+    if not healths or healths == {MISSING}:
+        return MISSING
+    if healths == {HEALTHY}:
+        return HEALTHY
+    if healths <= {HEALTHY, UNKNOWN}:
+        return UNKNOWN
+    return UNHEALTHY
+
+
+class HealthCheck(object):
+    """
+    Health of a deployed app, checked for the objects recorded in its state.
+
+    Objects are looked up with one provider call per provider, target and
+    kind (f.e. "kubectl get pod" for the pods of the apps in a namespace)
+    instead of one per object, so checking stays cheap for large apps and for many
+    apps. See combineHealth for the health of components and of the app.
+    """
+
+    def __init__(self, workdir, config=None, dryrun=False, targets=None, context=None):
+        self.workdir = workdir
+        self.config = config or {}
+        self.dryrun = dryrun
+        self.targets = targets
+        self.context = context
+        self.instance = None
+
+    def _groups(self, objects):
+        groups = OrderedDict()
+        for obj in objects:
+            groups.setdefault((obj["provider"], obj["target"]), {}) \
+                .setdefault(obj["kind"], []).append(obj)
+        return groups
+
+    def _checkGroup(self, key, target, kinds):
+        provider = recordedProvider(self.context, key, target, self.config,
+                                    self.workdir, self.dryrun)
+        initialized = False
+        for kind, objects in kinds.iteritems():
+            try:
+                if not initialized:
+                    provider.init()
+                    initialized = True
+                # Labelled objects are listed for the apps only, not the whole target
+                selector = appSelector((obj["app_id"] for obj in objects), self.instance) \
+                    if provider.object_labels else None
+                states = provider.getObjectStates(kind, [obj["name"] for obj in objects],
+                                                  selector)
+            except (ProviderFailedException, CommandFailedException, ValueError) as ex:
+                # One unreachable target does not hide the state of the others
+                logger.error("Could not get %s objects from %s %s: %s", kind, key, target, ex)
+                states = dict((obj["name"], (UNKNOWN, str(ex))) for obj in objects)
+            for obj in objects:
+                obj["health"], obj["state"] = states.get(obj["name"], (UNKNOWN, UNKNOWN))
+
+    def check(self):
+        """Report with the health of every component and recorded object."""
+        with events.phase("status", workdir=self.workdir):
+            report = self._check()
+        events.emit("health", health=report["health"], components=report["components"])
+        return report
+
+    def _check(self):
+        objects = []
+        if os.path.isfile(os.path.join(self.workdir, STATE_FILE)):
+            state = StateStore.open(self.workdir)
+            try:
+                objects = [obj for obj in state.getObjects()
+                           if not self.targets or obj["target"] in self.targets]
+                self.instance = state.getInstance()
+            finally:
+                state.close()
+
+        groups = self._groups(objects)
+        if groups:
+            pool = ThreadPool(min(len(groups), runner.max_procs))
+            try:
+                pool.map(lambda item: self._checkGroup(item[0][0], item[0][1], item[1]),
+                         groups.items(), 1)
+            finally:
+                pool.close()
+                pool.join()
+
+        components = OrderedDict()
+        for obj in objects:
+            components.setdefault((obj["app_id"], obj["component"]), []).append(obj)
+
+        report = {"components": [], "objects": []}
+        for (app_id, component), component_objects in components.iteritems():
+            healths = [obj["health"] for obj in component_objects]
+            report["components"].append({
+                "app": app_id, "component": component, "health": combineHealth(healths),
+                "healthy": healths.count(HEALTHY), "objects": len(healths)})
+        report["health"] = combineHealth(
+            component["health"] for component in report["components"])
+
+        for obj in objects:
+            report["objects"].append(dict(
+                (name, obj[name]) for name in
+                ("app_id", "component", "provider", "target", "kind", "name", "health", "state")))
+
+        return report
+
+    @staticmethod
+    def formatReport(report):
+        lines = []
+        for component in report["components"]:
+            lines.append("%s/%s: %s (%s/%s objects healthy)" % (
+                component["app"], component["component"], component["health"],
+                component["healthy"], component["objects"]))
+            for obj in report["objects"]:
+                if (obj["app_id"], obj["component"]) == (component["app"], component["component"]):
+                    lines.append("    %s/%s in %s %s: %s (%s)" % (
+                        obj["kind"], obj["name"], obj["provider"], obj["target"],
+                        obj["health"], obj["state"]))
+        lines.append("App is %s" % report["health"])
+
+        return "\n".join(lines)
@@ -23,16 +23,29 @@ import distutils.dir_util
 import random
 import string
 import json
-import subprocess
 
 import logging
 
 from nulecule_base import Nulecule_Base
-from utils import Utils, printStatus, printAnswerFile
-from constants import APP_ENT_PATH, MAIN_FILE, ANSWERS_FILE_SAMPLE_FORMAT
+from utils import Utils, printStatus, printErrorStatus, printAnswerFile
+from constants import APP_ENT_PATH, MAIN_FILE, ANSWERS_FILE_SAMPLE_FORMAT, BUNDLE_FILE
+from lock import CacheLock
+from merge import merge
+from validator import ValidationError
+from schema import SchemaError, checkApp
+from resolver import Resolver
+from bundle import Bundle, isAppFile
+from archive import ImageArchive
+from registry import RegistryClient, RegistryImage
+from command import runner
+from tracing import tracer, traced
+from events import events
 
 logger = logging.getLogger(__name__)
 
+# Options telling where images come from, passed on to installs of external apps
+SOURCE_OPTIONS = ("archive_dir", "from_registry", "insecure_registries")
+
 
 class Install(object):
     dryrun = False
@@ -40,23 +53,47 @@ class Install(object):
     answers_file = None
     docker_cli = "docker"
     answers_file_values = {}
+    context = None
+    bundle = None
+    archive = None
+    archive_dir = None
+    from_registry = False
 
     def __init__(
             self, answers, APP, nodeps=False, update=False, target_path=None,
-            dryrun=False, answers_format=ANSWERS_FILE_SAMPLE_FORMAT, **kwargs):
+            dryrun=False, answers_format=ANSWERS_FILE_SAMPLE_FORMAT, context=None,
+            **kwargs):
         self.dryrun = dryrun
         self.kwargs = kwargs
+        self.context = context
+        self.archive_dir = kwargs.get("archive_dir")
+        self.from_registry = kwargs.get("from_registry")
 
         app = APP  # FIXME
 
+        docker_cli = context.docker_cli if context else None
         self.nulecule_base = Nulecule_Base(
-            nodeps, update, target_path, dryrun, answers_format)
-
-        if os.path.exists(app):
+            nodeps, update, target_path, dryrun, answers_format, docker_cli)
+        if context:
+            self.nulecule_base.mainfile_cache = context.getCache("mainfiles")
+            self.nulecule_base.validator_cache = context.getCache("validators")
+        else:
+            # Loading and checking the app still parse its Nulecule only once
+            self.nulecule_base.mainfile_cache = {}
+
+        if Bundle.isBundle(app):
+            logger.info("App bundle is %s, will be extracted to %s", app, target_path)
+            app = self._loadBundle(app)
+        elif ImageArchive.isArchive(app):
+            logger.info("Image archive is %s, will be populated to %s", app, target_path)
+            app = self._loadArchive(app)
+        elif os.path.exists(app):
             logger.info("App path is %s, will be populated to %s", app, target_path)
             app = self._loadApp(app)
         else:
             logger.info("App name is %s, will be populated to %s", app, target_path)
+            if self.archive_dir:
+                self.archive = ImageArchive.find(self.archive_dir, app, self._archiveCache())
 
         printStatus("Loading app %s ." % app)
         if not target_path:
@@ -70,7 +107,7 @@ class Install(object):
         self.nulecule_base.app = app
 
         self.answers_file = answers
-        self.docker_cli = Utils.getDockerCli(self.dryrun)
+        self.docker_cli = self.nulecule_base.docker_cli
 
     def _loadApp(self, app_path):
         self.nulecule_base.app_path = app_path
@@ -84,6 +121,34 @@ class Install(object):
 
         return app
 
+    def _loadBundle(self, path):
+        self.bundle = Bundle(path)
+        return os.environ["IMAGE"] if "IMAGE" in os.environ else self.bundle.app_id
+
+    def _loadArchive(self, path):
+        self.archive = ImageArchive(path)
+        if "IMAGE" in os.environ:
+            return os.environ["IMAGE"]
+        return self.archive.reference or os.path.basename(path)
+
+    def _loadRegistryImage(self):
+        image = self.nulecule_base.getImageURI(self.nulecule_base.app)
+        logger.info("Fetching %s from the registry", image)
+        client = RegistryClient(self.kwargs.get("insecure_registries"))
+        self.archive = RegistryImage(image, client)
+
+    def _archiveCache(self):
+        return self.context.getCache("archives") if self.context else None
+
+    @traced("extractArchive")
+    def _extractArchive(self):
+        printStatus("Extracting %s from %s ..." % (APP_ENT_PATH, self.archive.path))
+        self.archive.extract(self.utils.tmpdir)
+        if not os.path.isfile(os.path.join(self.utils.getTmpAppDir(), MAIN_FILE)):
+            raise Exception("Image %s in %s does not contain %s/%s"
+                            % (self.archive.reference, self.archive.path, APP_ENT_PATH, MAIN_FILE))
+
+    @traced("copyFromContainer")
     def _copyFromContainer(self, image):
         image = self.nulecule_base.getImageURI(image)
 
@@ -92,18 +157,26 @@ class Install(object):
         logger.debug("Creating a container with name %s", name)
 
         # Workaround docker bug BZ1252168 by using run instead of create
-        create = [self.docker_cli, "run", "--name", name, "--entrypoint", "/bin/true", image]
-        logger.debug(" ".join(create))
-        subprocess.call(create)
-        cp = [self.docker_cli, "cp", "%s:/%s" % (name, APP_ENT_PATH), self.utils.tmpdir]
-        logger.debug(cp)
-        if not subprocess.call(cp):
+        docker_cli = self.docker_cli or Utils.getDockerCli(self.dryrun)
+        create = [docker_cli, "run", "--name", name, "--entrypoint", "/bin/true", image]
+        try:
+            with CacheLock("image:%s" % image).reading():
+                runner.run(create)
+            cp = [docker_cli, "cp", "%s:/%s" % (name, APP_ENT_PATH), self.utils.tmpdir]
+            runner.run(cp)
             logger.debug("Application entity data copied to %s", self.utils.tmpdir)
+        finally:
+            rm = [docker_cli, "rm", name]
+            runner.run(rm, check=False)
 
         printStatus("Copied app successfully.")
-        rm = [self.docker_cli, "rm", name]
-        subprocess.call(rm)
 
+    @traced("installBundle")
+    def _installBundle(self):
+        if self.bundle.install(self.nulecule_base.target_path, self.nulecule_base.update):
+            printStatus("Installed %s." % self.bundle.path)
+
+    @traced("populateApp")
     def _populateApp(self, src=None, dst=None):
         logger.info("Copying app %s", self.utils.getComponentName(self.nulecule_base.app))
         if not src:
@@ -112,28 +185,56 @@ class Install(object):
         if not dst:
             dst = self.nulecule_base.target_path
         distutils.dir_util.copy_tree(src, dst, update=(not self.nulecule_base.update))
+        if os.path.isfile(os.path.join(dst, BUNDLE_FILE)):
+            # Files of an installed bundle would be read instead of the copied ones
+            os.remove(os.path.join(dst, BUNDLE_FILE))
+
+    def _sourceOptions(self):
+        return dict((name, self.kwargs.get(name)) for name in SOURCE_OPTIONS)
 
     def _fromImage(self):
+        if self.bundle:
+            return False
         return not self.nulecule_base.app_path or \
             self.nulecule_base.target_path == self.nulecule_base.app_path
 
     def install(self):
+        with tracer.span("install", app=self.nulecule_base.app), \
+                events.phase("install", app=self.nulecule_base.app):
+            try:
+                return self._install()
+            finally:
+                if self.bundle:
+                    # Everything needed was extracted, app_id stays readable
+                    self.bundle.close()
+
+    def _install(self):
         answerContent = self.nulecule_base.loadAnswers(self.answers_file)
         printAnswerFile(json.dumps(answerContent))
 
         mainfile_dir = self.nulecule_base.app_path
+        if self.from_registry and self._fromImage() and not self.archive:
+            self._loadRegistryImage()
+        if self.archive:
+            # Reading an archive or a registry has no side effects besides
+            # filling the blob cache, do it in dry-run too
+            self._extractArchive()
+            mainfile_dir = self.utils.getTmpAppDir()
+
         if not self.dryrun:
-            if self._fromImage():
+            if self._fromImage() and not self.archive:
                 self.nulecule_base.pullApp()
                 self._copyFromContainer(self.nulecule_base.app)
                 mainfile_dir = self.utils.getTmpAppDir()
 
             current_app_id = None
-            if os.path.isfile(self.nulecule_base.getMainfilePath()):
+            if isAppFile(self.nulecule_base.getMainfilePath()):
                 current_app_id = Utils.getAppId(self.nulecule_base.getMainfilePath())
                 printStatus("Loading app_id %s ." % current_app_id)
 
-            if current_app_id:
+            if current_app_id and self.bundle:
+                self.nulecule_base.app_id = self.bundle.app_id
+            elif current_app_id:
                 tmp_mainfile_path = os.path.join(mainfile_dir, MAIN_FILE)
                 self.nulecule_base.loadMainfile(tmp_mainfile_path)
                 logger.debug("%s path for pulled image: %s", MAIN_FILE, tmp_mainfile_path)
@@ -142,13 +243,17 @@ class Install(object):
                            "app %s - clear or change current directory."
                            % (current_app_id, self.nulecule_base.app_id))
                     raise Exception(msg)
-        elif self._fromImage():
+        elif self._fromImage() and not self.archive:
             logger.warning("Using DRY-RUN together with install from image "
                            "may result in unexpected behaviour")
 
-        if self.nulecule_base.update or \
-            (not self.dryrun
-             and not os.path.exists(self.nulecule_base.getMainfilePath())):
+        if self.bundle:
+            # Installed in dry-run too, there is no other copy of the app to
+            # run from - an installed app is kept unless updating
+            self._installBundle()
+        elif self.nulecule_base.update or \
+            ((not self.dryrun or self.archive)
+             and not isAppFile(self.nulecule_base.getMainfilePath())):
             if self._fromImage():
                 self._populateApp()
             else:
@@ -157,6 +262,14 @@ class Install(object):
                 self._populateApp(src=self.nulecule_base.app_path)
 
         mainfile_path = os.path.join(self.nulecule_base.target_path, MAIN_FILE)
+        if isAppFile(mainfile_path):
+            # Dependencies are checked when they are installed below, or by the run
+            errors = checkApp(self.nulecule_base.target_path,
+                              cache=self.nulecule_base.mainfile_cache, recursive=False)
+            if errors:
+                for error in errors:
+                    printErrorStatus(error)
+                raise SchemaError(errors)
         if not self.nulecule_base.mainfile_data:
             self.nulecule_base.loadMainfile(mainfile_path)
 
@@ -165,6 +278,16 @@ class Install(object):
         self.nulecule_base.checkSpecVersion()
         printStatus("Checking all artifacts")
         self.nulecule_base.checkAllArtifacts()
+        if self.context:
+            self.context.markChecked(self.nulecule_base.target_path)
+
+        # Fail on bad values before pulling any dependencies
+        if not self.context or self.context.needsValidation(self.nulecule_base.target_path):
+            violations = self.nulecule_base.validate()
+            if violations:
+                for violation in violations:
+                    printErrorStatus(violation)
+                raise ValidationError(violations)
 
         printStatus("Loading Nulecule file.")
         if not self.nulecule_base.nodeps:
@@ -184,14 +307,15 @@ class Install(object):
 
     def _installDependencies(self):
         values = {}
+        resolver = Resolver(self.nulecule_base, skip_asking=True)
+        resolver.writeAnswers()
         for graph_item in self.nulecule_base.mainfile_data["graph"]:
             component = graph_item.get("name")
             if not component:
                 raise ValueError("Component name missing in graph")
 
             if not self.utils.isExternal(graph_item):
-                values[component] = self.nulecule_base.getValues(
-                    component, skip_asking=True)
+                values[component] = dict(resolver.getValues(component))
                 logger.debug("Component %s is part of the app", component)
                 logger.debug("Values: %s", values)
                 continue
@@ -202,14 +326,17 @@ class Install(object):
             component_path = self.utils.getExternalAppDir(component)
             mainfile_component_path = os.path.join(component_path, MAIN_FILE)
             logger.debug("Component path: %s", component_path)
-            if not os.path.isfile(mainfile_component_path) or self.nulecule_base.update:
+            # External apps packed into a bundle are installed with it
+            if not isAppFile(mainfile_component_path) or \
+                    (self.nulecule_base.update and not self.bundle):
                 printStatus("Pulling %s ..." % image_name)
                 component_app = Install(
                     self.nulecule_base.answers_data,
                     image_name, self.nulecule_base.nodeps,
-                    self.nulecule_base.update, component_path, self.dryrun)
+                    self.nulecule_base.update, component_path, self.dryrun,
+                    context=self.context, **self._sourceOptions())
                 component_app.install()
-                values = Utils.update(values, component_app.answers_file_values)
+                values = merge(values, component_app.answers_file_values)
                 printStatus("Component %s installed successfully." % component)
                 logger.debug("Component installed into %s", component_path)
             else:
@@ -0,0 +1,138 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import re
+import hashlib
+
+import anymarkup
+import logging
+
+logger = logging.getLogger(__name__)
+
+LABEL_APP = "io.projectatomic.nulecule/app"
+LABEL_COMPONENT = "io.projectatomic.nulecule/component"
+LABEL_RUN = "io.projectatomic.nulecule/run"
+LABEL_INSTANCE = "io.projectatomic.nulecule/instance"
+ARTIFACT_FORMATS = {".json": "json", ".yaml": "yaml", ".yml": "yaml"}
+
+
+def labelValue(value):
+    """value made a valid label value: 63 characters of [a-zA-Z0-9-_.]"""
+    value = re.sub(r"[^a-zA-Z0-9_.-]", "-", value)[:63]
+    return value.strip("-_.")
+
+
+def instanceId(workdir):
+    """
+    Id of the deployment made from workdir, the same app deployed from
+    another working directory to the same target is another instance.
+    """
+    return hashlib.sha1(os.path.realpath(workdir)).hexdigest()[:16]
+
+
+def objectLabels(app_id, component, run_id=None, instance=None):
+    labels = {LABEL_APP: labelValue(app_id), LABEL_COMPONENT: labelValue(component)}
+    if run_id:
+        labels[LABEL_RUN] = run_id
+    if instance:
+        labels[LABEL_INSTANCE] = instance
+    return labels
+
+
+def selector(labels):
+    """Label selector matching the app, component and instance of labels, never the run."""
+    return ",".join("%s=%s" % (name, labels[name])
+                    for name in (LABEL_APP, LABEL_COMPONENT, LABEL_INSTANCE) if name in labels)
+
+
+def componentSelector(app_id, component, instance=None):
+    return selector(objectLabels(app_id, component, instance=instance))
+
+
+def appSelector(app_ids, instance=None):
+    values = sorted(set(labelValue(app_id) for app_id in app_ids))
+    if len(values) == 1:
+        result = "%s=%s" % (LABEL_APP, values[0])
+    else:
+        result = "%s in (%s)" % (LABEL_APP, ",".join(values))
+    if instance:
+        result += ",%s=%s" % (LABEL_INSTANCE, instance)
+    return result
+
+
+def _addLabels(container, labels):
+    container["labels"] = dict(container.get("labels") or {}, **labels)
+
+
+def injectLabels(obj, labels):
+    """
+    Add labels to a Kubernetes or OpenShift object, to all objects of a
+    List or Template and to the pod templates of controllers, so that the
+    pods they create can be selected too. The run label is left out of pod
+    templates, a controller without a selector selects by their labels.
+    Returns whether there was anything to label.
+    """
+    if not isinstance(obj, dict) or "kind" not in obj:
+        return False
+
+    kind = obj["kind"].lower()
+    if kind == "list":
+        labelled = [injectLabels(item, labels) for item in obj.get("items") or []]
+        return any(labelled)
+    if kind == "template":
+        # Applied to every object when the template is processed
+        _addLabels(obj, labels)
+        for item in obj.get("objects") or []:
+            injectLabels(item, labels)
+        return True
+
+    if "metadata" in obj or "id" not in obj:
+        _addLabels(obj.setdefault("metadata", {}), labels)
+    else:
+        # v1beta1 and v1beta2 keep labels next to the id
+        _addLabels(obj, labels)
+
+    template_labels = dict((name, value) for name, value in labels.iteritems()
+                           if name != LABEL_RUN)
+    template = (obj.get("spec") or {}).get("template")
+    if isinstance(template, dict):
+        _addLabels(template.setdefault("metadata", {}), template_labels)
+    template = (obj.get("desiredState") or {}).get("podTemplate")
+    if isinstance(template, dict):
+        _addLabels(template, template_labels)
+    return True
+
+
+def labelArtifact(data, path, labels):
+    """Rendered artifact data with labels added to its objects."""
+    artifact_format = ARTIFACT_FORMATS.get(os.path.splitext(path)[1].lower())
+    if not artifact_format:
+        logger.debug("Not labelling %s, unknown format", path)
+        return data
+
+    try:
+        obj = anymarkup.parse(data, format=artifact_format, force_types=None)
+    except anymarkup.AnyMarkupError as ex:
+        logger.warning("Not labelling %s, could not parse it: %s", path, ex)
+        return data
+    # Artifacts without objects to label are kept as they were written
+    if not injectLabels(obj, labels):
+        return data
+    return anymarkup.serialize(obj, artifact_format)
@@ -0,0 +1,140 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import errno
+import fcntl
+import hashlib
+import time
+from contextlib import contextmanager
+
+import logging
+from lockfile import AlreadyLocked, LockFile, LockTimeout
+
+from constants import LOCK_DIR
+from utils import Utils
+
+logger = logging.getLogger(__name__)
+
+
+def _lockPath(scope, key):
+    lock_dir = os.path.join(Utils.getRoot(), LOCK_DIR.lstrip("/"), scope)
+    if not os.path.isdir(lock_dir):
+        try:
+            os.makedirs(lock_dir)
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+
+    return os.path.join(lock_dir, hashlib.sha1(key.encode("utf-8")).hexdigest())
+
+
+class AppLock(object):
+    """
+    Exclusive lock on a single application directory. Independent apps
+    get independent locks so they can be installed and run concurrently.
+
+    timeout: 0 fails immediately if the app is locked, a positive value
+    waits up to that many seconds and a negative value waits forever. The
+    AlreadyLocked or LockTimeout raised has the app path in "locked".
+    """
+
+    def __init__(self, app_path, timeout=0):
+        self.app_path = os.path.realpath(app_path)
+        self.timeout = timeout
+        self.lock = LockFile(_lockPath("apps", self.app_path))
+
+    def acquire(self):
+        logger.debug("Locking %s", self.app_path)
+        timeout = self.timeout
+        if timeout == 0:
+            timeout = -1
+        elif timeout < 0:
+            timeout = None
+        try:
+            self.lock.acquire(timeout=timeout)
+        except (AlreadyLocked, LockTimeout) as ex:
+            ex.locked = self.app_path
+            raise
+
+    def release(self):
+        if self.lock.i_am_locking():
+            logger.debug("Unlocking %s", self.app_path)
+            self.lock.release()
+
+
+class CacheLock(object):
+    """
+    Reader/writer lock on an entry of a cache shared by all apps on the
+    host (pulled images, downloaded blobs). Any number of readers may
+    hold it at once, a writer holds it alone.
+
+    Unlike AppLock this always waits - holders only keep it for a single
+    pull or copy. A positive timeout bounds the wait, the LockTimeout has
+    the name of the entry in "locked".
+    """
+
+    def __init__(self, name, timeout=None):
+        self.name = name
+        self.timeout = timeout
+        self.path = _lockPath("cache", name)
+        self.fd = None
+
+    def acquire(self, exclusive=False):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        operation = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        end_time = None
+        if self.timeout and self.timeout > 0:
+            end_time = time.time() + self.timeout
+
+        while True:
+            try:
+                fcntl.flock(self.fd, operation | fcntl.LOCK_NB)
+                return
+            except IOError as ex:
+                if ex.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+            if end_time and time.time() > end_time:
+                self.release()
+                ex = LockTimeout("Timeout waiting to acquire lock for %s" % self.name)
+                ex.locked = self.name
+                raise ex
+            time.sleep(0.1)
+
+    def release(self):
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+
+    @contextmanager
+    def reading(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    @contextmanager
+    def writing(self):
+        self.acquire(exclusive=True)
+        try:
+            yield
+        finally:
+            self.release()
@@ -0,0 +1,111 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import collections
+
+MERGE_KEY = "name"
+
+
+def merge(base, overlay, key=MERGE_KEY):
+    """
+    Return base with overlay merged into it, without modifying either.
+
+    Mappings are merged recursively, the overlay wins for everything else.
+    Lists of mappings which all carry the key (e.g. Nulecule params by
+    "name") are merged item by item, keeping the order of base and adding
+    new items in the order of overlay. Other lists are concatenated with
+    duplicates dropped, first occurrence wins. Only containers on the path
+    of a change are copied, everything else is shared with the inputs, so
+    the result must be treated as read-only - merge it again to change it.
+    """
+    if base is None:
+        return overlay
+
+    if isinstance(base, collections.Mapping) and isinstance(overlay, collections.Mapping):
+        return _mergeDicts(base, overlay, key)
+
+    if isinstance(base, list) and isinstance(overlay, list):
+        if _isKeyed(base, key) and _isKeyed(overlay, key):
+            return _mergeKeyed(base, overlay, key)
+        return dedupe(base + overlay)
+
+    return overlay
+
+
+def _mergeDicts(base, overlay, key):
+    if not overlay:
+        return base
+
+    result = dict(base)
+    for name, value in overlay.iteritems():
+        if name in result:
+            value = merge(result[name], value, key)
+        result[name] = value
+
+    return result
+
+
+def _isKeyed(items, key):
+    return all(isinstance(item, collections.Mapping) and key in item for item in items)
+
+
+def _mergeKeyed(base, overlay, key):
+    if not overlay:
+        return base
+
+    result = list(base)
+    index = {}
+    for position, item in enumerate(result):
+        index[_freeze(item[key])] = position
+
+    for item in overlay:
+        item_key = _freeze(item[key])
+        if item_key in index:
+            position = index[item_key]
+            result[position] = merge(result[position], item, key)
+        else:
+            index[item_key] = len(result)
+            result.append(item)
+
+    return result
+
+
+def dedupe(items):
+    """Return items without duplicates, keeping the first occurrence."""
+    seen = set()
+    result = []
+    for item in items:
+        frozen = _freeze(item)
+        if frozen not in seen:
+            seen.add(frozen)
+            result.append(item)
+
+    return result
+
+
+def _freeze(value):
+    """Hashable representation of (nested) dicts and lists for comparison."""
+    if isinstance(value, collections.Mapping):
+        return (dict, frozenset((name, _freeze(item)) for name, item in value.iteritems()))
+    if isinstance(value, (list, tuple)):
+        return (list, tuple(_freeze(item) for item in value))
+    if isinstance(value, (set, frozenset)):
+        return (set, frozenset(_freeze(item) for item in value))
+
+    return value
@@ -21,13 +21,19 @@ import anymarkup
 import os
 import logging
 import copy
-import subprocess
 
 from constants import MAIN_FILE, GLOBAL_CONF, DEFAULT_PROVIDER, PARAMS_KEY, \
     ANSWERS_FILE, DEFAULT_ANSWERS, ANSWERS_FILE_SAMPLE, \
     __NULECULESPECVERSION__, ANSWERS_FILE_SAMPLE_FORMAT
 
 from utils import Utils, printStatus, printErrorStatus
+from lock import CacheLock
+from merge import merge
+from validator import Validator
+from resolver import Resolver, MissingValuesError
+from command import runner, CommandFailedException
+from tracing import traced
+from bundle import isAppFile, readAppFile, appFileKey
 
 logger = logging.getLogger(__name__)
 
@@ -46,6 +52,12 @@ class Nulecule_Base(object):
     write_sample_answers = False
     docker_cli = None
     answer_file_format = ANSWERS_FILE_SAMPLE_FORMAT
+    mainfile_cache = None
+    mainfile_path = None
+    validator_cache = None
+    resolver = None
+    # Without it nothing is asked for, params without a value are an error
+    interactive = True
 
     @property
     def app(self):
@@ -79,13 +91,13 @@ class Nulecule_Base(object):
 
     def __init__(
             self, nodeps=False, update=False, target_path=None,
-            dryrun=False, file_format=ANSWERS_FILE_SAMPLE_FORMAT):
+            dryrun=False, file_format=ANSWERS_FILE_SAMPLE_FORMAT, docker_cli=None):
         self.target_path = target_path
         self.nodeps = Utils.isTrue(nodeps)
         self.update = Utils.isTrue(update)
         self.override = Utils.isTrue(False)
         self.dryrun = dryrun
-        self.docker_cli = Utils.getDockerCli(dryrun)
+        self.docker_cli = docker_cli or Utils.getDockerCli(dryrun, required=False)
         self.answer_file_format = file_format
 
     def loadParams(self, data=None):
@@ -105,18 +117,21 @@ class Nulecule_Base(object):
         else:
             logger.debug("Params in separate file")
 
+        self.resolver = None
         if self.params_data:
-            self.params_data = Utils.update(self.params_data, data)
+            self.params_data = merge(self.params_data, data)
         else:
             self.params_data = data
 
         return self.params_data
 
     def loadMainfile(self, path=None):
-        if not os.path.exists(path):
+        if not isAppFile(path):
             raise Exception("%s not found: %s" % (MAIN_FILE, path))
 
-        self.mainfile_data = anymarkup.parse_file(path)
+        self.mainfile_data = self._parseMainfile(path)
+        self.resolver = None
+        self.mainfile_path = path
         if "id" in self.mainfile_data:
             self.app_id = self.mainfile_data["id"]
             logger.debug("Setting app id to %s", self.mainfile_data["id"])
@@ -129,6 +144,20 @@ class Nulecule_Base(object):
 
         return self.mainfile_data
 
+    def _parseMainfile(self, path):
+        if self.mainfile_cache is None:
+            return anymarkup.parse(readAppFile(path))
+
+        # Keyed by its content so an app updated on disk is parsed again
+        key = appFileKey(path)
+        data = self.mainfile_cache.get(key)
+        if data is None:
+            data = self.mainfile_cache[key] = anymarkup.parse(readAppFile(path))
+        else:
+            logger.debug("Using cached %s for %s", MAIN_FILE, path)
+
+        return copy.deepcopy(data)
+
     def loadAnswers(self, data=None):
         if not data:
             logger.info("No answers data given")
@@ -151,8 +180,9 @@ class Nulecule_Base(object):
         if self.write_sample_answers:
             data = copy.deepcopy(DEFAULT_ANSWERS)
 
+        self.resolver = None
         if self.answers_data:
-            self.answers_data = Utils.update(self.answers_data, data)
+            self.answers_data = merge(self.answers_data, data)
         else:
             self.answers_data = data
 
@@ -171,28 +201,61 @@ class Nulecule_Base(object):
         params = self.get(component, not skip_asking)
 
         values = self._getComponentValues(params, skip_asking)
-        for n, p in values.iteritems():
-            self._updateAnswers(component, n, p)
+        self._updateAnswers(component, values)
         return values
 
+    def getResolver(self):
+        """
+        Resolver with the values of all components, resolved (and recorded
+        in the answers) once until params or answers are loaded again.
+        When not interactive, params without a value raise a
+        MissingValuesError listing all of them instead of being asked for.
+        """
+        if self.resolver is None:
+            if self.interactive:
+                resolver = Resolver(self)
+            else:
+                resolver = Resolver(self, skip_asking=True, global_base=True)
+                missing = resolver.getMissing()
+                if missing:
+                    raise MissingValuesError(self.app_id, missing)
+            self.resolver = resolver
+            self.resolver.writeAnswers()
+        return self.resolver
+
     def _mergeParamsComponent(self, component=GLOBAL_CONF, global_base=True):
         component_config = self._mergeParamsComponent(
         ) if not component == GLOBAL_CONF and global_base else {}
         if component == GLOBAL_CONF:
             if self.mainfile_data and PARAMS_KEY in self.mainfile_data:
-                component_config = Utils.update(
-                    component_config, self.mainfile_data[PARAMS_KEY])
+                component_config = merge(
+                    component_config, self.fromListToDict(self.mainfile_data[PARAMS_KEY]))
         else:
             graph_item = self.getComponent(component)
             if graph_item and PARAMS_KEY in graph_item:
                 config = self.fromListToDict(graph_item[PARAMS_KEY])
-                component_config = Utils.update(component_config, config)
+                component_config = merge(component_config, config)
 
         if component in self.answers_data:
             tmp_clean_answers = self._cleanNullValues(self.answers_data[component])
-            component_config = Utils.update(component_config, tmp_clean_answers)
+            component_config = merge(component_config, tmp_clean_answers)
         return component_config
 
+    def validate(self):
+        """
+        Check the values resolved from params and answers for every
+        component of this app against the constraints of the params,
+        return the list of violations.
+        """
+        validator = Validator.load(self.mainfile_path, self.mainfile_data, self.validator_cache)
+        resolver = Resolver(self, skip_asking=True, global_base=True)
+
+        violations = []
+        for component, values in sorted(resolver.values.iteritems()):
+            violations += validator.validate(component, values)
+
+        return violations
+
     def _getValue(self, param, name, skip_asking=False):
         value = None
 
@@ -227,20 +290,25 @@ class Nulecule_Base(object):
 
         return result
 
-    def _updateAnswers(self, component, param, value):
-        if component not in self.answers_data:
-            self.answers_data[component] = {}
-
-        if component != GLOBAL_CONF and param in self.answers_data[GLOBAL_CONF] \
-                and value == self.answers_data[GLOBAL_CONF][param]:
-            logger.debug(
-                "Param %s already in %s with value %s", param, GLOBAL_CONF, value)
+    def _updateAnswers(self, component, values):
+        if not values:
             return
 
-        if param not in self.answers_data[component]:
-            self.answers_data[component][param] = None
+        global_answers = self.answers_data.get(GLOBAL_CONF, {})
+        component_answers = dict(self.answers_data.get(component, {}))
+        for param, value in values.iteritems():
+            if component != GLOBAL_CONF and param in global_answers \
+                    and value == global_answers[param]:
+                logger.debug(
+                    "Param %s already in %s with value %s", param, GLOBAL_CONF, value)
+                continue
+            component_answers[param] = value
 
-        self.answers_data[component][param] = value
+        # Values replace the previous answers instead of being merged into
+        # them, answers_data itself may be shared and is never modified
+        answers_data = dict(self.answers_data)
+        answers_data[component] = component_answers
+        self.answers_data = answers_data
 
     def writeAnswers(self, path):
         logger.debug("writing %s to %s with format %s",
@@ -286,7 +354,7 @@ class Nulecule_Base(object):
                     self._checkInherit(component, artifact["inherit"], checked_providers)
                     continue
                 path = os.path.join(self.target_path, Utils.sanitizePath(artifact))
-                if os.path.isfile(path):
+                if isAppFile(path):
                     printStatus("Artifact %s: OK." % (artifact))
                 else:
                     printErrorStatus("Missing artifact %s." % (artifact))
@@ -295,6 +363,7 @@ class Nulecule_Base(object):
 
         return checked_providers
 
+    @traced("checkAllArtifacts")
     def checkAllArtifacts(self):
         for graph_item in self.mainfile_data["graph"]:
             component = graph_item.get("name")
@@ -340,6 +409,7 @@ class Nulecule_Base(object):
 
         return image
 
+    @traced("pullApp")
     def pullApp(self, image=None, update=None):
         if not image:
             image = self.app
@@ -347,21 +417,25 @@ class Nulecule_Base(object):
             update = self.update
 
         image = self.getImageURI(image)
-        if not update:
-            check_cmd = ["docker", "images", "-q", image]
-            image_id = subprocess.check_output(check_cmd)
-            logger.debug("Output of docker images cmd: %s", image_id)
-            if len(image_id) != 0:
-                logger.debug(
-                    "Image %s already present with id %s. Use --update to re-pull.",
-                    image, image_id.strip())
-                return
-
-        pull = ["docker", "pull", image]
-        printStatus("Pulling image %s ..." % image)
-        if subprocess.call(pull) != 0:
-            printErrorStatus("Couldn't pull %s." % image)
-            raise Exception("Couldn't pull %s" % image)
+        # Other apps on this host may be pulling or reading the same image
+        with CacheLock("image:%s" % image).writing():
+            if not update:
+                check_cmd = ["docker", "images", "-q", image]
+                image_id = runner.run(check_cmd).stdout
+                logger.debug("Output of docker images cmd: %s", image_id)
+                if len(image_id) != 0:
+                    logger.debug(
+                        "Image %s already present with id %s. Use --update to re-pull.",
+                        image, image_id.strip())
+                    return
+
+            pull = ["docker", "pull", image]
+            printStatus("Pulling image %s ..." % image)
+            try:
+                runner.run(pull, capture=False)
+            except CommandFailedException:
+                printErrorStatus("Couldn't pull %s." % image)
+                raise Exception("Couldn't pull %s" % image)
 
     def fromListToDict(self, llist):
         result = {}
@@ -0,0 +1,180 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import threading
+
+import logging
+
+from constants import __ATOMICAPPVERSION__
+from plugin import Plugin
+from utils import Utils, printStatus
+from engine import Graph, runTask
+from state import StateStore, ComponentState, contentHash
+from events import events
+
+logger = logging.getLogger(__name__)
+
+PLAN_VERSION = 1
+
+
+class Plan(object):
+    """
+    Serializable execution plan of a run.
+
+    A plan is a list of steps, one per provider call, in the order a run
+    would make them. Each step holds the provider, its resolved config and
+    the rendered artifacts with their content hashes, so applying it needs
+    neither the Nulecule nor the answers. Steps list the ids of the steps
+    they depend on in "depends_on", taken from the graph like a run does
+    (see Run._addDependencies): components of an app depend on its external
+    apps, or the other way round when undeploying, and each target of a
+    fan-out is a step of its own. Steps are applied concurrently once the
+    steps they depend on are done. "instance" is the instance label of the
+    rendered objects, recorded in the state of the working directory the
+    plan is applied in so stop and status select them.
+    """
+
+    def __init__(self, data=None):
+        if data is None:
+            data = {"version": PLAN_VERSION, "atomicappversion": __ATOMICAPPVERSION__,
+                    "steps": []}
+        self.data = data
+        # Plans are shared through the run context, keep adding steps thread-safe
+        self.lock = threading.Lock()
+
+    @property
+    def steps(self):
+        return self.data["steps"]
+
+    def addStep(self, app_id, component, provider, action, depends_on=None):
+        """Add a step calling provider, returns its id."""
+        artifacts = []
+        for artifact in provider.artifacts:
+            with open(os.path.join(provider.path, artifact), "r") as fp:
+                content = fp.read()
+            artifacts.append(
+                {"path": artifact, "sha256": contentHash(content), "content": content})
+
+        with self.lock:
+            step_id = len(self.steps)
+            self.steps.append({
+                "id": step_id,
+                "app": app_id,
+                "component": component,
+                "provider": provider.key,
+                "action": action,
+                "config": dict(provider.config),
+                "artifacts": artifacts,
+                "depends_on": sorted(depends_on or [])
+            })
+        return step_id
+
+    def dump(self, fp):
+        json.dump(self.data, fp, indent=2, sort_keys=True, separators=(",", ": "))
+        fp.write("\n")
+
+    def write(self, path):
+        with open(path, "w") as fp:
+            self.dump(fp)
+        logger.info("Plan with %s steps written to %s", len(self.steps), path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as fp:
+            data = json.load(fp)
+
+        if data.get("version") != PLAN_VERSION:
+            raise ValueError("Unsupported plan version %s in %s, expected %s"
+                             % (data.get("version"), path, PLAN_VERSION))
+        return cls(data)
+
+    def apply(self, workdir, dryrun=False, plugin=None):
+        """Write the artifacts of every step and call its provider."""
+        if not plugin:
+            plugin = Plugin()
+            plugin.load_plugins()
+
+        # Deployed objects are recorded like in a run, for stop and status
+        state = run_id = None
+        if not dryrun:
+            state = StateStore.open(workdir)
+            if self.data.get("instance"):
+                state.setInstance(self.data["instance"])
+            run_id = state.startRun(self.steps[0]["app"] if self.steps else "", "apply")
+
+        try:
+            with events.phase("apply", workdir=workdir, steps=len(self.steps)):
+                self._applySteps(workdir, dryrun, plugin, state, run_id)
+        except Exception:
+            if state:
+                state.finishRun(run_id, "failed")
+            raise
+        else:
+            if state:
+                state.finishRun(run_id, "success")
+        finally:
+            if state:
+                state.close()
+
+    def _applySteps(self, workdir, dryrun, plugin, state, run_id):
+        indexes = dict((step["id"], index) for index, step in enumerate(self.steps))
+        tasks = []
+        depends_on = []
+        for step in self.steps:
+            unknown = [dep for dep in step["depends_on"] if dep not in indexes]
+            if unknown:
+                raise ValueError("Step %s depends on unknown steps %s" % (step["id"], unknown))
+            depends_on.append([indexes[dep] for dep in step["depends_on"]])
+            provider = self._stepProvider(step, workdir, dryrun, plugin)
+            if state:
+                provider.state = ComponentState(state, step["app"], step["component"], run_id)
+            tasks.append(self._stepTask(step, provider))
+
+        # Raises for cycles before any step is applied
+        runTask(Graph(tasks, depends_on))
+
+    def _stepProvider(self, step, workdir, dryrun, plugin):
+        """Provider of step with the artifacts of the step written and checked."""
+        provider_class = plugin.getProvider(step["provider"])
+        if not provider_class:
+            raise Exception("Provider %s is not available" % step["provider"])
+
+        path = os.path.join(
+            workdir, "%s-%s" % (step["id"], Utils.sanitizeName(step["component"])))
+        provider = provider_class(step["config"], path, dryrun)
+        provider.artifacts = []
+        for artifact in step["artifacts"]:
+            content = artifact["content"].encode("utf-8")
+            if contentHash(content) != artifact["sha256"]:
+                raise ValueError("Content of %s in step %s does not match its hash"
+                                 % (artifact["path"], step["id"]))
+            provider.saveArtifact(os.path.join(path, artifact["path"]), content)
+            provider.artifacts.append(artifact["path"])
+        return provider
+
+    def _stepTask(self, step, provider):
+        printStatus("%s component %s ..." % (
+            "Deploying" if step["action"] == "deploy" else "Undeploying", step["component"]))
+        yield provider.initAsync()
+        if step["action"] == "undeploy":
+            yield provider.undeployAsync()
+        else:
+            yield provider.deployAsync()
@@ -21,8 +21,14 @@
 
 from __future__ import print_function
 import os
+import errno
 
 import imp
+import anymarkup
+
+from labels import labelArtifact
+from bundle import readAppFile, appFileKey
+from engine import Call
 
 import logging
 
@@ -31,11 +37,21 @@ logger = logging.getLogger(__name__)
 
 class Provider(object):
     key = None
+    # Config option selecting where the provider deploys to (e.g. a
+    # namespace), None if the provider can't deploy to several targets
+    target_key = None
 
     config = None
     path = None
     dryrun = None
     container = False
+    artifact_cache = None
+    # ComponentState deployed objects are recorded in, None to not record
+    state = None
+    # Whether the objects of the provider carry labels (see atomicapp.labels)
+    # and the labels saveArtifact adds to them
+    object_labels = False
+    labels = None
     __artifacts = None
 
     @property
@@ -64,15 +80,125 @@ class Provider(object):
             "Call to undeploy for provider %s failed - this action is not implemented",
             self.key)
 
+    # init, deploy and undeploy as tasks of atomicapp.engine.Engine, so the
+    # commands of several providers run concurrently from one thread.
+    # Providers only implementing the synchronous methods run them in a
+    # worker thread, native ones yield the commands to run instead.
+
+    def initAsync(self):
+        yield Call(self.init)
+
+    def deployAsync(self):
+        yield Call(self.deploy)
+
+    def undeployAsync(self):
+        yield Call(self.undeploy)
+
+    def deleteObjects(self, objects):
+        """
+        Delete objects recorded in the state, dicts with "kind" and "name",
+        in the given order and with as few calls as possible.
+        """
+        raise NotImplementedError()
+
+    def deleteSelected(self, kinds, selector, objects=()):
+        """
+        Delete all objects of kinds matching the label selector, one call per
+        kind. objects are the recorded ones among them, replication
+        controllers are scaled down first so their pods go with them.
+        """
+        raise NotImplementedError()
+
+    def getObjectStates(self, kind, names, selector=None):
+        """
+        Dict of name -> (health, state) of the named objects of kind, looked
+        up with a single call, limited to objects matching the label selector
+        if given. See atomicapp.health for the health values.
+        """
+        raise NotImplementedError()
+
+    def getTarget(self):
+        """Where the provider deploys to, recorded with the deployed objects."""
+        if self.target_key:
+            return self.config.get(self.target_key)
+        return None
+
+    def describeArtifact(self, path):
+        """List of (kind, name) of the objects the rendered artifact creates."""
+        data = anymarkup.parse_file(path, force_types=None)
+        items = data.get("items") if data.get("kind") == "List" else [data]
+        objects = []
+        for item in items or []:
+            if "kind" not in item:
+                continue
+            name = (item.get("metadata") or {}).get("name") or item.get("id")
+            objects.append((item["kind"].lower(), name or os.path.basename(path)))
+
+        return objects
+
+    def recordObjects(self, path, started=None):
+        """Record the objects created from the artifact at path in the state."""
+        if self.state is None:
+            return
+        for kind, name in self.describeArtifact(path):
+            self.state.record(self, kind, name, path, started)
+        self.state.checkpoint(self, path)
+
+    def isDeployed(self, path):
+        """Whether the run being resumed already deployed the artifact at path."""
+        return self.state is not None and self.state.isDeployed(self, path)
+
+    def resumeArtifact(self, path):
+        """
+        Skip the artifact at path if the run being resumed deployed it, it is
+        then checkpointed for this run too. Returns whether to skip it.
+        """
+        if not self.isDeployed(path):
+            return False
+        logger.info("Skipping %s, it was deployed before resuming", path)
+        self.state.checkpoint(self, path)
+        return True
+
+    def forgetObjects(self, path):
+        """Remove the objects of the artifact at path from the state."""
+        if self.state is None:
+            return
+        for kind, name in self.describeArtifact(path):
+            self.state.remove(self, kind, name)
+
+    def forgetAllObjects(self):
+        """Remove the objects of the component in the target from the state."""
+        if self.state is None:
+            return
+        for obj in self.state.getObjects(self):
+            if obj["target"] == (self.getTarget() or ""):
+                self.state.remove(self, obj["kind"], obj["name"])
+
     def loadArtifact(self, path):
-        with open(path, "r") as fp:
-            data = fp.read()
+        if self.artifact_cache is None:
+            return self._readArtifact(path)
+
+        # Artifact sources are shared by every run of the same app in this process
+        key = appFileKey(path)
+        data = self.artifact_cache.get(key)
+        if data is None:
+            data = self.artifact_cache[key] = self._readArtifact(path)
 
         return data
 
+    def _readArtifact(self, path):
+        return readAppFile(path)
+
     def saveArtifact(self, path, data):
+        if self.object_labels and self.labels:
+            data = labelArtifact(data, path, self.labels)
         if not os.path.isdir(os.path.dirname(path)):
-            os.makedirs(os.path.dirname(path))
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError as ex:
+                # Render processes create the directories they share concurrently
+                if ex.errno != errno.EEXIST:
+                    raise
         with open(path, "w") as fp:
             logger.debug("Writing artifact to %s" % path)
             fp.write(data)
@@ -18,8 +18,12 @@
 """
 
 from atomicapp.plugin import Provider, ProviderFailedException
+from atomicapp.command import runner, CommandFailedException
+from atomicapp.engine import Command, runTask
+from atomicapp.health import HEALTHY, UNHEALTHY, MISSING
 import os
-import subprocess
+import json
+import time
 
 import logging
 
@@ -30,11 +34,13 @@ class DockerProvider(Provider):
     key = "docker"
 
     def init(self):
+        runTask(self.initAsync())
 
+    def initAsync(self):
         cmd_check = ["docker", "version"]
         try:
-            docker_version = subprocess.check_output(cmd_check).split("\n")
-        except Exception as ex:
+            docker_version = (yield Command(cmd_check)).stdout.split("\n")
+        except CommandFailedException as ex:
             raise ProviderFailedException(ex)
 
         client = ""
@@ -51,15 +57,55 @@ class DockerProvider(Provider):
             raise ProviderFailedException(msg)
 
     def deploy(self):
+        runTask(self.deployAsync())
+
+    def deployAsync(self):
         for artifact in self.artifacts:
             artifact_path = os.path.join(self.path, artifact)
+            if self.resumeArtifact(artifact_path):
+                continue
             label_run = None
             with open(artifact_path, "r") as fp:
                 label_run = fp.read().strip()
 
             cmd = label_run.split()
-
-            if self.dryrun:
-                logger.info("DRY-RUN: %s", " ".join(cmd))
+            started = time.time()
+            yield Command(cmd, dryrun=self.dryrun)
+            self.recordObjects(artifact_path, started)
+
+    def deleteObjects(self, objects):
+        cmd = ["docker", "rm", "-f"] + [obj["name"] for obj in objects]
+        runner.run(cmd, dryrun=self.dryrun)
+
+    def getObjectStates(self, kind, names, selector=None):
+        # Fails for missing containers but still describes the others
+        cmd = ["docker", "inspect"] + list(names)
+        output = runner.run(cmd, dryrun=self.dryrun, check=False).stdout
+        if not output.strip():
+            return {}
+        found = dict((container["Name"].lstrip("/"), container["State"])
+                     for container in json.loads(output))
+
+        states = {}
+        for name in names:
+            if name not in found:
+                states[name] = (MISSING, "not found")
+            elif found[name].get("Running"):
+                states[name] = (HEALTHY, "running")
             else:
-                subprocess.check_call(cmd)
+                states[name] = (UNHEALTHY, found[name].get("Status") or "stopped")
+        return states
+
+    def describeArtifact(self, path):
+        """Each artifact runs one container, named by its --name option."""
+        with open(path, "r") as fp:
+            cmd = fp.read().split()
+
+        name = os.path.basename(path)
+        for index, arg in enumerate(cmd):
+            if arg == "--name" and index + 1 < len(cmd):
+                name = cmd[index + 1]
+            elif arg.startswith("--name="):
+                name = arg[len("--name="):]
+
+        return [("container", name)]
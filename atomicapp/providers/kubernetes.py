@@ -18,12 +18,16 @@
 """
 
 from atomicapp.plugin import Provider, ProviderFailedException
+from atomicapp.command import runner, CommandFailedException
+from atomicapp.engine import Command, runTask
 from atomicapp.utils import printErrorStatus
+from atomicapp.health import objectHealth
+from atomicapp.labels import selector
 from collections import OrderedDict
 import os
+import json
+import time
 import anymarkup
-import subprocess
-from subprocess import Popen, PIPE
 import logging
 
 logger = logging.getLogger(__name__)
@@ -31,6 +35,9 @@ logger = logging.getLogger(__name__)
 
 class KubernetesProvider(Provider):
     key = "kubernetes"
+    target_key = "namespace"
+    object_labels = True
+    namespace = "default"
 
     def init(self):
         self.namespace = "default"
@@ -57,6 +64,12 @@ class KubernetesProvider(Provider):
             if not os.access(self.kubectl, os.X_OK):
                 raise ProviderFailedException("Command: " + self.kubectl + " not found")
 
+    def initAsync(self):
+        # Only looks kubectl and its config up, nothing to run in a worker thread
+        self.init()
+        return
+        yield
+
     def _findKubectl(self, prefix=""):
         """
         Determine the path to the kubectl program on the host.
@@ -86,22 +99,21 @@ class KubernetesProvider(Provider):
 
         raise ProviderFailedException("No kubectl found in %s" % ":".join(test_paths))
 
+    def getTarget(self):
+        return self.namespace
+
     def _callK8s(self, path):
+        if self.resumeArtifact(path):
+            return
         cmd = [self.kubectl, "create", "-f", path, "--namespace=%s" % self.namespace]
 
-        if self.dryrun:
-            logger.info("DRY-RUN: %s", " ".join(cmd))
-        else:
-            try:
-                p = Popen(cmd, stdout=PIPE, stderr=PIPE)
-                stdout, stderr = p.communicate()
-                logger.debug("stdout = %s", stdout)
-                logger.debug("stderr = %s", stderr)
-                if stderr and stderr.strip() != "":
-                    raise Exception(str(stderr))
-            except Exception:
-                printErrorStatus("cmd failed: " + " ".join(cmd))
-                raise
+        started = time.time()
+        try:
+            yield Command(cmd, dryrun=self.dryrun)
+        except CommandFailedException:
+            printErrorStatus("cmd failed: " + " ".join(cmd))
+            raise
+        self.recordObjects(path, started)
 
     def prepareOrder(self):
         for artifact in self.artifacts:
@@ -119,13 +131,12 @@ class KubernetesProvider(Provider):
         name = data["id"]
         cmd = [self.kubectl, "resize", "rc", name, "--replicas=0", "--namespace=%s" %
                self.namespace]
-
-        if self.dryrun:
-            logger.info("DRY-RUN: %s", " ".join(cmd))
-        else:
-            subprocess.check_call(cmd)
+        return Command(cmd, dryrun=self.dryrun)
 
     def deploy(self):
+        runTask(self.deployAsync())
+
+    def deployAsync(self):
         logger.info("Deploying to Kubernetes")
         self.prepareOrder()
 
@@ -134,12 +145,26 @@ class KubernetesProvider(Provider):
                 continue
 
             k8s_file = os.path.join(self.path, self.kube_order[artifact])
-            self._callK8s(k8s_file)
+            yield self._callK8s(k8s_file)
 
     def undeploy(self):
+        runTask(self.undeployAsync())
+
+    def undeployAsync(self):
         logger.info("Undeploying from Kubernetes")
         self.prepareOrder()
 
+        if self.labels:
+            # The objects were labelled when rendered, delete each kind at once
+            kinds = [kind for kind in self.kube_order if self.kube_order[kind]]
+            for kind in kinds:
+                if kind in ["rc", "replicationcontroller"]:
+                    yield self._resetReplicas(os.path.join(self.path, self.kube_order[kind]))
+            for kind in kinds:
+                yield self._deleteSelected(kind, selector(self.labels))
+            self.forgetAllObjects()
+            return
+
         for kind, artifact in self.kube_order.iteritems():
             if not self.kube_order[kind]:
                 continue
@@ -147,10 +172,46 @@ class KubernetesProvider(Provider):
             path = os.path.join(self.path, artifact)
 
             if kind in ["ReplicationController", "rc", "replicationcontroller"]:
-                self._resetReplicas(path)
+                yield self._resetReplicas(path)
 
             cmd = [self.kubectl, "delete", "-f", path, "--namespace=%s" % self.namespace]
-            if self.dryrun:
-                logger.info("DRY-RUN: %s", " ".join(cmd))
-            else:
-                subprocess.check_call(cmd)
+            yield Command(cmd, dryrun=self.dryrun)
+            self.forgetObjects(path)
+
+    def _resizeObjects(self, objects):
+        for obj in objects:
+            if obj["kind"] in ["replicationcontroller", "rc"]:
+                cmd = [self.kubectl, "resize", "rc", obj["name"], "--replicas=0",
+                       "--namespace=%s" % self.namespace]
+                runner.run(cmd, dryrun=self.dryrun)
+
+    def deleteObjects(self, objects):
+        self._resizeObjects(objects)
+
+        cmd = [self.kubectl, "delete"] + \
+            ["%s/%s" % (obj["kind"], obj["name"]) for obj in objects] + \
+            ["--namespace=%s" % self.namespace]
+        runner.run(cmd, dryrun=self.dryrun)
+
+    def _deleteSelected(self, kind, selector):
+        cmd = [self.kubectl, "delete", kind, "--selector=%s" % selector,
+               "--namespace=%s" % self.namespace]
+        return Command(cmd, dryrun=self.dryrun)
+
+    def deleteSelected(self, kinds, selector, objects=()):
+        self._resizeObjects(objects)
+        for kind in kinds:
+            runTask(self._deleteSelected(kind, selector))
+
+    def getObjectStates(self, kind, names, selector=None):
+        cmd = [self.kubectl, "get", kind, "--output=json", "--namespace=%s" % self.namespace]
+        if selector:
+            cmd.append("--selector=%s" % selector)
+        output = runner.run(cmd, dryrun=self.dryrun).stdout
+        if not output:
+            return {}
+        items = json.loads(output).get("items") or []
+        found = dict(((item.get("metadata") or {}).get("name") or item.get("id"), item)
+                     for item in items)
+
+        return dict((name, objectHealth(kind, found.get(name))) for name in names)
@@ -18,11 +18,16 @@
 """
 
 from atomicapp.plugin import Provider, ProviderFailedException
+from atomicapp.command import runner
+from atomicapp.engine import Command, Return, runTask
+from atomicapp.health import objectHealth
+from atomicapp.labels import selector
 
 from collections import OrderedDict
 import os
+import json
+import time
 import anymarkup
-import subprocess
 from distutils.spawn import find_executable
 
 import logging
@@ -32,6 +37,8 @@ logger = logging.getLogger(__name__)
 
 class OpenShiftProvider(Provider):
     key = "openshift"
+    target_key = "openshiftconfig"
+    object_labels = True
     cli_str = "oc"
     cli = None
     config_file = None
@@ -67,13 +74,93 @@ class OpenShiftProvider(Provider):
                 "'openshiftconfig = /path/to/your/.kube/config' in the "
                 "[general] section of the answers.conf file." % self.config_file)
 
+    def initAsync(self):
+        # Only looks oc and its config up, nothing to run in a worker thread
+        self.init()
+        return
+        yield
+
     def _callCli(self, path):
+        if self.resumeArtifact(path):
+            return
         cmd = [self.cli, "--config=%s" % self.config_file, "create", "-f", path]
-
-        if self.dryrun:
-            logger.info("Calling: %s", " ".join(cmd))
-        else:
-            subprocess.check_call(cmd)
+        started = time.time()
+        yield Command(cmd, dryrun=self.dryrun)
+        self.recordObjects(path, started)
+
+    def _scaleObjects(self, objects):
+        for obj in objects:
+            if obj["kind"] in ["replicationcontroller", "rc"]:
+                cmd = [self.cli, "--config=%s" % self.config_file, "scale", "rc", obj["name"],
+                       "--replicas=0"]
+                runner.run(cmd, dryrun=self.dryrun)
+
+    def deleteObjects(self, objects):
+        self._scaleObjects(objects)
+        cmd = [self.cli, "--config=%s" % self.config_file, "delete"] + \
+            ["%s/%s" % (obj["kind"], obj["name"]) for obj in objects]
+        runner.run(cmd, dryrun=self.dryrun)
+
+    def undeploy(self):
+        runTask(self.undeployAsync())
+
+    def undeployAsync(self):
+        if not self.labels:
+            super(OpenShiftProvider, self).undeploy()
+            return
+
+        # "oc delete all" leaves secrets, volume claims etc. alone, each kind is deleted
+        logger.info("Undeploying from OpenShift")
+        for kind in self._objectKinds():
+            yield self._deleteSelected(kind, selector(self.labels))
+        self.forgetAllObjects()
+
+    def _objectKinds(self):
+        """
+        Kinds of the objects of the component: those recorded in the state
+        and those its artifacts create, templates create their objects.
+        """
+        kinds = OrderedDict()
+        if self.state is not None:
+            for obj in self.state.getObjects(self):
+                if obj["target"] == (self.getTarget() or ""):
+                    kinds[obj["kind"]] = True
+        for artifact in self.artifacts:
+            data = anymarkup.parse_file(os.path.join(self.path, artifact), force_types=None)
+            kind = str(data.get("kind", "")).lower()
+            if kind == "template":
+                items = data.get("objects")
+            elif kind == "list":
+                items = data.get("items")
+            else:
+                items = [data]
+            for item in items or []:
+                if isinstance(item, dict) and "kind" in item:
+                    kinds[item["kind"].lower()] = True
+        return kinds.keys()
+
+    def _deleteSelected(self, kind, selector):
+        cmd = [self.cli, "--config=%s" % self.config_file, "delete", kind,
+               "--selector=%s" % selector]
+        return Command(cmd, dryrun=self.dryrun)
+
+    def deleteSelected(self, kinds, selector, objects=()):
+        self._scaleObjects(objects)
+        for kind in kinds:
+            runTask(self._deleteSelected(kind, selector))
+
+    def getObjectStates(self, kind, names, selector=None):
+        cmd = [self.cli, "--config=%s" % self.config_file, "get", kind, "--output=json"]
+        if selector:
+            cmd.append("--selector=%s" % selector)
+        output = runner.run(cmd, dryrun=self.dryrun).stdout
+        if not output:
+            return {}
+        items = json.loads(output).get("items") or []
+        found = dict(((item.get("metadata") or {}).get("name") or item.get("id"), item)
+                     for item in items)
+
+        return dict((name, objectHealth(kind, found.get(name))) for name in names)
 
     def _processTemplate(self, path):
         cmd = [self.cli, "--config=%s" % self.config_file, "process", "-f", path]
@@ -81,11 +168,11 @@ class OpenShiftProvider(Provider):
         name = "config-%s" % os.path.basename(path)
         output_path = os.path.join(self.path, name)
         if self.cli and not self.dryrun:
-            output = subprocess.check_output(cmd)
+            output = (yield Command(cmd)).stdout
             logger.debug("Writing processed template to %s", output_path)
             with open(output_path, "w") as fp:
                 fp.write(output)
-        return name
+        raise Return(name)
 
     def loadArtifact(self, path):
         data = super(self.__class__, self).loadArtifact(path)
@@ -112,6 +199,9 @@ class OpenShiftProvider(Provider):
         super(self.__class__, self).saveArtifact(path, data)
 
     def deploy(self):
+        runTask(self.deployAsync())
+
+    def deployAsync(self):
         kube_order = OrderedDict(
             [("service", None), ("rc", None), ("pod", None)])  # FIXME
         for artifact in self.artifacts:
@@ -122,7 +212,7 @@ class OpenShiftProvider(Provider):
             if "kind" in data:
                 if data["kind"].lower() == "template":
                     logger.info("Processing template")
-                    artifact = self._processTemplate(artifact_path)
+                    artifact = yield self._processTemplate(artifact_path)
                 kube_order[data["kind"].lower()] = artifact
             else:
                 raise ProviderFailedException("Malformed artifact file")
@@ -132,4 +222,4 @@ class OpenShiftProvider(Provider):
                 continue
 
             k8s_file = os.path.join(self.path, kube_order[artifact])
-            self._callCli(k8s_file)
+            yield self._callCli(k8s_file)
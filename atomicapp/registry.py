@@ -0,0 +1,353 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import re
+import json
+import urllib
+import urllib2
+import hashlib
+import tempfile
+import posixpath
+
+import logging
+
+from constants import APP_ENT_PATH, REGISTRY_CACHE_DIR
+from archive import extractLayers, openLayerFiles
+from lock import CacheLock
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REGISTRY = "registry-1.docker.io"
+MANIFEST_TYPES = (
+    "application/vnd.docker.distribution.manifest.v2+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.oci.image.manifest.v1+json",
+    "application/vnd.oci.image.index.v1+json")
+CHUNK_SIZE = 1024 * 1024
+
+
+class RegistryError(Exception):
+    pass
+
+
+def parseReference(reference):
+    """Split an image reference into (registry, repository, tag or digest)."""
+    if reference.startswith("docker://"):
+        reference = reference[len("docker://"):]
+
+    if "@" in reference:
+        name, ref = reference.split("@", 1)
+    elif ":" in reference.rsplit("/", 1)[-1]:
+        name, ref = reference.rsplit(":", 1)
+    else:
+        name, ref = reference, "latest"
+
+    registry, _, repository = name.partition("/")
+    if not repository or not ("." in registry or ":" in registry or registry == "localhost"):
+        registry, repository = DEFAULT_REGISTRY, name
+    if registry in ("docker.io", "index.docker.io"):
+        registry = DEFAULT_REGISTRY
+    if registry == DEFAULT_REGISTRY and "/" not in repository:
+        repository = "library/%s" % repository
+
+    return registry, repository, ref
+
+
+def _instruction(created_by):
+    """(instruction, arguments) of the Dockerfile line of a history entry."""
+    text = created_by.strip()
+    if "#(nop)" in text:
+        text = text.split("#(nop)", 1)[1].strip()
+    elif text.startswith("/bin/sh -c "):
+        return "RUN", text
+    if text.endswith("# buildkit"):
+        text = text[:-len("# buildkit")].strip()
+    instruction, _, arguments = text.partition(" ")
+    return instruction.upper(), arguments.strip()
+
+
+def _resolvePath(path, workdir):
+    """Absolute path of a path in a Dockerfile line, None if not known."""
+    if not path or "$" in path or (not path.startswith("/") and workdir is None):
+        return None
+    return posixpath.normpath(posixpath.join(workdir or "/", path))
+
+
+def _destination(arguments, workdir):
+    """Absolute destination of ADD or COPY arguments, None if not known."""
+    if arguments.startswith("["):
+        try:
+            dst = json.loads(arguments)[-1]
+        except (ValueError, IndexError):
+            return None
+    elif " in " in arguments:
+        # Classic builder: ADD file:<hash> in <destination>
+        dst = arguments.rsplit(" in ", 1)[1].strip()
+    else:
+        parts = arguments.split()
+        dst = parts[-1] if len(parts) > 1 else None
+    return _resolvePath(dst, workdir)
+
+
+def appLayers(history, layers, prefix=APP_ENT_PATH):
+    """
+    The layers which add files under prefix, found in the history of the
+    image config, or None unless that is certain.
+
+    Only ADD and COPY to /prefix, into it or to one of its parents count,
+    relative destinations are resolved against the WORKDIR of the history.
+    Any other layer created under prefix or mentioning it, and destinations
+    which can not be resolved, make it uncertain. An ADD of a single file to
+    / is the root filesystem of a base image, not the app.
+    """
+    if len([item for item in history if not item.get("empty_layer")]) != len(layers):
+        return None
+
+    path = posixpath.join("/", prefix)
+    found = []
+    workdir = "/"
+    remaining = iter(layers)
+    for item in history:
+        created_by = item.get("created_by", "")
+        instruction, arguments = _instruction(created_by)
+        if instruction == "WORKDIR":
+            workdir = _resolvePath(arguments, workdir)
+        if item.get("empty_layer"):
+            continue
+
+        layer = next(remaining)
+        if instruction in ("ADD", "COPY"):
+            dst = _destination(arguments, workdir)
+            if dst is None:
+                return None
+            if dst == "/" and instruction == "ADD" and arguments.startswith("file:"):
+                continue
+            if dst == path or dst.startswith(path + "/") or \
+                    dst == "/" or path.startswith(dst + "/"):
+                found.append(layer)
+        elif prefix in created_by or workdir is None or \
+                workdir == path or workdir.startswith(path + "/"):
+            return None
+
+    return found or None
+
+
+class RegistryClient(object):
+    """
+    Client of the Docker registry HTTP API v2 pulling images without a
+    Docker daemon.
+
+    Blobs are content addressed, they are kept in the cache under their
+    digest and downloaded only once for all apps on the host. Manifests
+    of tags can change, they are cached with their ETag and revalidated
+    with a conditional request.
+    """
+
+    def __init__(self, insecure=None, cache_dir=None):
+        self.insecure = set(insecure or [])
+        self.cache_dir = cache_dir or REGISTRY_CACHE_DIR
+        self.tokens = {}
+
+    def _url(self, registry, repository, path):
+        # Like docker, talk plain HTTP to local and explicitly insecure registries
+        if registry in self.insecure or registry.split(":")[0] in ("localhost", "127.0.0.1"):
+            scheme = "http"
+        else:
+            scheme = "https"
+        return "%s://%s/v2/%s/%s" % (scheme, registry, repository, path)
+
+    def _open(self, registry, repository, path, headers=None):
+        request = urllib2.Request(self._url(registry, repository, path), headers=headers or {})
+        token = self.tokens.get((registry, repository))
+        if token:
+            # Blobs are often redirected to storage which rejects the token
+            request.add_unredirected_header("Authorization", "Bearer %s" % token)
+
+        try:
+            return urllib2.urlopen(request)
+        except urllib2.HTTPError as ex:
+            if ex.code == 401 and not token and \
+                    self._authenticate(registry, repository, ex.info().get("WWW-Authenticate")):
+                return self._open(registry, repository, path, headers)
+            raise
+
+    def _authenticate(self, registry, repository, challenge):
+        """Get an anonymous pull token for repository, True on success."""
+        if not challenge or not challenge.lower().startswith("bearer "):
+            return False
+
+        params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+        if "realm" not in params:
+            return False
+        query = {"scope": "repository:%s:pull" % repository}
+        if "service" in params:
+            query["service"] = params["service"]
+
+        logger.debug("Getting a token for %s/%s from %s", registry, repository, params["realm"])
+        response = json.load(urllib2.urlopen("%s?%s" % (params["realm"], urllib.urlencode(query))))
+        self.tokens[(registry, repository)] = response.get("token") or response.get("access_token")
+        return True
+
+    def _cachePath(self, *parts):
+        path = os.path.join(self.cache_dir, *parts)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        return path
+
+    def getManifest(self, registry, repository, ref):
+        """Image manifest of repository:ref, the linux/amd64 one of multi-arch images."""
+        manifest = self._getManifest(registry, repository, ref)
+        if "manifests" in manifest:
+            descriptors = manifest["manifests"]
+            for descriptor in descriptors:
+                platform = descriptor.get("platform") or {}
+                if platform.get("os") == "linux" and platform.get("architecture") == "amd64":
+                    break
+            else:
+                descriptor = descriptors[0]
+            manifest = self._getManifest(registry, repository, descriptor["digest"])
+
+        if manifest.get("schemaVersion") != 2 or "layers" not in manifest:
+            raise RegistryError("Unsupported manifest of %s/%s:%s" % (registry, repository, ref))
+        return manifest
+
+    def _getManifest(self, registry, repository, ref):
+        key = hashlib.sha256("%s/%s:%s" % (registry, repository, ref)).hexdigest()
+        path = self._cachePath("manifests", key)
+        cached = None
+        if os.path.isfile(path):
+            with open(path) as fp:
+                cached = json.load(fp)
+            if ref.startswith("sha256:"):
+                # Manifests referenced by digest never change
+                return cached["manifest"]
+
+        headers = {"Accept": ", ".join(MANIFEST_TYPES)}
+        if cached and cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        try:
+            response = self._open(registry, repository, "manifests/%s" % ref, headers)
+        except urllib2.HTTPError as ex:
+            if ex.code == 304 and cached:
+                logger.debug("Manifest of %s/%s:%s not modified", registry, repository, ref)
+                return cached["manifest"]
+            raise RegistryError("Could not get manifest of %s/%s:%s: %s"
+                                % (registry, repository, ref, ex))
+
+        manifest = json.loads(response.read())
+        etag = response.info().get("ETag")
+        if not etag and response.info().get("Docker-Content-Digest"):
+            etag = '"%s"' % response.info().get("Docker-Content-Digest")
+        # Unique per writer, threads of one process may fetch it at once
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".manifest-")
+        try:
+            with os.fdopen(fd, "w") as fp:
+                json.dump({"etag": etag, "manifest": manifest}, fp)
+            os.rename(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+        return manifest
+
+    def getBlob(self, registry, repository, digest):
+        """Path of the blob in the cache, downloaded if it is not there yet."""
+        algorithm, _, digest_hex = digest.partition(":")
+        if algorithm != "sha256" or not re.match(r"^[0-9a-f]{64}$", digest_hex):
+            raise RegistryError("Unsupported digest %s" % digest)
+
+        path = self._cachePath("blobs", algorithm, digest_hex)
+        with CacheLock("blob:%s" % digest).writing():
+            if os.path.isfile(path):
+                logger.debug("Blob %s is cached", digest)
+                return path
+
+            logger.info("Downloading blob %s of %s/%s", digest, registry, repository)
+            try:
+                response = self._open(registry, repository, "blobs/%s" % digest)
+            except urllib2.HTTPError as ex:
+                raise RegistryError("Could not get blob %s of %s/%s: %s"
+                                    % (digest, registry, repository, ex))
+
+            checksum = hashlib.sha256()
+            tmp_path = "%s.%s" % (path, os.getpid())
+            try:
+                with open(tmp_path, "wb") as fp:
+                    for chunk in iter(lambda: response.read(CHUNK_SIZE), ""):
+                        checksum.update(chunk)
+                        fp.write(chunk)
+                if checksum.hexdigest() != digest_hex:
+                    raise RegistryError("Blob %s of %s/%s is corrupted"
+                                        % (digest, registry, repository))
+                os.rename(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+
+        return path
+
+
+class RegistryImage(object):
+    """
+    Image in a registry, with the same extract() as ImageArchive.
+
+    Only the layers which add /application-entity are downloaded. They
+    are found in the history of the image config, where every entry which
+    is not an empty layer belongs to one layer of the manifest (see
+    appLayers). Images whose history does not tell them for certain fall
+    back to all layers.
+    """
+
+    path = None
+    reference = None
+
+    def __init__(self, reference, client):
+        self.reference = reference
+        self.client = client
+        self.registry, self.repository, self.ref = parseReference(reference)
+        self.path = "%s/%s" % (self.registry, self.repository)
+
+    def getLayers(self):
+        """Descriptors of the layers to download, bottom-up."""
+        manifest = self.client.getManifest(self.registry, self.repository, self.ref)
+        layers = manifest["layers"]
+        with open(self.client.getBlob(
+                self.registry, self.repository, manifest["config"]["digest"])) as fp:
+            config = json.load(fp)
+
+        app_layers = appLayers(config.get("history") or [], layers)
+        if app_layers is None:
+            logger.debug("History of %s does not tell the layers adding %s, using all of them",
+                         self.reference, APP_ENT_PATH)
+            return layers
+        return app_layers
+
+    def extract(self, dst, prefix=APP_ENT_PATH):
+        """
+        Write the files under prefix in the image to dst/prefix, return the
+        number of files written.
+        """
+        layers = self.getLayers()
+        paths = [self.client.getBlob(self.registry, self.repository, layer["digest"])
+                 for layer in layers]
+        files = extractLayers(openLayerFiles(reversed(paths)), dst, prefix)
+        logger.info("Extracted %s files of %s from %s of its layers",
+                    files, self.reference, len(layers))
+        return files
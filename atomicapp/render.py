@@ -0,0 +1,221 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+from string import Template
+from multiprocessing import Pool, cpu_count
+
+import logging
+
+from run import Run
+from plugin import Plugin, Provider
+from labels import objectLabels
+from state import contentHash
+from cache import LRUCache
+from resolver import Resolver
+from utils import printStatus, printErrorStatus
+from tracing import tracer
+from events import events
+
+logger = logging.getLogger(__name__)
+
+# Where rendered artifacts go without --output, relative to the current directory
+RENDER_DIR = "rendered"
+# Seconds to wait for the pool, a wait without timeout can not be interrupted in Python 2
+POOL_TIMEOUT = 365 * 24 * 3600
+
+# Per process, workers load the providers and cache artifacts and templates once
+_plugin = None
+_artifacts = LRUCache()
+_templates = LRUCache()
+
+
+class RenderError(Exception):
+
+    """Artifacts could not be rendered"""
+
+    def __init__(self, errors):
+        Exception.__init__(
+            self, "Rendering failed with %s error(s):\n%s" % (len(errors), "\n".join(errors)))
+        self.errors = errors
+
+
+def _providerClass(key):
+    global _plugin
+    if _plugin is None:
+        _plugin = Plugin()
+        _plugin.load_plugins()
+    # Unknown providers render as plain files, only known ones change artifacts
+    return _plugin.getProvider(key) or Provider
+
+
+def renderArtifact(job):
+    """
+    Render a job - (provider, source path, destination path, values, labels) -
+    like Run._processArtifacts does. Returns (destination, hash of the saved
+    artifact, None) or (destination, None, error message); only that goes
+    back from a worker process, the artifact itself is read and written by
+    the worker.
+    """
+    key, src, dst, values, labels = job
+    try:
+        provider = _providerClass(key)(values, os.path.dirname(dst), False)
+        provider.artifact_cache = _artifacts
+        provider.labels = labels
+        data = provider.loadArtifact(src)
+        template = _templates.get(data)
+        if template is None:
+            template = _templates[data] = Template(data)
+        try:
+            data = template.substitute(values)
+        except KeyError as ex:
+            raise Exception("Artifact contains unknown parameter %s" % ex.args[0])
+        provider.saveArtifact(dst, data)
+        with open(dst, "r") as fp:
+            return dst, contentHash(fp.read()), None
+    except Exception as ex:
+        logger.debug("Rendering %s failed", src, exc_info=True)
+        return dst, None, "%s: %s" % (src, ex)
+
+
+def renderArtifacts(jobs, processes=None):
+    """
+    Render jobs (see renderArtifact) in a pool of processes, returning
+    [(path, hash)] in the order of the jobs however the work was spread. A
+    failed job does not stop the others, all failures are raised together
+    as a RenderError once every job has finished. With one process the jobs
+    are rendered in this process.
+    """
+    processes = min(processes or cpu_count(), len(jobs))
+    if processes <= 1:
+        results = [renderArtifact(job) for job in jobs]
+    else:
+        pool = Pool(processes)
+        try:
+            results = pool.map_async(renderArtifact, jobs).get(POOL_TIMEOUT)
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    errors = [error for _, _, error in results if error]
+    if errors:
+        for error in errors:
+            printErrorStatus(error)
+        raise RenderError(errors)
+    return [(path, content_hash) for path, content_hash, _ in results]
+
+
+class Render(Run):
+    """
+    Render the artifacts of an app for every provider it has artifacts for,
+    without deploying anything.
+
+    Each provider gets its own tree: <output>/<provider>/<component>/<artifact
+    path>, external apps under <output>/<provider>/external/<name>/. Params
+    are resolved once per app, then the whole graph - every artifact of every
+    provider, inherited ones included - is rendered as one list of jobs in a
+    pool of processes (see renderArtifacts). Nothing is asked for while
+    rendering: params without a value in the answers or a default are
+    reported together, as is an artifact using a parameter the Nulecule
+    does not define.
+    """
+
+    def __init__(self, answers, APP, output=None, providers=None, processes=None,
+                 subdir="", jobs=None, missing=None, **kwargs):
+        Run.__init__(self, answers, APP, **kwargs)
+        self.output = os.path.abspath(output or RENDER_DIR)
+        self.providers = providers
+        self.processes = processes
+        self.subdir = subdir
+        # Jobs of the whole graph, shared with the renders of external apps
+        self.jobs = jobs if jobs is not None else []
+        # Params of the whole graph without a value, reported before rendering
+        self.missing = missing if missing is not None else []
+        self.resolver = None
+        # (path, hash) of the rendered artifacts, in the order of the jobs
+        self.rendered = []
+
+    def run(self):
+        with tracer.span("render", app=self.app_path, nested=self.nested), \
+                events.phase("render", app=self.app_path, nested=self.nested):
+            result = self._run()
+            if not self.nested:
+                self.rendered = self._render()
+            return result
+
+    def _render(self):
+        if self.missing:
+            for error in self.missing:
+                printErrorStatus(error)
+            raise RenderError(self.missing)
+        if not self.jobs:
+            return []
+        with tracer.span("renderArtifacts", artifacts=len(self.jobs)):
+            rendered = renderArtifacts(self.jobs, self.processes)
+
+        counts = {}
+        for key, _, _, _, _ in self.jobs:
+            counts[key] = counts.get(key, 0) + 1
+        for key in sorted(counts):
+            printStatus("Rendered %s artifacts for %s." % (counts[key], key))
+        return rendered
+
+    def _externalRun(self, component):
+        return Render(self.answers_file, self.utils.getExternalAppDir(component), self.output,
+                      self.providers, self.processes,
+                      os.path.join(self.subdir, "external", component), self.jobs,
+                      self.missing, dryrun=self.dryrun, debug=self.debug, context=self.context,
+                      **self.kwargs)
+
+    def _processComponent(self, component, graph_item):
+        artifacts = self.nulecule_base.getArtifacts(component)
+        providers = [name for name in sorted(artifacts)
+                     if not self.providers or name in self.providers]
+        if not providers:
+            logger.info("Component %s has no artifacts to render", component)
+            return
+
+        # Resolved here, every job of the component gets the same values
+        if self.resolver is None:
+            self.resolver = Resolver(self.nulecule_base, skip_asking=True, global_base=True)
+        values = dict(self.resolver.getValues(component))
+        missing = sorted(name for name, value in values.iteritems() if value is None)
+        if missing:
+            self.missing += ["%s: component %s: param %s has no value in the answers "
+                             "and no default" % (self.nulecule_base.app_id, component, name)
+                             for name in missing]
+            return
+        labels = objectLabels(self.nulecule_base.app_id, component)
+        for name in providers:
+            dst_dir = os.path.join(self.output, name, self.subdir, component)
+            self._addJobs(component, name, name, dst_dir, values, labels)
+
+    def _addJobs(self, component, key, provider_name, dst_dir, values, labels):
+        """Add jobs for the artifacts of provider_name, rendered for provider key."""
+        for artifact in self.nulecule_base.getArtifacts(component)[provider_name]:
+            if "inherit" in artifact:
+                for item in artifact["inherit"]:
+                    self._addJobs(component, key, item, dst_dir, values, labels)
+                continue
+            artifact_path = self.utils.sanitizePath(artifact)
+            self.jobs.append((key, os.path.join(self.app_path, artifact_path),
+                              os.path.join(dst_dir, artifact_path), values, labels))
@@ -0,0 +1,153 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import collections
+
+import logging
+
+from constants import GLOBAL_CONF, PARAMS_KEY
+from merge import merge
+from utils import Utils
+
+logger = logging.getLogger(__name__)
+
+
+class MissingValuesError(Exception):
+
+    """Params have no value and can not be asked for"""
+
+    def __init__(self, app_id, missing):
+        Exception.__init__(self, "%s: %s param(s) without a value in the answers or a default: %s"
+                           % (app_id, len(missing), ", ".join(missing)))
+        self.missing = missing
+
+
+class Values(collections.Mapping):
+    """
+    Read-only values of a component: its own layer on top of the shared
+    global values. Copy it with dict() to get something to modify.
+    """
+
+    def __init__(self, layer, parent=None):
+        self.layer = layer
+        self.parent = parent or {}
+
+    def __getitem__(self, name):
+        if name in self.layer:
+            return self.layer[name]
+        return self.parent[name]
+
+    def __contains__(self, name):
+        return name in self.layer or name in self.parent
+
+    def __iter__(self):
+        for name in self.layer:
+            yield name
+        for name in self.parent:
+            if name not in self.layer:
+                yield name
+
+    def __len__(self):
+        return len(self.layer) + len([name for name in self.parent if name not in self.layer])
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class Resolver(object):
+    """
+    Values of every component of a Nulecule, resolved in one pass.
+
+    The global params merged with the global answers are resolved once and
+    shared by all components. A component only resolves the params it
+    defines or has answers for, every other value is the global one - the
+    same object, so a global param is asked for once, not per component.
+    Without global_base (the default when skip_asking) components only see
+    their own params, like Nulecule_Base.getValues.
+    """
+
+    def __init__(self, nulecule_base, skip_asking=False, global_base=None):
+        self.nulecule_base = nulecule_base
+        self.skip_asking = skip_asking
+        self.global_base = not skip_asking if global_base is None else global_base
+        self.values = {}
+        self.asked = {}
+        self._resolve()
+
+    def _resolve(self):
+        nulecule_base = self.nulecule_base
+        answers = nulecule_base.answers_data or {}
+        mainfile_data = nulecule_base.mainfile_data or {}
+
+        global_params = merge(
+            nulecule_base.fromListToDict(mainfile_data.get(PARAMS_KEY) or []),
+            nulecule_base._cleanNullValues(answers.get(GLOBAL_CONF) or {}))
+        global_values = self._resolveParams(global_params)
+        self.values[GLOBAL_CONF] = Values(global_values)
+        # Values typed in for global params, kept so they are not asked again
+        self.asked = dict((name, value) for name, value in global_values.iteritems()
+                          if self._wasAsked(global_params[name], value))
+
+        for graph_item in mainfile_data.get("graph") or []:
+            component = graph_item.get("name")
+            if Utils.isExternal(graph_item):
+                continue
+
+            params = merge(
+                nulecule_base.fromListToDict(graph_item.get(PARAMS_KEY) or []),
+                nulecule_base._cleanNullValues(answers.get(component) or {}))
+            if self.global_base:
+                # A param overriding a global one is merged with it first
+                params = dict((name, merge(global_params[name], param)
+                               if name in global_params else param)
+                              for name, param in params.iteritems())
+                self.values[component] = Values(self._resolveParams(params), global_values)
+            else:
+                self.values[component] = Values(self._resolveParams(params))
+
+        logger.debug("Resolved values of %s components", len(self.values) - 1)
+
+    @staticmethod
+    def _wasAsked(param, value):
+        if not isinstance(param, dict) or value is param:
+            return False
+        return value != param.get("default")
+
+    def _resolveParams(self, params):
+        return dict((name, self.nulecule_base._getValue(param, name, self.skip_asking))
+                    for name, param in params.iteritems())
+
+    def getMissing(self):
+        """Params without a value, as component/param, in order."""
+        return ["%s/%s" % (component, name)
+                for component, values in sorted(self.values.iteritems())
+                for name in sorted(values.layer) if values.layer[name] is None]
+
+    def getValues(self, component=GLOBAL_CONF):
+        if component not in self.values:
+            raise ValueError("Component %s is not part of %s"
+                             % (component, self.nulecule_base.app_id))
+        return self.values[component]
+
+    def writeAnswers(self):
+        """Record the resolved values in the answers, once per component."""
+        self.nulecule_base._updateAnswers(GLOBAL_CONF, self.asked)
+        for component, values in self.values.iteritems():
+            if component != GLOBAL_CONF:
+                self.nulecule_base._updateAnswers(component, dict(values))
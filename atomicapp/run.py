@@ -26,11 +26,42 @@ import logging
 from nulecule_base import Nulecule_Base
 from utils import Utils, printStatus, printErrorStatus
 from constants import GLOBAL_CONF, DEFAULT_PROVIDER, MAIN_FILE, ANSWERS_FILE_SAMPLE_FORMAT
-from plugin import Plugin, ProviderFailedException
-from install import Install
+from plugin import ProviderFailedException
+from command import CommandFailedException
+from install import Install, SOURCE_OPTIONS
+from bundle import Bundle, isAppFile
+from archive import ImageArchive
+from validator import ValidationError
+from schema import SchemaError, checkApp
+from context import RunContext
+from state import StateStore, ComponentState
+from labels import objectLabels, instanceId
+from stop import Stop
+from tracing import tracer
+from events import events
+from engine import All, Graph, Return, runTask
 
 logger = logging.getLogger(__name__)
 
+# Stands in for the per-target value while artifacts are rendered for fan-out
+TARGET_PLACEHOLDER = "@@atomicapp-target@@"
+
+
+class Deployment(object):
+    """A component a run deploys or undeploys, see Run._deploy."""
+
+    def __init__(self, app_id, component, providers, task):
+        self.app_id = app_id
+        self.component = component
+        # One provider per target the component goes to
+        self.providers = providers
+        self.task = task
+        # Indexes of the deployments in RunContext.deployments to wait for
+        self.depends_on = []
+        # Position of the component in the graph of its app
+        self.index = None
+        self.total = None
+
 
 class Run(object):
     debug = False
@@ -49,16 +80,23 @@ class Run(object):
     app = None
     answers_output = None
     kwargs = None
+    context = None
+    nested = False
 
     def __init__(
             self, answers, APP, dryrun=False, debug=False, stop=False,
-            answers_format=ANSWERS_FILE_SAMPLE_FORMAT, **kwargs):
+            answers_format=ANSWERS_FILE_SAMPLE_FORMAT, context=None, **kwargs):
 
         self.debug = debug
         self.dryrun = dryrun
         self.stop = stop
         self.kwargs = kwargs
 
+        if not context:
+            context = RunContext(dryrun)
+        self.context = context
+        self.nested = context.isNested(self)
+
         if "answers_output" in kwargs:
             self.answers_output = kwargs["answers_output"]
 
@@ -75,19 +113,25 @@ class Run(object):
 
         self.kwargs = kwargs
 
-        if APP and os.path.exists(APP):
+        if APP and os.path.exists(APP) and not Bundle.isBundle(APP) and \
+                not ImageArchive.isArchive(APP):
             self.app_path = APP
         else:
             if not self.app_path:
                 self.app_path = os.getcwd()
             install = Install(
                 answers, APP, dryrun=dryrun, target_path=self.app_path,
-                answers_format=answers_format)
+                answers_format=answers_format, context=self.context,
+                **dict((name, kwargs.get(name)) for name in SOURCE_OPTIONS))
             install.install()
             printStatus("Install Successful.")
 
         self.nulecule_base = Nulecule_Base(
-            target_path=self.app_path, dryrun=dryrun, file_format=answers_format)
+            target_path=self.app_path, dryrun=dryrun, file_format=answers_format,
+            docker_cli=self.context.docker_cli)
+        self.nulecule_base.mainfile_cache = self.context.getCache("mainfiles")
+        self.nulecule_base.validator_cache = self.context.getCache("validators")
+        self.nulecule_base.interactive = self.context.interactive
         if "ask" in kwargs:
             self.nulecule_base.ask = kwargs["ask"]
 
@@ -100,33 +144,112 @@ class Run(object):
             kwargs["workdir"] = self.utils.workdir
 
         self.answers_file = answers
-        self.plugin = Plugin()
-        self.plugin.load_plugins()
+
+    def _validate(self):
+        """
+        Check the values of this app and of all its installed external apps
+        against their constraints before anything is pulled or deployed.
+        Apps installed later are checked by their own nested Run.
+        """
+        violations = []
+        pending = [(self.app_path, self.nulecule_base)]
+        while pending:
+            app_path, nulecule_base = pending.pop(0)
+            if not self.context.needsValidation(app_path):
+                continue
+            violations += nulecule_base.validate()
+
+            for graph_item in nulecule_base.mainfile_data["graph"]:
+                if not Utils.isExternal(graph_item):
+                    continue
+                external_path = Utils(app_path).getExternalAppDir(graph_item.get("name"))
+                if not isAppFile(os.path.join(external_path, MAIN_FILE)):
+                    continue
+                external = Nulecule_Base(
+                    target_path=external_path, dryrun=self.dryrun,
+                    docker_cli=self.context.docker_cli)
+                external.mainfile_cache = self.nulecule_base.mainfile_cache
+                external.validator_cache = self.nulecule_base.validator_cache
+                external.loadMainfile(os.path.join(external_path, MAIN_FILE))
+                # Nested runs resolve their values from the same answers
+                external.loadAnswers(nulecule_base.answers_data)
+                pending.append((external_path, external))
+
+        if violations:
+            for violation in violations:
+                printErrorStatus(violation)
+            raise ValidationError(violations)
 
     def _dispatchGraph(self):
         if "graph" not in self.nulecule_base.mainfile_data:
             printErrorStatus("Graph not specified in %s." % MAIN_FILE)
             raise Exception("Graph not specified in %s" % MAIN_FILE)
 
-        for graph_item in self.nulecule_base.mainfile_data["graph"]:
+        graph = self.nulecule_base.mainfile_data["graph"]
+        components = []
+        externals = []
+        for index, graph_item in enumerate(graph):
             component = graph_item.get("name")
             if not component:
                 printErrorStatus("Component name missing in graph.")
                 raise ValueError("Component name missing in graph")
 
+            first = len(self.context.deployments)
+            self._dispatchComponent(component, graph_item)
+            added = range(first, len(self.context.deployments))
             if self.utils.isExternal(graph_item):
-                self.kwargs["image"] = self.utils.getSourceImage(graph_item)
-                component_run = Run(self.answers_file, self.utils.getExternalAppDir(
-                    component), self.dryrun, self.debug, self.stop, **self.kwargs)
-                ret = component_run.run()
-                if self.answers_output:
-                    self.nulecule_base.loadAnswers(ret)
-            else:
-                self._processComponent(component, graph_item)
-
-    def _applyTemplate(self, data, component):
-        template = Template(data)
-        config = self.nulecule_base.getValues(component)
+                externals += added
+                continue
+            for deployment in self.context.deployments[first:]:
+                deployment.index, deployment.total = index + 1, len(graph)
+            components += added
+
+        self._addDependencies(components, externals)
+
+    def _addDependencies(self, components, externals):
+        """
+        Components of an app use the services of its external apps, these
+        are deployed before and undeployed after them. Nothing else orders
+        deployments, the components of an app and its external apps are
+        deployed concurrently.
+        """
+        deployments = self.context.deployments
+        if self.stop:
+            for index in externals:
+                deployments[index].depends_on += components
+        else:
+            for index in components:
+                deployments[index].depends_on += externals
+
+    def _dispatchComponent(self, component, graph_item):
+        if self.utils.isExternal(graph_item):
+            self.kwargs["image"] = self.utils.getSourceImage(graph_item)
+            ret = self._externalRun(component).run()
+            if self.answers_output:
+                self.nulecule_base.loadAnswers(ret)
+        else:
+            self.context.components.setdefault(
+                self.nulecule_base.app_id, set()).add(component)
+            self._processComponent(component, graph_item)
+
+    def _externalRun(self, component):
+        """Nested Run for the external app of component, installing it if needed."""
+        return Run(self.answers_file, self.utils.getExternalAppDir(component), self.dryrun,
+                   self.debug, self.stop, context=self.context, **self.kwargs)
+
+    def _template(self, data):
+        """Compiled template of artifact data, shared by every run in this process."""
+        templates = self.context.getCache("templates")
+        template = templates.get(data)
+        if template is None:
+            template = templates[data] = Template(data)
+        return template
+
+    def _applyTemplate(self, data, component, overrides=None):
+        template = self._template(data)
+        config = dict(self.nulecule_base.getResolver().getValues(component))
+        if overrides:
+            config.update(overrides)
         logger.debug("Config: %s ", config)
 
         output = None
@@ -136,24 +259,42 @@ class Run(object):
                 output = template.substitute(config)
             except KeyError as ex:
                 name = ex.args[0]
-                logger.debug(
-                    "Artifact contains unknown parameter %s, asking for it", name)
-                try:
-                    config[name] = self.utils.askFor(
-                        name,
-                        {"description":
-                         "Missing parameter '%s', provide the value or fix your %s" % (
-                             name, MAIN_FILE)})
-                except EOFError:
-                    raise Exception("Artifact contains unknown parameter %s" % name)
-                if not len(config[name]):
-                    printErrorStatus("Artifact contains unknown parameter %s." % name)
-                    raise Exception("Artifact contains unknown parameter %s" % name)
-                self.nulecule_base.loadAnswers({component: {name: config[name]}})
+                config[name] = self._askMissing(name, component)
 
         return output
 
-    def _processArtifacts(self, component, provider, provider_name=None):
+    def _askMissing(self, name, component):
+        """Value of a parameter an artifact uses but the Nulecule does not define."""
+        if not self.context.interactive:
+            printErrorStatus("Artifact contains unknown parameter %s." % name)
+            raise Exception("Artifact contains unknown parameter %s" % name)
+        logger.debug("Artifact contains unknown parameter %s, asking for it", name)
+        try:
+            value = self.utils.askFor(
+                name,
+                {"description":
+                 "Missing parameter '%s', provide the value or fix your %s" % (
+                     name, MAIN_FILE)})
+        except EOFError:
+            raise Exception("Artifact contains unknown parameter %s" % name)
+        if not len(value):
+            printErrorStatus("Artifact contains unknown parameter %s." % name)
+            raise Exception("Artifact contains unknown parameter %s" % name)
+        self.nulecule_base.loadAnswers({component: {name: value}})
+        return value
+
+    @staticmethod
+    def _targetDir(dst_dir, target):
+        return os.path.join(dst_dir, "targets", Utils.sanitizeName(target))
+
+    def _processArtifacts(self, component, provider, provider_name=None, targets=None):
+        """
+        Render artifacts of the component for the given provider into its
+        path, the component's directory in the working directory. With
+        targets, every artifact is rendered once with a placeholder for the
+        provider's target_key value, and a copy with the placeholder
+        replaced is saved for each target.
+        """
         if not provider_name:
             provider_name = str(provider)
 
@@ -163,39 +304,56 @@ class Run(object):
             msg = "Data for provider \"%s\" are not part of this app" % provider_name
             raise Exception(msg)
 
-        dst_dir = os.path.join(self.utils.workdir, component)
+        dst_dir = provider.path
         data = None
+        overrides = None
+        if targets:
+            overrides = {provider.target_key: TARGET_PLACEHOLDER}
 
         for artifact in artifacts[provider_name]:
             if "inherit" in artifact:
                 logger.debug("Inheriting from %s", artifact["inherit"])
                 for item in artifact["inherit"]:
                     inherited_artifacts, _ = self._processArtifacts(
-                        component, provider, item)
+                        component, provider, item, targets)
                     artifact_provider_list += inherited_artifacts
                 continue
             artifact_path = self.utils.sanitizePath(artifact)
             data = provider.loadArtifact(os.path.join(self.app_path, artifact_path))
 
             logger.debug("Templating artifact %s/%s", self.app_path, artifact_path)
-            data = self._applyTemplate(data, component)
-
-            artifact_dst = os.path.join(dst_dir, artifact_path)
-
-            provider.saveArtifact(artifact_dst, data)
+            with tracer.span("applyTemplate", component=component,
+                             provider=provider_name, artifact=artifact_path):
+                data = self._applyTemplate(data, component, overrides)
+
+            if targets:
+                for target in targets:
+                    artifact_dst = os.path.join(self._targetDir(dst_dir, target), artifact_path)
+                    provider.saveArtifact(artifact_dst, data.replace(TARGET_PLACEHOLDER, target))
+            else:
+                artifact_dst = os.path.join(dst_dir, artifact_path)
+                provider.saveArtifact(artifact_dst, data)
 
             artifact_provider_list.append(artifact_path)
 
         return artifact_provider_list, dst_dir
 
     def _processComponent(self, component, graph_item):
+        # Deploying the component is its own "component" span, see _componentTask
+        with tracer.span("render", component=component,
+                         provider=self.nulecule_base.provider):
+            self._processProvider(component, graph_item)
+
+    def _processProvider(self, component, graph_item):
         logger.debug(
             "Processing component '%s' and graph item '%s'", component, graph_item)
 
-        provider_class = self.plugin.getProvider(self.nulecule_base.provider)
+        provider_class = self.context.getProvider(self.nulecule_base.provider)
         dst_dir = os.path.join(self.utils.workdir, component)
         provider = provider_class(
-            self.nulecule_base.getValues(component), dst_dir, self.dryrun)
+            self.nulecule_base.getResolver().getValues(component), dst_dir, self.dryrun)
+        provider.artifact_cache = self.context.getCache("artifacts")
+        provider.labels = self._objectLabels(component)
         if provider:
             printStatus("Deploying component %s ..." % component)
             logger.info("Using provider %s for component %s",
@@ -203,35 +361,266 @@ class Run(object):
         else:
             raise Exception("Something is broken - couldn't get the provider")
 
-        provider.artifacts, dst_dir = self._processArtifacts(component, provider)
+        targets = self.kwargs.get("targets")
+        if targets:
+            if not provider.target_key:
+                raise Exception("Provider %s does not support deploying to several targets"
+                                % self.nulecule_base.provider)
+            artifacts, dst_dir = self._processArtifacts(component, provider, targets=targets)
+            providers = self._targetProviders(
+                component, provider_class, artifacts, dst_dir, targets)
+            self._addDeployment(component, providers, self._fanOut(component, providers))
+            return
 
+        provider.artifacts, dst_dir = self._processArtifacts(component, provider)
+        self._addDeployment(component, [provider], self._providerTask(component, provider))
+
+    def _objectLabels(self, component):
+        return objectLabels(self.nulecule_base.app_id, component, self.context.run_id,
+                            self._instance())
+
+    def _instance(self):
+        """Instance label of the deployment, nested runs use the one of the top-level run."""
+        if self.context.instance:
+            return self.context.instance
+        return instanceId(self.context.root.utils.workdir)
+
+    def _addDeployment(self, component, providers, task):
+        deployment = Deployment(self.nulecule_base.app_id, component, providers, None)
+        deployment.task = self._componentTask(deployment, task)
+        self.context.deployments.append(deployment)
+
+    def _componentTask(self, deployment, task):
+        with tracer.span("component", component=deployment.component,
+                         provider=self.nulecule_base.provider), \
+                events.phase("component", app=deployment.app_id,
+                             component=deployment.component,
+                             index=deployment.index, total=deployment.total):
+            yield task
+
+    def _deploy(self):
+        """
+        Deploy or undeploy all rendered components, of external apps too, as
+        one graph of tasks in a single engine: a component starts once the
+        components it depends on are done, see _addDependencies. With a plan
+        the provider calls are added to it as steps instead.
+        """
+        deployments = self.context.deployments
+        if not deployments:
+            return
+
+        graph = Graph([deployment.task for deployment in deployments],
+                      [deployment.depends_on for deployment in deployments])
+        if self.context.plan is not None:
+            self.context.plan.data["instance"] = self._instance()
+            self._addSteps(graph.order)
+            return
+        runTask(graph)
+
+    def _addSteps(self, order):
+        """
+        Add a step per provider of each deployment, in the order of the
+        graph. A step depends on the steps of the deployments its deployment
+        depends on; the targets of a fan-out do not depend on each other.
+        """
+        action = "undeploy" if self.stop else "deploy"
+        steps = {}
+        for index in order:
+            deployment = self.context.deployments[index]
+            depends_on = set()
+            for dep in deployment.depends_on:
+                depends_on.update(steps[dep])
+            steps[index] = [
+                self.context.plan.addStep(deployment.app_id, deployment.component,
+                                          provider, action, depends_on)
+                for provider in deployment.providers]
+
+    def _providerTask(self, component, provider):
+        """Deploy or undeploy the component with provider, as an engine task."""
+        action = "undeploy" if self.stop else "deploy"
+        if self.context.state is not None:
+            provider.state = ComponentState(
+                self.context.state, self.nulecule_base.app_id, component, self.context.run_id,
+                self.context.checkpoints)
+
+        if self.context.checkpoints and not self.stop and provider.artifacts and \
+                all(provider.isDeployed(os.path.join(provider.path, artifact))
+                    for artifact in provider.artifacts):
+            printStatus("Component %s was deployed before resuming, skipping." % component)
+            for artifact in provider.artifacts:
+                provider.resumeArtifact(os.path.join(provider.path, artifact))
+            return
+
+        target = provider.config.get(provider.target_key) if provider.target_key else None
         try:
-            provider.init()
-            if self.stop:
-                provider.undeploy()
-            else:
-                provider.deploy()
-        except ProviderFailedException as ex:
+            with tracer.span("provider.init", provider=provider, target=target):
+                yield provider.initAsync()
+            with tracer.span("provider.%s" % action, provider=provider, target=target,
+                             artifacts=len(provider.artifacts)):
+                if self.stop:
+                    yield provider.undeployAsync()
+                else:
+                    yield provider.deployAsync()
+        except (ProviderFailedException, CommandFailedException) as ex:
             printErrorStatus(ex)
             logger.error(ex)
             raise
 
+    def _targetProviders(self, component, provider_class, artifacts, dst_dir, targets):
+        """Providers deploying the artifacts rendered for fan-out, one per target."""
+        base_config = self.nulecule_base.getResolver().getValues(component)
+        providers = []
+        for target in targets:
+            config = dict(base_config)
+            config[provider_class.target_key] = target
+            provider = provider_class(config, self._targetDir(dst_dir, target), self.dryrun)
+            provider.artifacts = artifacts
+            provider.labels = self._objectLabels(component)
+            providers.append(provider)
+        return providers
+
+    def _fanOut(self, component, providers):
+        """Deploy already rendered artifacts to all targets concurrently."""
+
+        def deploy(provider):
+            target = provider.config[provider.target_key]
+            try:
+                with events.phase("target", app=self.nulecule_base.app_id,
+                                  component=component, target=target):
+                    yield self._providerTask(component, provider)
+            except Exception as ex:
+                logger.error("Component %s failed for target %s: %s", component, target, repr(ex))
+                raise Return((target, str(ex)))
+            raise Return((target, None))
+
+        # The targets are deployed to concurrently from a single thread
+        results = yield All([deploy(provider) for provider in providers])
+
+        failed = []
+        for target, error in results:
+            if error:
+                printErrorStatus("Component %s failed for target %s: %s." % (component, target, error))
+                failed.append(target)
+            else:
+                printStatus("Component %s done for target %s." % (component, target))
+
+        if failed:
+            raise Exception("Component %s failed for targets %s" % (component, ", ".join(failed)))
+
     def run(self):
+        with tracer.span("run", app=self.app_path, nested=self.nested), \
+                events.phase("stop" if self.stop else "run", app=self.app_path,
+                             nested=self.nested):
+            if self.stop and not self.nested and self.context.plan is None:
+                stop = self._loadStop()
+                if stop:
+                    return stop.stop(self.nulecule_base.app_id)
+                logger.info("Nothing recorded in %s, stopping by rendering the app",
+                            self.utils.workdir)
+            if self.nested or self.dryrun or self.context.plan is not None:
+                return self._run()
+            return self._recordRun()
+
+    def _loadStop(self):
+        """Stop from the objects recorded when the app was deployed, if any."""
+        self.nulecule_base.loadMainfile(
+            os.path.join(self.nulecule_base.target_path, MAIN_FILE))
+        answers = self.nulecule_base.loadAnswers(self.answers_file)
+        return Stop.load(self.utils.workdir, answers.get(GLOBAL_CONF), self.dryrun,
+                         self.kwargs.get("targets"), self.context)
+
+    def _recordRun(self):
+        """Run and record the run and the objects it deploys in the state store."""
+        state = StateStore.open(self.utils.workdir)
+        app_id = Utils.getAppId(os.path.join(self.app_path, MAIN_FILE)) or ""
+        self.context.state = state
+        self.context.instance = state.getInstance(instanceId(self.utils.workdir))
+        if self.kwargs.get("resume") and not self.stop:
+            self.context.checkpoints = self._resumeCheckpoints(state, app_id)
+        self.context.run_id = state.startRun(app_id, "undeploy" if self.stop else "deploy")
+        try:
+            result = self._run()
+            if self.kwargs.get("prune") and not self.stop:
+                self._prune(state)
+        except Exception:
+            state.finishRun(self.context.run_id, "failed")
+            raise
+        else:
+            state.finishRun(self.context.run_id, "success")
+        finally:
+            self.context.state = None
+            self.context.instance = None
+            self.context.checkpoints = None
+            state.close()
+
+        return result
+
+    @staticmethod
+    def _resumeCheckpoints(state, app_id):
+        """Checkpoints of the last run of the app if it deployed it, else None."""
+        runs = state.getRuns(app_id)
+        if not runs or runs[-1]["action"] != "deploy":
+            printStatus("No deployment of %s to resume, deploying all components." % app_id)
+            return None
+
+        checkpoints = state.getCheckpoints(runs[-1]["id"])
+        printStatus("Resuming %s run %s, %s artifacts were deployed." % (
+            runs[-1]["status"] or "interrupted", runs[-1]["id"], len(checkpoints)))
+        return checkpoints
+
+    def _prune(self, state):
+        """
+        Delete the objects of components that were deployed before but are
+        no longer in the graph of their app, f.e. after a component was
+        removed from the Nulecule.
+        """
+        components = self.context.components
+        orphans = [obj for obj in state.getObjects()
+                   if obj["component"] not in components.get(obj["app_id"], [obj["component"]])]
+        if not orphans:
+            return
+
+        printStatus("Pruning %s objects of removed components ..." % len(orphans))
+        stop = Stop(state, self.context.getAnswers().get(GLOBAL_CONF), self.dryrun,
+                    self.kwargs.get("targets"), self.context, objects=orphans)
+        stop.delete()
+
+    def _checkSchema(self):
+        """Fail on any error in the Nulecule files of the app tree, before anything else."""
+        errors = checkApp(self.app_path, self.context.schema_checked,
+                          self.nulecule_base.mainfile_cache)
+        if errors:
+            for error in errors:
+                printErrorStatus(error)
+            raise SchemaError(errors)
+
+    def _run(self):
+        self._checkSchema()
         self.nulecule_base.loadMainfile(
             os.path.join(self.nulecule_base.target_path, MAIN_FILE))
         self.nulecule_base.checkSpecVersion()
-        self.nulecule_base.loadAnswers(self.answers_file)
+        if self.nested:
+            self.nulecule_base.loadAnswers(self.context.getAnswers())
+        else:
+            self.nulecule_base.loadAnswers(self.answers_file)
+            self.context.setAnswers(self.nulecule_base.answers_data)
 
-        self.nulecule_base.checkAllArtifacts()
+        self._validate()
+        if self.context.needsArtifactCheck(self.app_path):
+            self.nulecule_base.checkAllArtifacts()
         config = self.nulecule_base.get()
         if "provider" in config:
             self.provider = config["provider"]
 
         self._dispatchGraph()
+        if not self.nested:
+            self._deploy()
 
-# Think about this a bit more probably - it's (re)written for all components...
+        # Nested runs hand their answers up to the parent, only the top-level
+        # run writes the file once all components have been processed
         if self.answers_output:
-            self.nulecule_base.writeAnswers(self.answers_output)
+            if not self.nested:
+                self.nulecule_base.writeAnswers(self.answers_output)
             return self.nulecule_base.answers_data
 
         return None
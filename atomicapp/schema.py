@@ -0,0 +1,324 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import re
+import json
+
+import anymarkup
+import logging
+
+from constants import MAIN_FILE, PARAMS_KEY, __NULECULESPECVERSION__
+from utils import Utils
+from bundle import isAppFile, readAppFile, appFileKey
+
+logger = logging.getLogger(__name__)
+
+STRING = {"type": "string"}
+PARAMS = {"type": "array", "items": {
+    "type": "object", "required": ["name"], "properties": {
+        "name": STRING,
+        "description": STRING,
+        "constraints": {"type": "array", "items": {
+            "type": "object", "required": ["allowed_pattern"], "properties": {
+                "allowed_pattern": {"type": "string", "format": "regex"},
+                "description": STRING}}}}}}
+ARTIFACT = {"anyOf": [
+    {"type": "string", "pattern": "^file://.+"},
+    {"type": "object", "required": ["inherit"], "properties": {
+        "inherit": {"type": "array", "items": STRING}}}],
+    "description": "a file:// URL or an inherit list"}
+COMPONENT = {"type": "object", "required": ["name"], "properties": {
+    "name": STRING,
+    "source": {"type": "string", "pattern": "^docker://.+"},
+    PARAMS_KEY: PARAMS,
+    "artifacts": {"type": "object", "additionalProperties": {
+        "type": "array", "minItems": 1, "items": ARTIFACT}}}}
+
+# Schema of the Nulecule file per spec version, in the subset of JSON
+# Schema understood by compileSchema
+NULECULE_SCHEMAS = {
+    __NULECULESPECVERSION__: {
+        "type": "object", "required": ["specversion", "id", "graph"], "properties": {
+            "specversion": STRING,
+            "id": STRING,
+            "metadata": {"type": "object"},
+            "requirements": {"type": "array"},
+            PARAMS_KEY: PARAMS,
+            "graph": {"type": "array", "minItems": 1, "items": COMPONENT}}}
+}
+
+TYPES = {
+    "object": (dict, "an object"),
+    "array": (list, "a list"),
+    "string": (basestring, "a string"),
+    "boolean": (bool, "a boolean"),
+}
+# Providers whose artifacts are Kubernetes style objects with a kind
+KIND_PROVIDERS = ("kubernetes", "openshift")
+KIND_RE = re.compile(r'"kind"\s*:\s*"[${}\w]+"|^\s*kind\s*:\s*\S', re.MULTILINE)
+
+
+class SchemaError(Exception):
+
+    """Nulecule files of an app do not match the Nulecule specification"""
+
+    def __init__(self, errors):
+        Exception.__init__(
+            self, "%s error(s) in %s files:\n%s"
+            % (len(errors), MAIN_FILE, "\n".join(errors)))
+        self.errors = errors
+
+
+def _show(value):
+    return json.dumps(value, default=str)
+
+
+def _child(location, key):
+    if isinstance(key, int):
+        return "%s[%d]" % (location, key)
+    return "%s.%s" % (location, key) if location else key
+
+
+class _Node(object):
+    """One compiled schema, check appends (location, message) for every error."""
+
+    def __init__(self, schema):
+        self.type, self.type_name = TYPES.get(schema.get("type"), (None, None))
+        self.required = schema.get("required", [])
+        self.properties = dict((name, _Node(child))
+                               for name, child in schema.get("properties", {}).iteritems())
+        self.additional = _Node(schema["additionalProperties"]) \
+            if "additionalProperties" in schema else None
+        self.items = _Node(schema["items"]) if "items" in schema else None
+        self.min_items = schema.get("minItems")
+        self.pattern = re.compile(schema["pattern"]) if "pattern" in schema else None
+        self.regex = schema.get("format") == "regex"
+        self.any_of = [_Node(child) for child in schema.get("anyOf", [])]
+        self.description = schema.get("description")
+
+    def check(self, value, location, errors):
+        if self.any_of:
+            for node in self.any_of:
+                option_errors = []
+                node.check(value, location, option_errors)
+                if not option_errors:
+                    return
+            errors.append((location, "has to be %s" % self.description))
+            return
+
+        if self.type and not isinstance(value, self.type):
+            errors.append((location, "has to be %s, not %s" % (self.type_name, _show(value))))
+            return
+
+        if isinstance(value, dict):
+            for name in self.required:
+                if name not in value:
+                    errors.append((location, "%s is missing" % name))
+            for name, item in sorted(value.iteritems()):
+                node = self.properties.get(name, self.additional)
+                if node:
+                    node.check(item, _child(location, name), errors)
+        elif isinstance(value, list):
+            if self.min_items and len(value) < self.min_items:
+                errors.append((location, "needs at least %s item(s)" % self.min_items))
+            if self.items:
+                for index, item in enumerate(value):
+                    self.items.check(item, _child(location, index), errors)
+        elif isinstance(value, basestring):
+            if self.pattern and not self.pattern.match(value):
+                errors.append((location, "%s does not match %s" % (_show(value),
+                                                                   self.pattern.pattern)))
+            if self.regex:
+                try:
+                    re.compile(value)
+                except re.error as ex:
+                    errors.append((location, "is not a valid pattern: %s" % ex))
+
+
+def compileSchema(schema):
+    return _Node(schema)
+
+
+# Compiled once, when Atomic App starts
+COMPILED_SCHEMAS = dict((version, compileSchema(schema))
+                        for version, schema in NULECULE_SCHEMAS.iteritems())
+
+
+def _checkArtifacts(app_path, component, errors, warnings):
+    artifacts = component.get("artifacts")
+    if not isinstance(artifacts, dict):
+        return
+
+    # provider -> {inherited provider: location of the inherit}
+    inherits = {}
+    for provider, artifact_list in sorted(artifacts.iteritems()):
+        if not isinstance(artifact_list, list):
+            continue
+        for index, artifact in enumerate(artifact_list):
+            location = _child(_child("artifacts", provider), index)
+            if isinstance(artifact, dict):
+                for inherit in artifact.get("inherit") or []:
+                    if inherit not in artifacts:
+                        errors.append((location, "inherits from %s which has no artifacts "
+                                       "in the component" % inherit))
+                    else:
+                        inherits.setdefault(provider, {}).setdefault(inherit, location)
+                continue
+            if not isinstance(artifact, basestring) or not artifact.startswith("file://"):
+                continue
+
+            path = os.path.join(app_path, Utils.sanitizePath(artifact))
+            if not isAppFile(path):
+                errors.append((location, "artifact %s does not exist" % artifact))
+                continue
+            data = readAppFile(path)
+            # Only warnings, the kind may come from a param and providers run
+            # docker artifacts whatever the command is
+            if provider in KIND_PROVIDERS and not KIND_RE.search(data):
+                warnings.append((location, "artifact %s has no kind" % artifact))
+            elif provider == "docker" and "docker" not in data:
+                warnings.append((location, "artifact %s does not run docker" % artifact))
+
+    # Rendering follows inherits recursively, a cycle would never end
+    for cycle in _inheritCycles(inherits):
+        errors.append((inherits[cycle[0]][cycle[1 % len(cycle)]],
+                       "inherit cycle %s" % " -> ".join(cycle + [cycle[0]])))
+
+
+def _inheritCycles(inherits):
+    """Cycles of the provider -> inherited providers graph, each once."""
+    cycles = set()
+
+    def visit(provider, path):
+        for inherit in sorted(inherits.get(provider, {})):
+            if inherit in path:
+                cycle = path[path.index(inherit):]
+                # The same cycle found from another provider starts elsewhere
+                start = cycle.index(min(cycle))
+                cycles.add(tuple(cycle[start:] + cycle[:start]))
+            else:
+                visit(inherit, path + [inherit])
+
+    for provider in sorted(inherits):
+        visit(provider, [provider])
+    return [list(cycle) for cycle in sorted(cycles)]
+
+
+def _checkGraph(app_path, graph, errors, warnings):
+    """Checks the schema can not express, returns the installed external apps."""
+    externals = []
+    names = set()
+    for index, component in enumerate(graph):
+        if not isinstance(component, dict) or not isinstance(component.get("name"), basestring):
+            continue
+        location = _child("graph", index)
+        name = component["name"]
+        if name in names:
+            errors.append((location, "component %s is defined more than once" % name))
+        names.add(name)
+
+        component_errors = []
+        component_warnings = []
+        if "artifacts" in component:
+            _checkArtifacts(app_path, component, component_errors, component_warnings)
+        elif "source" in component:
+            external_path = Utils(app_path).getExternalAppDir(name)
+            if isAppFile(os.path.join(external_path, MAIN_FILE)):
+                externals.append(external_path)
+        else:
+            component_errors.append(("", "needs artifacts or an external source"))
+        errors += [(_child(location, child) if child else location, message)
+                   for child, message in component_errors]
+        warnings += [(_child(location, child), message)
+                     for child, message in component_warnings]
+
+    return externals
+
+
+def _parseMainfile(path, cache):
+    if cache is None:
+        return anymarkup.parse(readAppFile(path))
+
+    # Shared with NuleculeBase, parsed once per run even when checked first
+    key = appFileKey(path)
+    data = cache.get(key)
+    if data is None:
+        data = cache[key] = anymarkup.parse(readAppFile(path))
+    return data
+
+
+def checkMainfile(app_path, cache=None):
+    """
+    (location, message) errors and warnings of the Nulecule of the app, and
+    its installed external apps. cache is a NuleculeBase.mainfile_cache.
+    """
+    path = os.path.join(app_path, MAIN_FILE)
+    try:
+        data = _parseMainfile(path, cache)
+    except (anymarkup.AnyMarkupError, IOError, OSError) as ex:
+        return [("", "can not be parsed: %s" % ex)], [], []
+
+    if not isinstance(data, dict):
+        return [("", "has to be an object")], [], []
+    schema = COMPILED_SCHEMAS.get(data.get("specversion"))
+    if not schema:
+        return [("specversion", "%s is not supported, use %s" % (
+            _show(data.get("specversion")), ", ".join(sorted(COMPILED_SCHEMAS))))], [], []
+
+    errors = []
+    warnings = []
+    schema.check(data, "", errors)
+    externals = []
+    if isinstance(data.get("graph"), list):
+        externals = _checkGraph(app_path, data["graph"], errors, warnings)
+    return errors, warnings, externals
+
+
+def checkApp(app_path, checked=None, cache=None, recursive=True):
+    """
+    Check the Nulecule files of the app and of all its installed external
+    apps against the schema of their spec version, including that their
+    artifacts exist. Every error is reported as "FILE: LOCATION: message",
+    nothing stops at the first. Artifacts which do not look like what their
+    provider deploys are only logged as warnings. Apps in checked (real
+    paths) are skipped, checked apps are added to it. Without recursive
+    only the Nulecule of the app itself is checked.
+    """
+    if checked is None:
+        checked = set()
+
+    errors = []
+    pending = [app_path]
+    while pending:
+        path = pending.pop(0)
+        if os.path.realpath(path) in checked:
+            continue
+        checked.add(os.path.realpath(path))
+
+        mainfile = os.path.relpath(os.path.join(path, MAIN_FILE), app_path)
+        app_errors, app_warnings, externals = checkMainfile(path, cache)
+        errors += ["%s: %s: %s" % (mainfile, location or "top level", message)
+                   for location, message in app_errors]
+        for location, message in app_warnings:
+            logger.warning("%s: %s: %s", mainfile, location, message)
+        if recursive:
+            pending += externals
+
+    return errors
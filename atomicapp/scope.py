@@ -0,0 +1,52 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import threading
+from contextlib import contextmanager
+
+# Request served by the current thread, inherited by the work it hands to
+# other threads (engine workers, command pools) through inherit()
+_local = threading.local()
+
+
+def current():
+    """Request the current thread works for, None outside of one."""
+    return getattr(_local, "request", None)
+
+
+@contextmanager
+def working(request):
+    """Work for request in the current thread until the block ends."""
+    previous = current()
+    _local.request = request
+    try:
+        yield request
+    finally:
+        _local.request = previous
+
+
+def inherit(func):
+    """Wrap func to run for the request of the caller, in whichever thread."""
+    request = current()
+
+    def call(*args, **kwargs):
+        with working(request):
+            return func(*args, **kwargs)
+    return call
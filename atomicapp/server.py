@@ -0,0 +1,174 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import re
+import json
+import SocketServer
+
+import logging
+
+from context import RunContext
+from install import Install
+from lock import AppLock
+from plugin import Plugin
+from run import Run
+from scope import current, working
+from utils import Utils
+from constants import ANSWERS_FILE
+
+logger = logging.getLogger(__name__)
+
+STATUS_RE = re.compile(r"^atomicapp\.status\.(\w+)\.message=(.*)$", re.DOTALL)
+
+
+class StatusForwarder(logging.Handler):
+    """
+    Send status messages logged for one request to its client, by the
+    request thread or by the worker threads it hands work to.
+    """
+
+    def __init__(self, handler):
+        logging.Handler.__init__(self)
+        self.handler = handler
+
+    def emit(self, record):
+        if current() is not self:
+            return
+
+        match = STATUS_RE.match(record.getMessage())
+        if match:
+            self.handler.send(
+                {"event": "status", "type": match.group(1), "message": match.group(2)})
+
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        for line in iter(self.rfile.readline, ""):
+            if not line.strip():
+                continue
+
+            try:
+                request = json.loads(line)
+                if type(request) != dict:
+                    raise ValueError("Request has to be a JSON object")
+            except ValueError as ex:
+                self.send({"event": "result", "success": False, "error": str(ex)})
+                continue
+
+            self.process(request)
+
+    def send(self, data):
+        try:
+            self.wfile.write(json.dumps(data) + "\n")
+            self.wfile.flush()
+        except (IOError, OSError) as ex:
+            logger.debug("Client went away: %s", ex)
+
+    def process(self, request):
+        forwarder = StatusForwarder(self)
+        logging.getLogger().addHandler(forwarder)
+        try:
+            with working(forwarder):
+                self.server.execute(request)
+            self.send({"event": "result", "success": True})
+        except Exception as ex:
+            logger.error("Request %s failed: %s", request, repr(ex))
+            self.send({"event": "result", "success": False, "error": str(ex)})
+        finally:
+            logging.getLogger().removeHandler(forwarder)
+
+
+class Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """
+    Long-running Atomic App service. It keeps plugins, the docker client and
+    parsed Nulecule files loaded between requests, the caches of files only
+    keep the entries used last (see RunContext.getCache). Requests for different
+    apps run concurrently, requests for the same app wait for each other.
+
+    Clients connect to a unix socket and send one request per line as a
+    JSON object, for example:
+
+        {"action": "run", "APP": "/srv/apps/helloapache", "dryrun": true}
+
+    "action" is one of "install", "run" or "stop", the remaining keys are
+    the options of the matching CLI command ("answers", "answers_output",
+    "target_path", "nodeps", "update", "image", ...). "lock_timeout" works
+    like the CLI option but defaults to waiting forever.
+
+    For every request the server streams back JSON lines: one
+    {"event": "status", "type": ..., "message": ...} per atomicapp.status.*
+    message (type is "info", "error" or "answer") followed by a single
+    {"event": "result", "success": ...} line, which carries "error" on
+    failure.
+
+    Nothing is asked for while serving a request: params without a value in
+    the answers or a default fail the request with the list of them.
+    """
+
+    daemon_threads = True
+    actions = ("install", "run", "stop")
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        SocketServer.UnixStreamServer.__init__(self, socket_path, RequestHandler)
+
+        self.plugin = Plugin()
+        self.plugin.load_plugins()
+        self.docker_cli = Utils.getDockerCli(required=False)
+        self.cache = {}
+        logger.info("Listening on %s", socket_path)
+
+    def _context(self, dryrun):
+        return RunContext(dryrun, plugin=self.plugin, docker_cli=self.docker_cli,
+                          cache=self.cache, interactive=False)
+
+    def execute(self, request):
+        args = dict((str(key), value) for key, value in request.iteritems())
+        action = args.pop("action", None)
+        if action not in self.actions:
+            raise ValueError("Unknown action %s, use one of %s" % (action, ", ".join(self.actions)))
+        if "APP" not in args:
+            raise ValueError("Missing APP")
+
+        if action == "install":
+            lock_path = args.get("target_path") or args["APP"]
+        else:
+            lock_path = args["APP"]
+        if not args.get("answers"):
+            args["answers"] = os.path.join(lock_path, ANSWERS_FILE)
+
+        lock = AppLock(lock_path, args.pop("lock_timeout", -1))
+        lock.acquire()
+        try:
+            context = self._context(args.get("dryrun", False))
+            if action == "install":
+                Install(context=context, **args).install()
+            else:
+                Run(stop=(action == "stop"), context=context, **args).run()
+        finally:
+            lock.release()
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
@@ -0,0 +1,264 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import time
+import uuid
+import hashlib
+import sqlite3
+import threading
+
+import logging
+
+from constants import STATE_FILE
+
+logger = logging.getLogger(__name__)
+
+STATE_VERSION = 3
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id TEXT PRIMARY KEY,
+    app_id TEXT NOT NULL,
+    action TEXT NOT NULL,
+    started REAL NOT NULL,
+    finished REAL,
+    status TEXT
+);
+CREATE TABLE IF NOT EXISTS objects (
+    app_id TEXT NOT NULL,
+    component TEXT NOT NULL,
+    provider TEXT NOT NULL,
+    target TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    artifact TEXT,
+    hash TEXT,
+    run_id TEXT,
+    deployed REAL NOT NULL,
+    duration REAL,
+    PRIMARY KEY (app_id, component, provider, target, kind, name)
+);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    run_id TEXT NOT NULL,
+    app_id TEXT NOT NULL,
+    component TEXT NOT NULL,
+    provider TEXT NOT NULL,
+    target TEXT NOT NULL,
+    artifact TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    finished REAL NOT NULL,
+    PRIMARY KEY (run_id, app_id, component, provider, target, artifact)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE INDEX IF NOT EXISTS objects_component ON objects (component, app_id);
+CREATE INDEX IF NOT EXISTS objects_kind ON objects (kind, target);
+CREATE INDEX IF NOT EXISTS runs_app ON runs (app_id, started);
+"""
+OBJECT_FILTERS = ("app_id", "component", "provider", "target", "kind")
+
+
+def contentHash(data):
+    return "sha256:%s" % hashlib.sha256(data).hexdigest()
+
+
+class StateStore(object):
+    """
+    Record of what was deployed from a working directory, kept in an
+    SQLite database next to the rendered artifacts.
+
+    "objects" holds what is deployed right now - one row per object with
+    the provider and target it went to, the artifact it was created from
+    with its content hash and how long creating it took. Undeploying an
+    object removes its row. "runs" keeps the history of runs with their
+    outcome. Nested runs of external apps share the working directory, so
+    the store covers the whole application graph. "checkpoints" has the
+    artifacts every run deployed, for resuming a failed run. "meta" has
+    the instance label of the deployment, see labels.instanceId.
+    """
+
+    path = None
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        # Targets are deployed to from the fan-out threads
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.lock, self.connection:
+            version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+            if version > STATE_VERSION:
+                raise ValueError("State %s was written by a newer Atomic App (version %s)"
+                                 % (path, version))
+            self.connection.executescript(SCHEMA)
+            self.connection.execute("PRAGMA user_version = %d" % STATE_VERSION)
+
+    @classmethod
+    def open(cls, workdir):
+        return cls(os.path.join(workdir, STATE_FILE))
+
+    def close(self):
+        self.connection.close()
+
+    def _execute(self, sql, params=()):
+        with self.lock, self.connection:
+            return self.connection.execute(sql, params)
+
+    def _query(self, sql, params=()):
+        with self.lock:
+            return [dict(row) for row in self.connection.execute(sql, params)]
+
+    def getInstance(self, default=None):
+        """
+        Instance label of the objects deployed from here, default is
+        recorded as the instance if there is none yet (and then returned).
+        """
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "SELECT value FROM meta WHERE key = 'instance'").fetchone()
+            if row:
+                return row[0]
+            if default:
+                self.connection.execute(
+                    "INSERT INTO meta (key, value) VALUES ('instance', ?)", (default,))
+            return default
+
+    def setInstance(self, instance):
+        self._execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('instance', ?)",
+                      (instance,))
+
+    def startRun(self, app_id, action):
+        run_id = uuid.uuid4().hex
+        self._execute("INSERT INTO runs (id, app_id, action, started) VALUES (?, ?, ?, ?)",
+                      (run_id, app_id, action, time.time()))
+        return run_id
+
+    def finishRun(self, run_id, status):
+        self._execute("UPDATE runs SET finished = ?, status = ? WHERE id = ?",
+                      (time.time(), status, run_id))
+
+    def getRuns(self, app_id=None):
+        if app_id:
+            return self._query("SELECT * FROM runs WHERE app_id = ? ORDER BY started", (app_id,))
+        return self._query("SELECT * FROM runs ORDER BY started")
+
+    def checkpoint(self, run_id, app_id, component, provider, target, artifact,
+                   content_hash):
+        self._execute(
+            "INSERT OR REPLACE INTO checkpoints (run_id, app_id, component, provider, "
+            "target, artifact, hash, finished) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (run_id, app_id, component, provider, target or "", artifact, content_hash,
+             time.time()))
+
+    def getCheckpoints(self, run_id):
+        """(app_id, component, provider, target, artifact) -> hash deployed by the run."""
+        rows = self._query("SELECT * FROM checkpoints WHERE run_id = ?", (run_id,))
+        return dict(((row["app_id"], row["component"], row["provider"], row["target"],
+                      row["artifact"]), row["hash"]) for row in rows)
+
+    def recordObject(self, app_id, component, provider, target, kind, name,
+                     artifact=None, content_hash=None, run_id=None, started=None):
+        finished = time.time()
+        if started is None:
+            started = finished
+        self._execute(
+            "INSERT OR REPLACE INTO objects (app_id, component, provider, target, kind, "
+            "name, artifact, hash, run_id, deployed, duration) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (app_id, component, provider, target or "", kind, name, artifact, content_hash,
+             run_id, started, finished - started))
+
+    def removeObject(self, app_id, component, provider, target, kind, name):
+        self._execute(
+            "DELETE FROM objects WHERE app_id = ? AND component = ? AND provider = ? "
+            "AND target = ? AND kind = ? AND name = ?",
+            (app_id, component, provider, target or "", kind, name))
+
+    def getObjects(self, **filters):
+        """Deployed objects in the order they were deployed, f.e. getObjects(kind="service")."""
+        unknown = set(filters) - set(OBJECT_FILTERS)
+        if unknown:
+            raise ValueError("Can not filter objects by %s" % ", ".join(sorted(unknown)))
+
+        names = sorted(name for name in filters if filters[name] is not None)
+        where = " AND ".join("%s = ?" % name for name in names) or "1"
+        return self._query("SELECT * FROM objects WHERE %s ORDER BY deployed, rowid" % where,
+                           [filters[name] for name in names])
+
+
+class ComponentState(object):
+    """
+    The part of the state a provider deploying one component writes to,
+    see Provider.recordObjects.
+
+    checkpoints are those of the run being resumed, see StateStore.getCheckpoints.
+    Artifacts are checkpointed with the hash of their content without the
+    id of the run (it is in the run label of every object), so the hashes
+    of two runs match when the artifacts were rendered from the same
+    sources and params.
+    """
+
+    def __init__(self, store, app_id, component, run_id=None, checkpoints=None):
+        self.store = store
+        self.app_id = app_id
+        self.component = component
+        self.run_id = run_id
+        self.checkpoints = checkpoints or {}
+
+    def _artifact(self, path):
+        # Relative to the working directory, which holds the database
+        return os.path.relpath(path, os.path.dirname(self.store.path))
+
+    def record(self, provider, kind, name, path, started=None):
+        with open(path, "r") as fp:
+            content_hash = contentHash(fp.read())
+        self.store.recordObject(
+            self.app_id, self.component, provider.key, provider.getTarget(), kind, name,
+            self._artifact(path), content_hash, self.run_id, started)
+
+    def _inputHash(self, path):
+        with open(path, "r") as fp:
+            data = fp.read()
+        if self.run_id:
+            data = data.replace(self.run_id, "")
+        return contentHash(data)
+
+    def checkpoint(self, provider, path):
+        self.store.checkpoint(
+            self.run_id, self.app_id, self.component, provider.key, provider.getTarget(),
+            self._artifact(path), self._inputHash(path))
+
+    def isDeployed(self, provider, path):
+        """Whether the run being resumed deployed the artifact at path as it is now."""
+        key = (self.app_id, self.component, provider.key, provider.getTarget() or "",
+               self._artifact(path))
+        return key in self.checkpoints and self.checkpoints[key] == self._inputHash(path)
+
+    def remove(self, provider, kind, name):
+        self.store.removeObject(
+            self.app_id, self.component, provider.key, provider.getTarget(), kind, name)
+
+    def getObjects(self, provider=None):
+        return self.store.getObjects(
+            app_id=self.app_id, component=self.component,
+            provider=provider.key if provider else None)
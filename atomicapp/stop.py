@@ -0,0 +1,155 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+from collections import OrderedDict
+
+import logging
+
+from constants import STATE_FILE
+from state import StateStore
+from plugin import ProviderFailedException
+from labels import appSelector, componentSelector
+from command import CommandFailedException
+from utils import printStatus, printErrorStatus
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+def recordedProvider(context, key, target, config, workdir, dryrun):
+    """Provider for objects recorded in the state, deployed to target."""
+    provider_class = context.getProvider(key)
+    if not provider_class:
+        raise Exception("Provider %s is not available" % key)
+
+    config = dict(config or {})
+    if provider_class.target_key and target:
+        config[provider_class.target_key] = target
+    return provider_class(config, workdir, dryrun)
+
+
+class Stop(object):
+    """
+    Undeploy an app by deleting the objects recorded in its state store.
+
+    Nothing is rendered and no params are resolved, so stopping never
+    prompts and takes about as long as the deletes. Objects are deleted in
+    the reverse order they were deployed in, with one provider call per
+    provider and target. Providers whose objects carry labels delete with
+    label selectors instead, one call per kind and target. The providers
+    get the global answers as their config, with the target the objects
+    were deployed to.
+
+    objects limits what is deleted to some of the recorded objects, see
+    Run._prune - only whole components are then deleted by selector.
+    """
+
+    def __init__(self, state, config=None, dryrun=False, targets=None, context=None,
+                 objects=None):
+        self.state = state
+        self.config = config or {}
+        self.dryrun = dryrun
+        self.context = context
+        self.whole_apps = objects is None
+        # Objects deployed before instances were recorded are selected without
+        self.instance = state.getInstance()
+        if objects is None:
+            objects = state.getObjects()
+        self.objects = [obj for obj in objects
+                        if not targets or obj["target"] in targets]
+
+    @classmethod
+    def load(cls, workdir, *args, **kwargs):
+        """Stop for the state in workdir, None if nothing was recorded there."""
+        if not os.path.isfile(os.path.join(workdir, STATE_FILE)):
+            return None
+        stop = cls(StateStore.open(workdir), *args, **kwargs)
+        if not stop.objects:
+            stop.state.close()
+            return None
+        return stop
+
+    def _groups(self):
+        groups = OrderedDict()
+        for obj in reversed(self.objects):
+            groups.setdefault((obj["provider"], obj["target"]), []).append(obj)
+        return groups
+
+    def _selectors(self, objects):
+        """
+        (selector, kinds, objects) to delete objects with, kinds in the order
+        to delete, objects the recorded ones the selector matches.
+        """
+        kinds = OrderedDict()
+        selected = OrderedDict()
+        for obj in objects:
+            key = obj["app_id"] if self.whole_apps else (obj["app_id"], obj["component"])
+            kinds.setdefault(key, OrderedDict())[obj["kind"]] = True
+            selected.setdefault(key, []).append(obj)
+        if self.whole_apps:
+            all_kinds = OrderedDict()
+            for app_kinds in kinds.itervalues():
+                all_kinds.update(app_kinds)
+            return [(appSelector(kinds.keys(), self.instance), all_kinds.keys(), objects)]
+
+        selectors = []
+        for (app_id, component), component_kinds in kinds.iteritems():
+            selectors.append((componentSelector(app_id, component, self.instance),
+                              component_kinds.keys(), selected[(app_id, component)]))
+        return selectors
+
+    def delete(self):
+        """Delete the objects and remove them from the state."""
+        for (key, target), objects in self._groups().iteritems():
+            provider = recordedProvider(self.context, key, target, self.config,
+                                        os.path.dirname(self.state.path), self.dryrun)
+            printStatus("Deleting %s objects from %s %s ..." % (len(objects), key, target))
+            with tracer.span("provider.init", provider=key, target=target):
+                provider.init()
+            with tracer.span("provider.deleteObjects", provider=key, target=target,
+                             objects=len(objects)):
+                if provider.object_labels:
+                    for selector, kinds, selected in self._selectors(objects):
+                        provider.deleteSelected(kinds, selector, selected)
+                else:
+                    provider.deleteObjects(objects)
+
+            if not self.dryrun:
+                for obj in objects:
+                    self.state.removeObject(obj["app_id"], obj["component"], obj["provider"],
+                                            obj["target"], obj["kind"], obj["name"])
+
+    def stop(self, app_id):
+        run_id = None if self.dryrun else self.state.startRun(app_id, "undeploy")
+        try:
+            self.delete()
+        except Exception as ex:
+            if isinstance(ex, (ProviderFailedException, CommandFailedException)):
+                printErrorStatus(ex)
+            if run_id:
+                self.state.finishRun(run_id, "failed")
+            raise
+        else:
+            if run_id:
+                self.state.finishRun(run_id, "success")
+        finally:
+            self.state.close()
+
+        printStatus("Deleted %s objects." % len(self.objects))
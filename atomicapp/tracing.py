@@ -0,0 +1,142 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import time
+import threading
+import functools
+from contextlib import contextmanager
+
+import logging
+
+from utils import printStatus
+
+logger = logging.getLogger(__name__)
+
+
+class Tracer(object):
+    """
+    Records nested timing spans of an Atomic App invocation.
+
+    Spans are kept as Chrome trace events ("ph": "X"), so the file written
+    by write() can be loaded in chrome://tracing or any compatible viewer.
+    Tracing is off until enabled, spans are then no-ops.
+    """
+
+    enabled = False
+
+    def __init__(self):
+        self.events = []
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+
+    def enable(self):
+        self.enabled = True
+
+    @contextmanager
+    def span(self, name, **attrs):
+        if not self.enabled:
+            yield
+            return
+
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.addSpan(name, start, time.time(), **attrs)
+
+    def addSpan(self, name, start, end, **attrs):
+        """Record a span timed elsewhere, f.e. a command run by atomicapp.engine."""
+        if not self.enabled:
+            return
+        event = {
+            "name": name,
+            "cat": "atomicapp",
+            "ph": "X",
+            "ts": int(start * 1000000),
+            "dur": int((end - start) * 1000000),
+            "pid": self.pid,
+            "tid": threading.current_thread().ident,
+            "args": dict((key, str(value)) for key, value in attrs.iteritems()
+                         if value is not None)
+        }
+        with self.lock:
+            self.events.append(event)
+
+    def write(self, path):
+        logger.info("Writing trace with %s spans to %s", len(self.events), path)
+        with open(path, "w") as fp:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, fp)
+
+    def summary(self, key="name", name=None):
+        """
+        Return (value, seconds, count) per value of key, slowest first.
+        key is "name" or a span attribute, name limits it to spans of that name.
+        Spans of a value overlapping each other, f.e. the run of an external
+        app inside the run of its parent or concurrent commands, are counted
+        once: seconds is the time covered by any of them.
+        """
+        spans = {}
+        for event in self.events:
+            if name and event["name"] != name:
+                continue
+            value = event["name"] if key == "name" else event["args"].get(key)
+            if value is None:
+                continue
+            spans.setdefault(value, []).append((event["ts"], event["ts"] + event["dur"]))
+
+        return sorted(((value, _covered(intervals) / 1000000.0, len(intervals))
+                       for value, intervals in spans.iteritems()),
+                      key=lambda item: item[1], reverse=True)
+
+    def printSummary(self):
+        for name, seconds, count in self.summary():
+            printStatus("Timing: %s took %.3fs in %s call(s)." % (name, seconds, count))
+        for component, seconds, count in self.summary("component", "component"):
+            printStatus("Timing: component %s took %.3fs." % (component, seconds))
+        for component, seconds, count in self.summary("render", "component"):
+            printStatus("Timing: rendering component %s took %.3fs." % (component, seconds))
+
+
+def _covered(intervals):
+    """Length of the union of (start, end) intervals."""
+    total = 0
+    covered_until = None
+    for start, end in sorted(intervals):
+        if covered_until is not None and start < covered_until:
+            start = covered_until
+        if end > start:
+            total += end - start
+        covered_until = max(end, covered_until)
+    return total
+
+
+tracer = Tracer()
+
+
+def traced(name):
+    """Decorator recording every call of the function as a span."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -19,15 +19,18 @@
 
 from __future__ import print_function
 import os
+import json
 import tempfile
-import re
-import collections
 import anymarkup
 from distutils.spawn import find_executable
 
 import logging
 
 from constants import APP_ENT_PATH, EXTERNAL_APP_DIR, WORKDIR
+from merge import merge
+from validator import compilePattern
+from bundle import isAppFile, readAppFile
+from events import events
 
 __all__ = ('Utils')
 
@@ -36,18 +39,26 @@ logger = logging.getLogger(__name__)
 # Following Methods(printStatus, printErrorStatus, printAnswerFile)
 #  are required for Cockpit or thirdparty management tool integration
 #  DONOT change the atomicapp.status.* prefix in the logger method.
+#  They also emit the typed events of atomicapp.events.
 
 
 def printStatus(message):
     logger.info("atomicapp.status.info.message=" + str(message))
+    events.emit("status", message=str(message))
 
 
 def printErrorStatus(message):
     logger.info("atomicapp.status.error.message=" + str(message))
+    events.emit("error", message=str(message))
 
 
 def printAnswerFile(message):
     logger.info("atomicapp.status.answer.message=" + str(message))
+    if events.sinks:
+        try:
+            events.emit("answers", answers=json.loads(message))
+        except ValueError:
+            events.emit("answers", answers=str(message))
 
 
 class Utils(object):
@@ -167,7 +178,7 @@ class Utils(object):
             if constraints:
                 for constraint in constraints:
                     logger.info("Checking pattern: %s", constraint["allowed_pattern"])
-                    if not re.match("^%s$" % constraint["allowed_pattern"], value):
+                    if not compilePattern(constraint["allowed_pattern"]).match(value):
                         logger.error(constraint["description"])
                         repeat = True
 
@@ -175,32 +186,23 @@ class Utils(object):
 
     @staticmethod
     def update(old_dict, new_dict):
-        for key, val in new_dict.iteritems():
-            if isinstance(val, collections.Mapping):
-                tmp = Utils.update(old_dict.get(key, {}), val)
-                old_dict[key] = tmp
-            elif isinstance(val, list) and key in old_dict:
-                res = (old_dict[key] + val)
-                if isinstance(val[0], collections.Mapping):
-                    old_dict[key] = [dict(y) for y in set(tuple(x.items()) for x in res)]
-                else:
-                    old_dict[key] = list(set(res))
-            else:
-                old_dict[key] = new_dict[key]
-        return old_dict
+        """Deprecated, use merge.merge - old_dict is no longer modified."""
+        return merge(old_dict, new_dict)
 
     @staticmethod
     def getAppId(path):
-        if not os.path.isfile(path):
+        if not isAppFile(path):
             return None
 
-        data = anymarkup.parse_file(path)
+        data = anymarkup.parse(readAppFile(path))
         return data.get("id")
 
     @staticmethod
-    def getDockerCli(dryrun=False):
+    def getDockerCli(dryrun=False, required=True):
+        # Only installing from an image needs docker, others look it up
+        # with required=False and get None if it is missing
         cli = find_executable("docker")
-        if not cli:
+        if not cli and required:
             if dryrun:
                 logger.error("Could not find docker client")
             else:
@@ -0,0 +1,121 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import re
+import threading
+
+import logging
+
+from constants import GLOBAL_CONF, PARAMS_KEY
+from bundle import appFileKey
+
+logger = logging.getLogger(__name__)
+
+_patterns = {}
+_patterns_lock = threading.Lock()
+
+
+def compilePattern(pattern):
+    """Compiled regex matching the whole value against an allowed_pattern."""
+    with _patterns_lock:
+        if pattern not in _patterns:
+            _patterns[pattern] = re.compile("^%s$" % pattern)
+        return _patterns[pattern]
+
+
+class ValidationError(Exception):
+
+    """Resolved values violate constraints of the Nulecule"""
+
+    def __init__(self, violations):
+        Exception.__init__(
+            self, "%s param(s) violate their constraints:\n%s"
+            % (len(violations), "\n".join(violations)))
+        self.violations = violations
+
+
+class Constraint(object):
+
+    def __init__(self, pattern, description=None):
+        self.pattern = pattern
+        self.regex = compilePattern(pattern)
+        self.description = description or "Value has to match %s" % pattern
+
+    def check(self, value):
+        return self.regex.match(value) is not None
+
+
+class Validator(object):
+    """
+    Constraints of one Nulecule, compiled once.
+
+    Constraints of a global param apply to every component which does not
+    define the param with its own constraints, the same way the params
+    themselves are inherited.
+    """
+
+    def __init__(self, mainfile_data):
+        self.app_id = mainfile_data.get("id")
+        self.constraints = {}
+        self._addParams(GLOBAL_CONF, mainfile_data.get(PARAMS_KEY))
+        for graph_item in mainfile_data.get("graph") or []:
+            self._addParams(graph_item.get("name"), graph_item.get(PARAMS_KEY))
+
+    @classmethod
+    def load(cls, path, mainfile_data, cache=None):
+        """Validator for the Nulecule at path, reused from cache until the file changes."""
+        if cache is None:
+            return cls(mainfile_data)
+
+        key = appFileKey(path)
+        validator = cache.get(key)
+        if validator is None:
+            validator = cache[key] = cls(mainfile_data)
+        return validator
+
+    def _addParams(self, component, params):
+        for param in params or []:
+            if not isinstance(param, dict) or not param.get("constraints"):
+                continue
+            self.constraints.setdefault(component, {})[param.get("name")] = [
+                Constraint(constraint["allowed_pattern"], constraint.get("description"))
+                for constraint in param["constraints"]]
+
+    def getConstraints(self, component, name):
+        component_constraints = self.constraints.get(component, {})
+        if name in component_constraints:
+            return component_constraints[name]
+        return self.constraints.get(GLOBAL_CONF, {}).get(name, [])
+
+    def validate(self, component, values):
+        """Return a list of violations of the given resolved values of component."""
+        violations = []
+        for name in sorted(values):
+            value = values[name]
+            # Params without a value are asked for (and checked) later
+            if value is None or isinstance(value, dict):
+                continue
+            for constraint in self.getConstraints(component, name):
+                if not isinstance(value, basestring):
+                    value = str(value)
+                if not constraint.check(value):
+                    violations.append("%s: %s in component %s: %s" % (
+                        self.app_id, name, component, constraint.description))
+
+        return violations
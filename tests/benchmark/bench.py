@@ -0,0 +1,210 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Scaling benchmarks on synthetic apps.
+
+Every benchmark runs on a small and a large synthetic app and both the
+times and the ratio large/small are compared against baselines.json. The
+ratio shows whether the code still scales the same way; absolute times
+depend on the machine, so they get a looser tolerance and differences too
+small to measure reliably are ignored:
+
+    python tests/benchmark/bench.py                     # compare
+    python tests/benchmark/bench.py --update-baseline   # record new baselines
+
+Commit updated baselines together with the change that moved them,
+including changes which made things faster.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from atomicapp import set_logging  # noqa
+from atomicapp.constants import MAIN_FILE  # noqa
+from atomicapp.install import Install  # noqa
+from atomicapp.nulecule_base import Nulecule_Base  # noqa
+from atomicapp.run import Run  # noqa
+from atomicapp.utils import Utils  # noqa
+
+from synthetic import generate_app  # noqa
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+# Seconds a time may grow by whatever the tolerance, below that it is noise
+MIN_DIFFERENCE = 0.005
+
+SIZES = {
+    "small": {"components": 5, "depth": 1, "params": 5, "artifacts": 2, "size": 2048},
+    "large": {"components": 40, "depth": 1, "params": 40, "artifacts": 2, "size": 2048},
+}
+
+
+def _components(nulecule_base):
+    return [item["name"] for item in nulecule_base.mainfile_data["graph"]
+            if not Utils.isExternal(item)]
+
+
+def _loadApp(path):
+    nulecule_base = Nulecule_Base(target_path=path, dryrun=True)
+    nulecule_base.loadMainfile(os.path.join(path, MAIN_FILE))
+    nulecule_base.loadAnswers({"general": {"namespace": "default"}})
+    return nulecule_base
+
+
+def bench_merge(path):
+    nulecule_base = _loadApp(path)
+    start = time.time()
+    for component in _components(nulecule_base):
+        nulecule_base.getValues(component)
+    return time.time() - start
+
+
+def bench_template(path):
+    run = Run({"general": {"namespace": "default"}}, path, dryrun=True)
+    run.nulecule_base.loadMainfile(os.path.join(path, MAIN_FILE))
+    run.nulecule_base.loadAnswers({"general": {"namespace": "default"}})
+    jobs = []
+    for component in _components(run.nulecule_base):
+        for artifact in run.nulecule_base.getArtifacts(component)["kubernetes"]:
+            with open(os.path.join(path, Utils.sanitizePath(artifact))) as fp:
+                jobs.append((fp.read(), component))
+
+    start = time.time()
+    for data, component in jobs:
+        run._applyTemplate(data, component)
+    return time.time() - start
+
+
+def bench_check_artifacts(path):
+    nulecule_base = _loadApp(path)
+    start = time.time()
+    nulecule_base.checkAllArtifacts()
+    return time.time() - start
+
+
+def bench_install(path):
+    start = time.time()
+    Install(os.path.join(path, "answers.conf"), path, dryrun=True).install()
+    return time.time() - start
+
+
+def bench_run(path):
+    start = time.time()
+    Run({"general": {"namespace": "default"}}, path, dryrun=True).run()
+    return time.time() - start
+
+
+BENCHMARKS = [
+    ("merge", bench_merge),
+    ("template", bench_template),
+    ("check_artifacts", bench_check_artifacts),
+    ("install", bench_install),
+    ("run", bench_run),
+]
+
+
+def measure(repeat=3):
+    results = {}
+    tmpdir = tempfile.mkdtemp(prefix="atomicapp-bench-")
+    try:
+        apps = {}
+        for size, params in SIZES.items():
+            apps[size] = os.path.join(tmpdir, size)
+            generate_app(apps[size], **params)
+
+        for name, func in BENCHMARKS:
+            times = {}
+            for size in SIZES:
+                # the best of several runs is the least noisy estimate
+                times[size] = min(func(apps[size]) for _ in range(repeat))
+            results[name] = {
+                "small": round(times["small"], 6),
+                "large": round(times["large"], 6),
+                "ratio": round(times["large"] / max(times["small"], 1e-6), 2)
+            }
+    finally:
+        shutil.rmtree(tmpdir)
+
+    return results
+
+
+def compare(results, baselines, tolerance, time_tolerance):
+    regressions = []
+    for name, result in sorted(results.items()):
+        baseline = baselines.get(name)
+        line = "%-16s small %.4fs  large %.4fs  ratio %.2f" % (
+            name, result["small"], result["large"], result["ratio"])
+        if baseline:
+            line += "  (baseline %.4fs  %.4fs  ratio %.2f)" % (
+                baseline["small"], baseline["large"], baseline["ratio"])
+            slower = [size for size in SIZES
+                      if result[size] > baseline[size] * (1 + time_tolerance) and
+                      result[size] - baseline[size] > MIN_DIFFERENCE]
+            if result["ratio"] > baseline["ratio"] * (1 + tolerance) and \
+                    result["large"] - baseline["large"] > MIN_DIFFERENCE:
+                regressions.append(name)
+                line += "  SCALING REGRESSION"
+            elif slower:
+                regressions.append(name)
+                line += "  REGRESSION (%s)" % ", ".join(sorted(slower))
+        print(line)
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Atomic App scaling benchmarks")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="Allowed relative growth of a ratio (default 0.5)")
+    parser.add_argument("--time-tolerance", type=float, default=1.0,
+                        help="Allowed relative growth of a time (default 1.0)")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    set_logging(level=logging.CRITICAL)
+    results = measure(args.repeat)
+
+    baselines = {}
+    if os.path.isfile(BASELINES):
+        with open(BASELINES) as fp:
+            baselines = json.load(fp)
+
+    regressions = compare(results, baselines, args.tolerance, args.time_tolerance)
+
+    if args.update_baseline:
+        with open(BASELINES, "w") as fp:
+            json.dump(results, fp, indent=4, sort_keys=True, separators=(",", ": "))
+            fp.write("\n")
+        print("Baselines written to %s" % BASELINES)
+    elif regressions:
+        print("Regressions: %s" % ", ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
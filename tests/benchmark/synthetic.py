@@ -0,0 +1,130 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Generator of synthetic Nulecule apps of arbitrary size, used by the
+benchmarks in bench.py and usable on its own:
+
+    python tests/benchmark/synthetic.py --components 50 --depth 2 /tmp/bigapp
+"""
+
+import os
+import json
+import argparse
+
+import anymarkup
+
+SPECVERSION = "0.0.2"
+
+
+def _artifact(component, index, params, size):
+    data = {
+        "apiVersion": "v1beta3",
+        "kind": "Pod",
+        "metadata": {
+            "name": "%s-%s" % (component, index),
+            "labels": {"app": component},
+            "annotations": {"padding": ""}
+        },
+        "spec": {
+            "containers": [{
+                "name": "%s-%s" % (component, index),
+                "image": "$p0" if params else "centos/httpd",
+                "env": [{"name": "P%s" % i, "value": "$p%s" % i} for i in range(params)]
+            }]
+        }
+    }
+
+    content = json.dumps(data, indent=4, sort_keys=True)
+    padding = max(0, size - len(content))
+    data["metadata"]["annotations"]["padding"] = "x" * padding
+    return json.dumps(data, indent=4, sort_keys=True)
+
+
+def generate_app(path, components=10, depth=0, params=5, artifacts=2, size=1024,
+                 providers=("kubernetes",), app_id="synthetic"):
+    """
+    Write a synthetic app to path and return the number of Nulecule files
+    written.
+
+    The app has the given number of local components, each with params
+    parameters (all with defaults) and artifacts artifacts of about size
+    bytes per provider. With depth > 0 the graph also contains one external
+    component, installed in external/, which is itself a synthetic app of
+    depth - 1.
+    """
+    graph = []
+    for c in range(components):
+        name = "%s-component-%s" % (app_id, c)
+        item = {
+            "name": name,
+            "params": [{"name": "p%s" % i, "description": "Parameter %s" % i,
+                        "default": "value-%s-%s" % (c, i)} for i in range(params)],
+            "artifacts": {}
+        }
+        for provider in providers:
+            item["artifacts"][provider] = []
+            for a in range(artifacts):
+                relpath = os.path.join("artifacts", provider, "%s-%s.json" % (name, a))
+                item["artifacts"][provider].append("file://%s" % relpath)
+                artifact_path = os.path.join(path, relpath)
+                if not os.path.isdir(os.path.dirname(artifact_path)):
+                    os.makedirs(os.path.dirname(artifact_path))
+                with open(artifact_path, "w") as fp:
+                    fp.write(_artifact(name, a, params, size))
+        graph.append(item)
+
+    written = 1
+    if depth > 0:
+        external_id = "%s-external" % app_id
+        graph.insert(0, {"name": external_id, "source": "docker://synthetic/%s" % external_id})
+        written += generate_app(
+            os.path.join(path, "external", external_id), components, depth - 1,
+            params, artifacts, size, providers, external_id)
+
+    mainfile = {
+        "specversion": SPECVERSION,
+        "id": app_id,
+        "metadata": {"name": "Synthetic app %s" % app_id},
+        "graph": graph
+    }
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    anymarkup.serialize_file(mainfile, os.path.join(path, "Nulecule"), format="yaml")
+
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic Nulecule app")
+    parser.add_argument("--components", type=int, default=10)
+    parser.add_argument("--depth", type=int, default=0)
+    parser.add_argument("--params", type=int, default=5)
+    parser.add_argument("--artifacts", type=int, default=2)
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--provider", dest="providers", action="append")
+    parser.add_argument("path")
+    args = parser.parse_args()
+
+    generate_app(args.path, args.components, args.depth, args.params, args.artifacts,
+                 args.size, tuple(args.providers or ("kubernetes",)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import json
+import shutil
+import hashlib
+import tarfile
+import tempfile
+from StringIO import StringIO
+
+import pytest
+
+import atomicapp.cli.main
+from atomicapp.archive import ImageArchive, normalizeReference
+
+tests_root = os.path.dirname(__file__)
+WORDPRESS = os.path.join(tests_root, "cached_nulecules", "wordpress-centos7-atomicapp")
+
+
+def makeLayer(files, compress=False):
+    """Tar of files, a dict of path -> content (None for a directory)."""
+    data = StringIO()
+    with tarfile.open(fileobj=data, mode="w:gz" if compress else "w") as layer:
+        for name, content in sorted(files.iteritems()):
+            info = tarfile.TarInfo(name)
+            if content is None:
+                info.type = tarfile.DIRTYPE
+                info.mode = 0755
+                layer.addfile(info)
+            else:
+                info.size = len(content)
+                info.mode = 0644
+                layer.addfile(info, StringIO(content))
+    return data.getvalue()
+
+
+def appLayer(app_path):
+    files = {}
+    for root, dirs, filenames in os.walk(app_path):
+        dirs[:] = [d for d in dirs if d not in (".workdir", "external")]
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            with open(path) as fp:
+                files[os.path.join("application-entity", os.path.relpath(path, app_path))] = fp.read()
+    return files
+
+
+def addMember(archive, name, content):
+    info = tarfile.TarInfo(name)
+    info.size = len(content)
+    archive.addfile(info, StringIO(content))
+
+
+def makeDockerSave(path, tag, layers):
+    with tarfile.open(path, "w") as archive:
+        names = []
+        for index, files in enumerate(layers):
+            names.append("%s/layer.tar" % index)
+            addMember(archive, names[-1], makeLayer(files))
+        addMember(archive, "manifest.json", json.dumps(
+            [{"Config": "config.json", "RepoTags": [tag], "Layers": names}]))
+    return path
+
+
+def makeOCI(path, ref, layers):
+    blobs = os.path.join(path, "blobs", "sha256")
+    os.makedirs(blobs)
+
+    def blob(content):
+        digest = hashlib.sha256(content).hexdigest()
+        with open(os.path.join(blobs, digest), "wb") as fp:
+            fp.write(content)
+        return {"digest": "sha256:%s" % digest, "size": len(content)}
+
+    manifest = {"schemaVersion": 2, "layers": [
+        dict(blob(makeLayer(files, compress=True)),
+             mediaType="application/vnd.oci.image.layer.v1.tar+gzip") for files in layers]}
+    descriptor = blob(json.dumps(manifest))
+    descriptor["annotations"] = {"org.opencontainers.image.ref.name": ref}
+    with open(os.path.join(path, "index.json"), "w") as fp:
+        json.dump({"schemaVersion": 2, "manifests": [descriptor]}, fp)
+    with open(os.path.join(path, "oci-layout"), "w") as fp:
+        json.dump({"imageLayoutVersion": "1.0.0"}, fp)
+    return path
+
+
+def exec_cli(command):
+    saved_args = sys.argv
+    sys.argv = ["main.py"] + command
+    try:
+        with pytest.raises(SystemExit) as exec_info:
+            atomicapp.cli.main.main()
+    finally:
+        sys.argv = saved_args
+    return exec_info.value.code
+
+
+class TestArchiveSuite(object):
+
+    def setup_method(self, method):
+        self.tmpdir = tempfile.mkdtemp(prefix="atomicapp-test-")
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    def test_layers_and_whiteouts(self):
+        layers = [
+            {"etc/passwd": "root", "application-entity": None,
+             "application-entity/Nulecule": "old", "application-entity/old.txt": "old",
+             "application-entity/dir/a": "a"},
+            {"application-entity/.wh.old.txt": "", "application-entity/dir/.wh..wh..opq": "",
+             "application-entity/dir/b": "b", "application-entity/Nulecule": "new"}]
+
+        for archive in (
+                ImageArchive(makeDockerSave(os.path.join(self.tmpdir, "app.tar"), "org/app", layers)),
+                ImageArchive(makeOCI(os.path.join(self.tmpdir, "oci"), "org/app:1", layers))):
+            dst = tempfile.mkdtemp(dir=self.tmpdir)
+            assert archive.extract(dst) == 2
+            with open(os.path.join(dst, "application-entity", "Nulecule")) as fp:
+                assert fp.read() == "new"
+            assert os.listdir(os.path.join(dst, "application-entity", "dir")) == ["b"]
+            assert not os.path.exists(os.path.join(dst, "application-entity", "old.txt"))
+            assert not os.path.exists(os.path.join(dst, "etc"))
+
+        assert ImageArchive.find(self.tmpdir, "docker.io/org/app").path.endswith("app.tar")
+        assert ImageArchive.find(self.tmpdir, "org/app:1").path.endswith("oci")
+        assert ImageArchive.find(self.tmpdir, "org/other") is None
+        assert normalizeReference("docker://library/centos") == "centos:latest"
+
+    def test_install_with_external_apps(self):
+        archive_dir = os.path.join(self.tmpdir, "images")
+        os.mkdir(archive_dir)
+        external = os.path.join(WORDPRESS, "external")
+        makeDockerSave(os.path.join(archive_dir, "mysql.tar"), "projectatomic/mysql-centos7-atomicapp",
+                       [appLayer(os.path.join(external, "aggregated-mysql-atomicapp"))])
+        makeOCI(os.path.join(archive_dir, "skydns"), "projectatomic/skydns-atomicapp:latest",
+                [appLayer(os.path.join(external, "aggregated-skydns-atomicapp"))])
+        wordpress = makeDockerSave(os.path.join(self.tmpdir, "wordpress.tar"),
+                                   "projectatomic/wordpress-centos7-atomicapp", [appLayer(WORDPRESS)])
+        target = os.path.join(self.tmpdir, "target")
+
+        assert exec_cli(["--dry-run", "--archive-dir", archive_dir,
+                         "install", "--destination", target, wordpress]) == 0
+        for path in ("Nulecule", "external/aggregated-mysql-atomicapp/Nulecule",
+                     "external/aggregated-skydns-atomicapp/artifacts/kubernetes/skydns-service.yaml"):
+            assert os.path.isfile(os.path.join(target, path))
+        assert exec_cli(["--dry-run", "run", target]) == 0
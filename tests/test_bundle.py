@@ -0,0 +1,125 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import zipfile
+
+import pytest
+
+import atomicapp.cli.main
+from atomicapp.bundle import Bundle, isAppFile, readAppFile
+from atomicapp.constants import BUNDLE_FILE
+
+tests_root = os.path.dirname(__file__)
+
+
+def exec_cli(command):
+    saved_args = sys.argv
+    sys.argv = ["main.py"] + command
+    try:
+        with pytest.raises(SystemExit) as exec_info:
+            atomicapp.cli.main.main()
+    finally:
+        sys.argv = saved_args
+    return exec_info.value.code
+
+
+class TestBundleSuite(object):
+
+    def setup_method(self, method):
+        self.tmpdir = tempfile.mkdtemp(prefix="atomicapp-test-")
+        self.app = os.path.join(self.tmpdir, "wordpress")
+        shutil.copytree(
+            os.path.join(tests_root, "cached_nulecules", "wordpress-centos7-atomicapp"),
+            self.app, ignore=shutil.ignore_patterns(".workdir", "answers.conf"))
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    def test_pack_and_read(self):
+        path = os.path.join(self.tmpdir, "wordpress.atomicapp")
+        bundle = Bundle.pack(self.app, path)
+
+        assert bundle.app_id == "wordpress-atomicapp"
+        assert "external/aggregated-mysql-atomicapp/Nulecule" in bundle.files
+        for name in bundle.files:
+            with open(os.path.join(self.app, name), "rb") as fp:
+                assert bundle.read(name) == fp.read()
+        assert bundle.getMainfile()["id"] == "wordpress-atomicapp"
+
+        # still a plain zip file
+        with zipfile.ZipFile(path) as archive:
+            assert archive.testzip() is None
+            archive_nulecule = archive.read("Nulecule")
+            assert archive_nulecule == bundle.read("Nulecule")
+
+        target = os.path.join(self.tmpdir, "target")
+        assert bundle.extract(target) == len(bundle.files)
+        assert bundle.extract(target) == 0
+        assert bundle.extract(target, update=True) == len(bundle.files)
+        bundle.close()
+        assert bundle.fp.closed
+
+        with Bundle(path) as bundle:
+            assert bundle.read("Nulecule") == archive_nulecule
+        assert bundle.fp.closed
+        with pytest.raises(ValueError):
+            bundle.read("Nulecule")
+
+    def test_install_and_run_from_bundle(self):
+        path = os.path.join(self.tmpdir, "wordpress.atomicapp")
+        target = os.path.join(self.tmpdir, "target")
+
+        assert exec_cli(["pack", "-o", path, self.app]) == 0
+        assert exec_cli(["--dry-run", "install", "--destination", target, path]) == 0
+        assert os.path.isfile(os.path.join(target, BUNDLE_FILE))
+        external = os.path.join(target, "external/aggregated-mysql-atomicapp/Nulecule")
+        assert not os.path.exists(external)
+        assert isAppFile(external)
+        with open(os.path.join(
+                self.app, "external/aggregated-mysql-atomicapp/Nulecule"), "rb") as fp:
+            assert readAppFile(external) == fp.read()
+
+        assert exec_cli(["--dry-run", "run", target]) == 0
+        assert os.path.isfile(os.path.join(
+            target, ".workdir/wordpress/artifacts/kubernetes/wordpress-pod.yaml"))
+
+        # packing the installed app copies its bundle
+        copy = os.path.join(self.tmpdir, "copy.atomicapp")
+        assert exec_cli(["pack", "-o", copy, target]) == 0
+        with open(path, "rb") as original, open(copy, "rb") as fp:
+            assert fp.read() == original.read()
+
+    def test_install_closes_bundle(self, monkeypatch):
+        path = os.path.join(self.tmpdir, "wordpress.atomicapp")
+        Bundle.pack(self.app, path).close()
+        closed = []
+        close = Bundle.close
+
+        def record(bundle):
+            close(bundle)
+            closed.append(bundle.fp.closed)
+        monkeypatch.setattr(Bundle, "close", record)
+
+        assert exec_cli(["--dry-run", "install", "--destination",
+                         os.path.join(self.tmpdir, "target"), path]) == 0
+        assert closed == [True]
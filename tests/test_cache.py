@@ -0,0 +1,38 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+from atomicapp.cache import LRUCache
+
+
+def test_keeps_recently_used_entries():
+    cache = LRUCache(maxsize=2)
+    cache["a"] = 1
+    cache["b"] = 2
+    # Using "a" makes "b" the one to evict
+    assert cache.get("a") == 1
+    cache["c"] = 3
+
+    assert sorted(cache) == ["a", "c"]
+    assert cache.get("b") is None
+    assert len(cache) == 2
+
+    cache["a"] = 4
+    cache["d"] = 5
+    assert sorted(cache.items()) == [("a", 4), ("d", 5)]
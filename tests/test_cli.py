@@ -22,6 +22,7 @@ __author__ = "goern"
 import os, sys, logging
 
 import pytest , json
+import shutil, tempfile
 
 import atomicapp.cli.main
 
@@ -37,6 +38,15 @@ def teardown_module(module):
 
 # TESTS
 class TestCLISuite(object):
+    # dry runs render into the .workdir of the app, keep the fixtures as they are
+    def setup_method(self, method):
+        self.tmpdir = tempfile.mkdtemp(prefix="atomicapp-test-")
+        self.cached = os.path.join(self.tmpdir, "cached_nulecules") + "/"
+        shutil.copytree(tests_root + 'cached_nulecules', self.cached)
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
     # this is how we call the CLI...
     def exec_cli(self, command):
         saved_args = sys.argv
@@ -59,7 +69,7 @@ class TestCLISuite(object):
             "--verbose",
             "--dry-run",
             "run",
-            tests_root + 'cached_nulecules/helloapache/'
+            self.cached + 'helloapache/'
         ]
 
         # run the command and check if it was successful
@@ -77,14 +87,14 @@ class TestCLISuite(object):
             "--answers-format=json",
             "--dry-run",
             "install",
-            tests_root + 'cached_nulecules/helloapache/'
+            self.cached + 'helloapache/'
         ]
 
         # run the command and check if it was successful
         with pytest.raises(SystemExit) as exec_info:
             self.exec_cli(command)
 
-        json_data=open(tests_root + "cached_nulecules/helloapache/answers.conf.sample").read()
+        json_data=open(self.cached + "helloapache/answers.conf.sample").read()
 
         assert exec_info.value.code == 0
         assert self.is_json(json_data)
@@ -98,7 +108,7 @@ class TestCLISuite(object):
             "--verbose",
             "--dry-run",
             "run",
-            tests_root + 'cached_nulecules/wordpress-centos7-atomicapp/'
+            self.cached + 'wordpress-centos7-atomicapp/'
         ]
 
         # run the command and check if it was successful
@@ -106,3 +116,163 @@ class TestCLISuite(object):
             self.exec_cli(command)
 
         assert exec_info.value.code == 0
+
+    # deploy one app for several tenants in a single process
+    def test_batch_with_helloapache(self):
+        app = self.cached + 'helloapache'
+        manifest = os.path.join(self.tmpdir, "manifest.json")
+        with open(manifest, "w") as fp:
+            json.dump([{"app": app, "namespace": "tenant-%s" % i} for i in range(3)], fp)
+
+        command = [
+            "main.py",
+            "--verbose",
+            "--dry-run",
+            "batch",
+            "--workers=2",
+            manifest
+        ]
+
+        with pytest.raises(SystemExit) as exec_info:
+            self.exec_cli(command)
+
+        assert exec_info.value.code == 0
+        for i in range(3):
+            assert os.path.isfile(os.path.join(
+                app, ".workdir/batch/%s-tenant-%s/helloapache-app/artifacts/k8s/hello-apache-pod.json" % (i, i)))
+
+    # render once and deploy to several namespaces
+    def test_run_with_several_targets(self):
+        app = self.cached + 'helloapache'
+
+        command = [
+            "main.py",
+            "--verbose",
+            "--dry-run",
+            "run",
+            "--target=ns1",
+            "--target=ns2",
+            app
+        ]
+
+        with pytest.raises(SystemExit) as exec_info:
+            self.exec_cli(command)
+
+        assert exec_info.value.code == 0
+        for target in ("ns1", "ns2"):
+            assert os.path.isfile(os.path.join(
+                app, ".workdir/helloapache-app/targets/%s/artifacts/k8s/hello-apache-pod.json" % target))
+
+    # record timing spans of a run
+    def test_run_with_trace(self):
+        trace_file = os.path.join(self.tmpdir, "trace.json")
+
+        command = [
+            "main.py",
+            "--verbose",
+            "--dry-run",
+            "--trace=%s" % trace_file,
+            "run",
+            self.cached + 'helloapache/'
+        ]
+
+        with pytest.raises(SystemExit) as exec_info:
+            self.exec_cli(command)
+
+        assert exec_info.value.code == 0
+        with open(trace_file) as fp:
+            events = json.load(fp)["traceEvents"]
+        spans = [event["name"] for event in events]
+        assert "run" in spans
+        assert "applyTemplate" in spans
+        # Rendering and deploying a component are told apart
+        for name in ("render", "component"):
+            assert {"component": "helloapache-app", "provider": "kubernetes"} in \
+                [event["args"] for event in events if event["name"] == name]
+
+    # plan a run and apply the plan later
+    def test_plan_and_apply_with_helloapache(self):
+        app = self.cached + 'helloapache'
+        plan_file = os.path.join(self.tmpdir, "plan.json")
+
+        command = [
+            "main.py",
+            "--verbose",
+            "--dry-run",
+            "plan",
+            "--output=%s" % plan_file,
+            app
+        ]
+
+        with pytest.raises(SystemExit) as exec_info:
+            self.exec_cli(command)
+
+        assert exec_info.value.code == 0
+        with open(plan_file) as fp:
+            steps = json.load(fp)["steps"]
+        assert [(step["component"], step["provider"], step["action"]) for step in steps] == \
+            [("helloapache-app", "kubernetes", "deploy")]
+        assert steps[0]["artifacts"][0]["path"] == "artifacts/k8s/hello-apache-pod.json"
+
+        command = [
+            "main.py",
+            "--verbose",
+            "--dry-run",
+            "apply",
+            plan_file
+        ]
+
+        with pytest.raises(SystemExit) as exec_info:
+            self.exec_cli(command)
+
+        assert exec_info.value.code == 0
+        assert os.path.isfile(os.path.join(
+            self.tmpdir, ".workdir/0-helloapache-app/artifacts/k8s/hello-apache-pod.json"))
+
+    # steps depend on the steps of the external apps, targets on nothing else
+    def test_plan_dependencies_with_wordpress(self):
+        app = self.cached + 'wordpress-centos7-atomicapp'
+        plan_file = os.path.join(self.tmpdir, "plan.json")
+
+        command = [
+            "main.py",
+            "--dry-run",
+            "plan",
+            "--target=a",
+            "--target=b",
+            "--output=%s" % plan_file,
+            app
+        ]
+
+        with pytest.raises(SystemExit) as exec_info:
+            self.exec_cli(command)
+
+        assert exec_info.value.code == 0
+        with open(plan_file) as fp:
+            steps = json.load(fp)["steps"]
+        assert [(step["component"], step["config"]["namespace"], step["depends_on"])
+                for step in steps] == [
+            ("mysql-atomicapp", "a", []),
+            ("mysql-atomicapp", "b", []),
+            ("skydns", "a", []),
+            ("skydns", "b", []),
+            ("wordpress", "a", [0, 1, 2, 3]),
+            ("wordpress", "b", [0, 1, 2, 3])]
+
+        command = [
+            "main.py",
+            "--dry-run",
+            "plan",
+            "--stop",
+            "--output=%s" % plan_file,
+            app
+        ]
+
+        with pytest.raises(SystemExit) as exec_info:
+            self.exec_cli(command)
+
+        assert exec_info.value.code == 0
+        with open(plan_file) as fp:
+            steps = json.load(fp)["steps"]
+        assert [(step["component"], step["depends_on"]) for step in steps] == [
+            ("wordpress", []), ("mysql-atomicapp", [0]), ("skydns", [0])]
@@ -0,0 +1,81 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import time
+
+import pytest
+
+from atomicapp.command import CommandRunner, CommandResult, CommandFailedException, \
+    RECENT_RECORDS
+
+
+class TestCommandSuite(object):
+
+    def test_captures_output_and_records(self):
+        runner = CommandRunner()
+        result = runner.run(["echo", "hello"])
+
+        assert result.stdout == "hello\n"
+        assert result.returncode == 0
+        assert runner.summary() == [("echo", 1, 0, result.duration)]
+
+    def test_records_are_bounded(self):
+        runner = CommandRunner()
+        for _ in range(RECENT_RECORDS + 5):
+            runner.finish(CommandResult(["kubectl", "get"], stdout="x" * 1000, duration=0.5))
+        runner.finish(CommandResult(["kubectl", "create"], returncode=1), check=False)
+
+        assert len(runner.records) == RECENT_RECORDS
+        assert all(record.stdout == "" for record in runner.records)
+        assert runner.summary() == [("kubectl", RECENT_RECORDS + 6, 1, (RECENT_RECORDS + 5) * 0.5)]
+
+    def test_failure_is_uniform(self):
+        runner = CommandRunner()
+        with pytest.raises(CommandFailedException) as exec_info:
+            runner.run(["sh", "-c", "echo broken >&2; exit 3"])
+        assert exec_info.value.result.returncode == 3
+        assert "broken" in str(exec_info.value)
+
+        assert runner.run(["false"], check=False).returncode == 1
+
+        with pytest.raises(CommandFailedException):
+            runner.run(["/nonexistent/kubectl"])
+
+    def test_dryrun_does_not_execute(self):
+        runner = CommandRunner()
+        result = runner.run(["false"], dryrun=True)
+
+        assert result.dryrun
+        assert runner.summary() == []
+
+    def test_timeout_kills_command(self):
+        runner = CommandRunner(timeout=0.2)
+        start = time.time()
+        with pytest.raises(CommandFailedException) as exec_info:
+            runner.run(["sleep", "5"])
+        assert exec_info.value.result.timed_out
+        assert time.time() - start < 2
+
+    def test_map_runs_concurrently_within_limit(self):
+        runner = CommandRunner(max_procs=4)
+        start = time.time()
+        results = runner.map([["sh", "-c", "sleep 0.3; echo %s" % i] for i in range(4)])
+
+        assert [r.stdout.strip() for r in results] == ["0", "1", "2", "3"]
+        assert time.time() - start < 1.0
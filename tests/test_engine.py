@@ -0,0 +1,144 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import time
+import threading
+
+import pytest
+
+from atomicapp.command import runner, CommandFailedException
+from atomicapp.engine import Engine, Command, Call, All, Graph, Return, runTask
+from atomicapp.plugin import Provider
+
+
+def sleeper(index, seconds=0.3):
+    return Command(["sh", "-c", "sleep %s; echo %s" % (seconds, index)])
+
+
+class SyncProvider(Provider):
+    key = "sync"
+
+    def init(self):
+        self.initialized = threading.current_thread().name
+
+    def deploy(self):
+        self.deployed = runner.run(["echo", "deployed"]).stdout.strip()
+
+
+class TestEngineSuite(object):
+
+    def teardown_method(self, method):
+        runner.configure(max_procs=4, timeout=0)
+
+    def test_commands_run_concurrently(self):
+        start = time.time()
+        results = runTask(All([sleeper(index) for index in range(4)]))
+
+        assert [result.stdout.strip() for result in results] == ["0", "1", "2", "3"]
+        assert time.time() - start < 1.0
+
+    def test_commands_wait_for_a_slot(self):
+        runner.configure(max_procs=2)
+        start = time.time()
+        runTask(All([sleeper(index, 0.2) for index in range(4)]))
+
+        assert time.time() - start >= 0.4
+
+    def test_tasks(self):
+        def task(index):
+            result = yield sleeper(index, 0.1)
+            raise Return(int(result.stdout) * 2)
+
+        def failing():
+            try:
+                yield Command(["sh", "-c", "echo broken >&2; exit 3"])
+            except CommandFailedException as ex:
+                raise Return(ex.result.returncode)
+
+        def outer():
+            doubled = yield All([task(index) for index in range(3)])
+            returncode = yield failing()
+            raise Return((doubled, returncode))
+
+        assert Engine().run(outer()) == ([0, 2, 4], 3)
+
+    def test_errors_are_raised(self):
+        with pytest.raises(CommandFailedException):
+            runTask(All([sleeper(0, 0.1), Command(["/nonexistent/kubectl"])]))
+
+        runner.configure(timeout=0.2)
+        start = time.time()
+        with pytest.raises(CommandFailedException) as exec_info:
+            runTask(Command(["sleep", "5"]))
+        assert exec_info.value.result.timed_out
+        assert time.time() - start < 2
+
+    def test_dryrun_does_not_execute(self):
+        assert runTask(Command(["false"], dryrun=True)).dryrun
+
+    def test_sync_provider_adapter(self):
+        provider = SyncProvider({}, "/tmp", False)
+
+        def task():
+            yield provider.initAsync()
+            yield provider.deployAsync()
+
+        runTask(task())
+        # Synchronous methods run in a worker thread, not the engine's
+        assert provider.initialized != threading.current_thread().name
+        assert provider.deployed == "deployed"
+        assert runTask(Call(lambda: 42)) == 42
+
+    def test_graph(self):
+        started = []
+
+        def task(index, fail=False):
+            started.append(index)
+            yield sleeper(index, 0.2)
+            if fail:
+                raise ValueError("task %s failed" % index)
+            raise Return(index)
+
+        # 0 and 1 run concurrently, 2 waits for both, 3 only for 1
+        start = time.time()
+        results = runTask(Graph([task(0), task(1), task(2), task(3)], [[], [], [0, 1], [1]]))
+        assert results == [0, 1, 2, 3]
+        assert started[:2] == [0, 1] and started.index(2) > 1
+        assert time.time() - start < 0.7
+
+        # Dependents of a failed task are skipped, the others still run
+        del started[:]
+        with pytest.raises(ValueError):
+            runTask(Graph([task(0, fail=True), task(1), task(2), task(3)],
+                          [[], [], [0], [2]]))
+        assert sorted(started) == [0, 1]
+
+        assert Graph([None] * 3, [[2], [], [1]]).order == [1, 2, 0]
+        with pytest.raises(ValueError):
+            Graph([None, None], [[1], [0]])
+        with pytest.raises(ValueError):
+            Graph([None], [[4]])
+
+    def test_calls_share_workers(self):
+        # Calls of every engine run in the same threads, none are started per run
+        threads = set(runTask(Call(lambda: threading.current_thread().ident))
+                      for _ in range(10))
+        assert len(threads) <= runner.max_procs
+        # An engine run from a worker does not wait for another one
+        assert runTask(Call(lambda: runTask(Call(lambda: 42)))) == 42
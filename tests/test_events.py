@@ -0,0 +1,87 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+
+import atomicapp.cli.main
+from atomicapp.events import EventStream
+
+from test_archive import exec_cli
+from test_state import makeKubectl, makeApp
+
+
+class TestEventsSuite(object):
+
+    def setup_method(self, method):
+        self.tmpdir = tempfile.mkdtemp(prefix="atomicapp-test-")
+        self.events_path = os.path.join(self.tmpdir, "events.jsonl")
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    def readEvents(self):
+        with open(self.events_path) as fp:
+            return [json.loads(line) for line in fp]
+
+    def test_run_events(self):
+        app_path, answers = makeApp(self.tmpdir, makeKubectl(self.tmpdir))
+        exec_cli(["--events", self.events_path, "-a", answers, "run", app_path])
+
+        events = self.readEvents()
+        phases = [(event["event"], event["phase"]) for event in events
+                  if event["event"].startswith("phase_")]
+        assert phases == [("phase_start", "run"), ("phase_start", "component"),
+                          ("phase_end", "component"), ("phase_end", "run")]
+        component = [event for event in events if event.get("phase") == "component"][-1]
+        assert (component["component"], component["index"], component["total"],
+                component["success"]) == ("helloapache-app", 1, 1, True)
+        assert {"event": "status", "message": "Deploying component helloapache-app ..."} in \
+            [dict((key, event[key]) for key in ("event", "message") if key in event)
+             for event in events]
+
+    def test_failure_events(self, monkeypatch):
+        app_path, answers = makeApp(self.tmpdir, "/nonexistent/kubectl")
+        # A failed run is reported, not exited from
+        monkeypatch.setattr(sys, "argv", ["main.py", "--events", self.events_path,
+                                          "-a", answers, "run", app_path])
+        atomicapp.cli.main.main()
+
+        events = self.readEvents()
+        assert [event["success"] for event in events if event["event"] == "phase_end"] == \
+            [False, False]
+        assert events[-1]["event"] == "error"
+        assert "kubectl" in events[-1]["message"]
+
+    def test_stream(self):
+        stream = EventStream()
+        stream.emit("status", message="nobody listens")
+
+        sink = stream.open(self.events_path)
+        stream.emit("answers", answers={"general": {"provider": "kubernetes"}})
+        sink.close()
+        # A closed sink is dropped instead of failing the run
+        stream.emit("status", message="gone")
+        assert stream.sinks == []
+
+        assert [(event["event"], event["answers"]) for event in self.readEvents()] == \
+            [("answers", {"general": {"provider": "kubernetes"}})]
@@ -0,0 +1,76 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import tempfile
+import threading
+
+import pytest
+from lockfile import AlreadyLocked, LockTimeout
+
+from atomicapp.lock import AppLock, CacheLock
+
+
+class TestLockSuite(object):
+
+    def test_independent_apps_do_not_block(self):
+        first = AppLock(tempfile.mkdtemp(prefix="atomicapp-test-"))
+        second = AppLock(tempfile.mkdtemp(prefix="atomicapp-test-"))
+        first.acquire()
+        try:
+            second.acquire()
+            second.release()
+        finally:
+            first.release()
+
+    def test_same_app_is_exclusive(self):
+        path = tempfile.mkdtemp(prefix="atomicapp-test-")
+        errors = []
+
+        def contend(timeout):
+            try:
+                AppLock(path, timeout).acquire()
+            except Exception as ex:
+                errors.append(ex)
+
+        first = AppLock(path)
+        first.acquire()
+        try:
+            for timeout in (0, 0.2):
+                thread = threading.Thread(target=contend, args=(timeout,))
+                thread.start()
+                thread.join()
+        finally:
+            first.release()
+
+        assert isinstance(errors[0], AlreadyLocked)
+        assert isinstance(errors[1], LockTimeout)
+        assert [error.locked for error in errors] == [os.path.realpath(path)] * 2
+
+    def test_cache_lock_readers_share_writer_waits(self):
+        name = tempfile.mktemp(prefix="atomicapp-test-")
+        reader = CacheLock(name)
+        with reader.reading():
+            with CacheLock(name).reading():
+                pass
+            with pytest.raises(LockTimeout) as exc_info:
+                CacheLock(name, timeout=0.2).acquire(exclusive=True)
+            assert exc_info.value.locked == name
+        with CacheLock(name).writing():
+            pass
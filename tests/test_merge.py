@@ -0,0 +1,67 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import copy
+
+from atomicapp.merge import merge, dedupe
+from atomicapp.nulecule_base import Nulecule_Base
+
+
+class TestMergeSuite(object):
+
+    def test_does_not_modify_inputs(self):
+        base = {"general": {"namespace": "default", "provider": "kubernetes"},
+                "db": {"password": "secret"}}
+        overlay = {"general": {"namespace": "prod"}, "web": {"port": 80}}
+        base_copy, overlay_copy = copy.deepcopy(base), copy.deepcopy(overlay)
+
+        result = merge(base, overlay)
+
+        assert result == {"general": {"namespace": "prod", "provider": "kubernetes"},
+                          "db": {"password": "secret"}, "web": {"port": 80}}
+        assert base == base_copy and overlay == overlay_copy
+        # untouched subtrees are shared, not copied
+        assert result["db"] is base["db"]
+        assert result["web"] is overlay["web"]
+
+    def test_keyed_lists_keep_order(self):
+        base = {"params": [{"name": "b", "default": 1}, {"name": "a", "default": 2}]}
+        overlay = {"params": [{"name": "c", "default": 3},
+                              {"name": "a", "default": 4, "description": "A"}]}
+
+        assert merge(base, overlay)["params"] == [
+            {"name": "b", "default": 1},
+            {"name": "a", "default": 4, "description": "A"},
+            {"name": "c", "default": 3}]
+
+    def test_dedupe_keeps_first_and_handles_unhashable(self):
+        assert dedupe([3, 1, 3, 2, 1]) == [3, 1, 2]
+        assert merge(["x", "y"], ["y", "z"]) == ["x", "y", "z"]
+        assert merge([{"a": [1]}, {"b": {"c": 2}}], [{"b": {"c": 2}}, {"a": [2]}]) == \
+            [{"a": [1]}, {"b": {"c": 2}}, {"a": [2]}]
+        assert merge([], []) == []
+
+    def test_answers_are_not_shared_with_caller(self):
+        answers = {"general": {"namespace": "default"}}
+        nulecule_base = Nulecule_Base(dryrun=True, docker_cli="docker")
+        nulecule_base.loadAnswers(answers)
+        nulecule_base._updateAnswers("general", {"namespace": "prod"})
+
+        assert nulecule_base.answers_data == {"general": {"namespace": "prod"}}
+        assert answers == {"general": {"namespace": "default"}}
@@ -0,0 +1,234 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+import atomicapp.registry
+from atomicapp.registry import RegistryClient, RegistryImage, RegistryError, parseReference, \
+    appLayers
+
+from test_archive import WORDPRESS, makeLayer, appLayer, exec_cli
+
+MANIFEST_TYPE = "application/vnd.docker.distribution.manifest.v2+json"
+TOKEN = "secret-token"
+
+
+class RegistryHandler(BaseHTTPRequestHandler):
+    """Minimal registry v2 API with anonymous bearer token auth."""
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, code, content="", headers=None):
+        self.send_response(code)
+        for name, value in (headers or {}).iteritems():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        registry = self.server.registry
+        if self.path.startswith("/token?"):
+            return self.reply(200, json.dumps({"token": TOKEN}))
+
+        registry.requests.append(self.path)
+        if self.headers.get("Authorization") != "Bearer %s" % TOKEN:
+            challenge = 'Bearer realm="http://%s:%s/token",service="test"' % self.server.server_address
+            return self.reply(401, headers={"WWW-Authenticate": challenge})
+
+        repository, kind, ref = self.path[len("/v2/"):].rsplit("/", 2)
+        if kind == "manifests" and (repository, ref) in registry.manifests:
+            content = registry.manifests[(repository, ref)]
+            etag = '"sha256:%s"' % hashlib.sha256(content).hexdigest()
+            if self.headers.get("If-None-Match") == etag:
+                return self.reply(304)
+            return self.reply(200, content, {"Content-Type": MANIFEST_TYPE, "ETag": etag})
+        if kind == "blobs" and ref in registry.blobs:
+            return self.reply(200, registry.blobs[ref])
+        self.reply(404)
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.manifests = {}
+        self.blobs = {}
+        self.requests = []
+        self.server = HTTPServer(("127.0.0.1", 0), RegistryHandler)
+        self.server.registry = self
+        self.address = "127.0.0.1:%s" % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def blob(self, content):
+        digest = "sha256:%s" % hashlib.sha256(content).hexdigest()
+        self.blobs[digest] = content
+        return {"digest": digest, "size": len(content)}
+
+    def push(self, repository, layers, tag="latest"):
+        """Push an image of (created_by, files) layers, return the layer digests."""
+        history = [{"created_by": "/bin/sh -c #(nop) ENV container=docker", "empty_layer": True}]
+        descriptors = []
+        for created_by, files in layers:
+            history.append({"created_by": created_by})
+            descriptors.append(self.blob(makeLayer(files, compress=True)))
+        config = self.blob(json.dumps({"architecture": "amd64", "history": history}))
+        self.manifests[(repository, tag)] = json.dumps(
+            {"schemaVersion": 2, "mediaType": MANIFEST_TYPE, "config": config, "layers": descriptors})
+        return [descriptor["digest"] for descriptor in descriptors]
+
+    def pushApp(self, repository, app_path):
+        return self.push(repository, [
+            ("/bin/sh -c #(nop) ADD file:0a1b in /", {"etc/passwd": "root"}),
+            ("/bin/sh -c #(nop) ADD dir:2c3d in /application-entity", appLayer(app_path)),
+            ("/bin/sh -c yum install -y tool", {"usr/bin/tool": "tool"})])
+
+    def blobRequests(self):
+        return [path.rsplit("/", 1)[-1] for path in self.requests if "/blobs/" in path]
+
+
+class TestRegistrySuite(object):
+
+    def setup_method(self, method):
+        self.tmpdir = tempfile.mkdtemp(prefix="atomicapp-test-")
+        self.registry = Registry()
+
+    def teardown_method(self, method):
+        self.registry.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_fetch_app_layers_and_cache(self):
+        base, app, tool = self.registry.pushApp("org/app", WORDPRESS)
+        cache_dir = os.path.join(self.tmpdir, "cache")
+        reference = "%s/org/app" % self.registry.address
+
+        dst = os.path.join(self.tmpdir, "first")
+        image = RegistryImage(reference, RegistryClient(cache_dir=cache_dir))
+        assert image.extract(dst) > 0
+        assert os.path.isfile(os.path.join(dst, "application-entity", "Nulecule"))
+        assert not os.path.exists(os.path.join(dst, "etc"))
+        # Only the config and the layer adding the app are downloaded
+        assert app in self.registry.blobRequests()
+        assert base not in self.registry.blobRequests()
+        assert tool not in self.registry.blobRequests()
+
+        # The manifest is revalidated, blobs come from the cache
+        del self.registry.requests[:]
+        dst = os.path.join(self.tmpdir, "second")
+        image = RegistryImage(reference, RegistryClient(cache_dir=cache_dir))
+        assert image.extract(dst) > 0
+        assert self.registry.blobRequests() == []
+        assert len(self.registry.requests) == 2  # unauthorized, then not modified
+
+    def test_corrupted_blob(self):
+        base, app, tool = self.registry.pushApp("org/app", WORDPRESS)
+        self.registry.blobs[app] = "garbage"
+
+        image = RegistryImage("%s/org/app" % self.registry.address,
+                              RegistryClient(cache_dir=os.path.join(self.tmpdir, "cache")))
+        with pytest.raises(RegistryError):
+            image.extract(self.tmpdir)
+        # Only the config is cached, nothing is left of the broken download
+        assert len(os.listdir(os.path.join(self.tmpdir, "cache", "blobs", "sha256"))) == 1
+
+    def test_manifest_fetched_by_threads(self):
+        self.registry.pushApp("org/app", WORDPRESS)
+        client = RegistryClient(cache_dir=os.path.join(self.tmpdir, "cache"))
+        errors = []
+
+        def fetch():
+            try:
+                client.getManifest(self.registry.address, "org/app", "latest")
+            except Exception as ex:
+                errors.append(ex)
+        threads = [threading.Thread(target=fetch) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        # No temporary files are left next to the manifest
+        assert len(os.listdir(os.path.join(self.tmpdir, "cache", "manifests"))) == 1
+
+    def test_app_layers(self):
+        def history(*lines):
+            return [{"created_by": line, "empty_layer": True} if "WORKDIR" in line
+                    else {"created_by": line} for line in lines]
+        base = "/bin/sh -c #(nop) ADD file:0a1b in / "
+
+        assert appLayers(history(
+            base, "/bin/sh -c yum install -y tool", "/bin/sh -c #(nop) WORKDIR /application-entity",
+            "/bin/sh -c #(nop) COPY dir:2c3d in . "),
+            ["base", "tool", "app"]) == ["app"]
+        assert appLayers(history(
+            "ADD rootfs.tar / # buildkit", "WORKDIR /application-entity # buildkit",
+            "COPY Nulecule ./ # buildkit", "ADD artifacts /application-entity/artifacts # buildkit",
+            "WORKDIR / # buildkit", "RUN /bin/sh -c yum install -y tool # buildkit"),
+            ["base", "nulecule", "artifacts", "tool"]) == ["base", "nulecule", "artifacts"]
+        # Files created by other instructions can not be told from the history
+        assert appLayers(history(
+            base, "/bin/sh -c #(nop) ADD dir:2c3d in /application-entity",
+            "/bin/sh -c mkdir -p /application-entity/extra"),
+            ["base", "app", "extra"]) is None
+        assert appLayers(history(
+            base, "/bin/sh -c #(nop) WORKDIR /application-entity", "/bin/sh -c make"),
+            ["base", "generated"]) is None
+        assert appLayers(history(base, "/bin/sh -c #(nop) COPY dir:2c3d in $APP"),
+                         ["base", "app"]) is None
+        assert appLayers(history(base, "/bin/sh -c yum install -y tool"), ["base", "tool"]) is None
+        assert appLayers(history(base), ["base", "extra"]) is None
+
+    def test_parse_reference(self):
+        assert parseReference("centos") == ("registry-1.docker.io", "library/centos", "latest")
+        assert parseReference("docker.io/org/app:1") == ("registry-1.docker.io", "org/app", "1")
+        assert parseReference("localhost:5000/app@sha256:ab") == ("localhost:5000", "app", "sha256:ab")
+
+    def test_install_with_external_apps(self, monkeypatch):
+        monkeypatch.setattr(atomicapp.registry, "REGISTRY_CACHE_DIR", os.path.join(self.tmpdir, "cache"))
+        external = os.path.join(WORDPRESS, "external")
+        self.registry.pushApp("projectatomic/wordpress-centos7-atomicapp", WORDPRESS)
+        self.registry.pushApp("projectatomic/mysql-centos7-atomicapp",
+                              os.path.join(external, "aggregated-mysql-atomicapp"))
+        self.registry.pushApp("projectatomic/skydns-atomicapp",
+                              os.path.join(external, "aggregated-skydns-atomicapp"))
+        answers = os.path.join(self.tmpdir, "answers.conf")
+        with open(answers, "w") as fp:
+            fp.write("[general]\nregistry = %s\n" % self.registry.address)
+        target = os.path.join(self.tmpdir, "target")
+
+        assert exec_cli(["--dry-run", "--from-registry", "-a", answers, "install",
+                         "--destination", target, "projectatomic/wordpress-centos7-atomicapp"]) == 0
+        for path in ("Nulecule", "external/aggregated-mysql-atomicapp/Nulecule",
+                     "external/aggregated-skydns-atomicapp/artifacts/kubernetes/skydns-service.yaml"):
+            assert os.path.isfile(os.path.join(target, path))
@@ -0,0 +1,158 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import shutil
+import tempfile
+
+import anymarkup
+import pytest
+
+from atomicapp.render import Render, RenderError, renderArtifacts
+from atomicapp.state import contentHash
+from atomicapp.labels import LABEL_APP, LABEL_RUN
+
+from test_archive import exec_cli
+
+tests_root = os.path.dirname(__file__)
+WORDPRESS = os.path.join(tests_root, "cached_nulecules", "wordpress-centos7-atomicapp")
+
+POD = {"kind": "Pod", "apiVersion": "v1", "metadata": {"name": "web"},
+       "spec": {"containers": [{"name": "web", "image": "$image"}]}}
+
+
+class TestRenderSuite(object):
+
+    def setup_method(self, method):
+        self.tmpdir = tempfile.mkdtemp(prefix="atomicapp-test-")
+        self.app_path = os.path.join(self.tmpdir, "app")
+        self.output = os.path.join(self.tmpdir, "rendered")
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    def writeApp(self, artifacts, files):
+        for path, data in files.iteritems():
+            path = os.path.join(self.app_path, path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, "w") as fp:
+                fp.write(data)
+        nulecule = {
+            "specversion": "0.0.2", "id": "render-app",
+            "graph": [{"name": "web", "artifacts": artifacts,
+                       "params": [{"name": "image", "default": "centos/httpd"}]}]}
+        anymarkup.serialize_file(nulecule, os.path.join(self.app_path, "Nulecule"),
+                                 format="yaml")
+
+    def test_render_all_providers(self):
+        self.writeApp({"kubernetes": ["file://artifacts/k8s/pod.json"],
+                       "openshift": [{"inherit": ["kubernetes"]}],
+                       "docker": ["file://artifacts/docker/run"]},
+                      {"artifacts/k8s/pod.json": json.dumps(POD),
+                       "artifacts/docker/run": "docker run -d --name web $image\n"})
+
+        render = Render(os.path.join(self.app_path, "answers.conf"), self.app_path,
+                        self.output, processes=2)
+        render.run()
+
+        # In the order of the graph and providers, whichever process rendered them
+        assert [os.path.relpath(path, self.output) for path, _ in render.rendered] == [
+            "docker/web/artifacts/docker/run",
+            "kubernetes/web/artifacts/k8s/pod.json",
+            "openshift/web/artifacts/k8s/pod.json"]
+        for path, content_hash in render.rendered:
+            with open(path) as fp:
+                assert contentHash(fp.read()) == content_hash
+        with open(os.path.join(self.output, "docker", "web", "artifacts", "docker", "run")) as fp:
+            assert fp.read() == "docker run -d --name web centos/httpd\n"
+        for provider in ("kubernetes", "openshift"):
+            with open(os.path.join(self.output, provider, "web", "artifacts", "k8s",
+                                   "pod.json")) as fp:
+                pod = json.load(fp)
+            assert pod["spec"]["containers"][0]["image"] == "centos/httpd"
+            # Labelled for the app, a render is not a run
+            assert pod["metadata"]["labels"][LABEL_APP] == "render-app"
+            assert LABEL_RUN not in pod["metadata"]["labels"]
+
+    def test_render_unknown_param(self):
+        self.writeApp({"docker": ["file://artifacts/docker/run"]},
+                      {"artifacts/docker/run": "docker run -d --name $name $image\n"})
+
+        with pytest.raises(Exception) as exc_info:
+            Render(os.path.join(self.app_path, "answers.conf"), self.app_path,
+                   self.output).run()
+        assert "unknown parameter name" in str(exc_info.value)
+
+    def test_render_missing_params(self, monkeypatch):
+        shutil.copytree(os.path.join(tests_root, "cached_nulecules", "helloapache"),
+                        self.app_path, ignore=shutil.ignore_patterns(".workdir"))
+        mainfile = os.path.join(self.app_path, "Nulecule")
+        nulecule = anymarkup.parse_file(mainfile)
+        for param in nulecule["graph"][0]["params"]:
+            del param["default"]
+        anymarkup.serialize_file(nulecule, mainfile, format="yaml")
+        # Asking would fail with EOFError
+        monkeypatch.setattr("sys.stdin", open(os.devnull))
+
+        with pytest.raises(RenderError) as exc_info:
+            Render(os.path.join(self.app_path, "answers.conf"), self.app_path,
+                   self.output).run()
+        assert exc_info.value.errors == [
+            "helloapache-app: component helloapache-app: param %s has no value in the "
+            "answers and no default" % name for name in ("hostport", "image")]
+        assert not os.path.exists(self.output)
+
+    def test_render_pool(self):
+        jobs = []
+        for index in range(20):
+            src = os.path.join(self.tmpdir, "src", "%s.txt" % index)
+            if not os.path.isdir(os.path.dirname(src)):
+                os.makedirs(os.path.dirname(src))
+            with open(src, "w") as fp:
+                fp.write("$name %s\n" % index)
+            jobs.append(("docker", src, os.path.join(self.output, "%s.txt" % index),
+                         {"name": "job"}, {}))
+
+        rendered = renderArtifacts(jobs, 4)
+        assert [path for path, _ in rendered] == [job[2] for job in jobs]
+        assert rendered[7][1] == contentHash("job 7\n")
+
+        # Every failure is reported, in the order of the jobs
+        jobs[3] = jobs[3][:3] + ({}, {})
+        jobs[12] = jobs[12][:1] + ("/nonexistent",) + jobs[12][2:]
+        with pytest.raises(RenderError) as exc_info:
+            renderArtifacts(jobs, 4)
+        assert len(exc_info.value.errors) == 2
+        assert "unknown parameter name" in exc_info.value.errors[0]
+        assert exc_info.value.errors[1].startswith("/nonexistent: ")
+
+    def test_render_external_apps(self):
+        # Dry-run, the installed external apps are not pulled again
+        code = exec_cli(["--dry-run", "render", "--provider", "kubernetes",
+                         "-o", self.output, WORDPRESS])
+
+        assert code == 0
+        for path in ["wordpress/artifacts/kubernetes/wordpress-pod.yaml",
+                     "external/aggregated-mysql-atomicapp/mysql-atomicapp/"
+                     "artifacts/kubernetes/mysql-service.yaml",
+                     "external/aggregated-skydns-atomicapp/skydns/"
+                     "artifacts/kubernetes/skydns-service.yaml"]:
+            assert os.path.isfile(os.path.join(self.output, "kubernetes", path))
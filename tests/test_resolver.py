@@ -0,0 +1,77 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import pytest
+
+from atomicapp.nulecule_base import Nulecule_Base
+from atomicapp.resolver import Resolver
+
+MAINFILE = {
+    "id": "app",
+    "params": [{"name": "image", "default": "centos"},
+               {"name": "replicas", "default": 1}],
+    "graph": [
+        {"name": "web", "params": [{"name": "port", "default": 80}],
+         "artifacts": {"kubernetes": []}},
+        {"name": "db", "params": [{"name": "image", "default": "mysql"}],
+         "artifacts": {"kubernetes": []}},
+        {"name": "external", "source": "docker://external"}]}
+
+
+def nuleculeBase(answers):
+    nulecule_base = Nulecule_Base(dryrun=True, docker_cli="docker")
+    nulecule_base.mainfile_data = MAINFILE
+    nulecule_base.loadAnswers(answers)
+    return nulecule_base
+
+
+class TestResolverSuite(object):
+
+    def test_resolves_all_components(self):
+        nulecule_base = nuleculeBase({"general": {"namespace": "prod", "replicas": 3},
+                                      "web": {"port": 8080}})
+        resolver = Resolver(nulecule_base)
+
+        assert dict(resolver.getValues("web")) == {
+            "image": "centos", "replicas": 3, "namespace": "prod", "port": 8080}
+        assert dict(resolver.getValues("db")) == {
+            "image": "mysql", "replicas": 3, "namespace": "prod"}
+        assert "external" not in resolver.values
+        with pytest.raises(ValueError):
+            resolver.getValues("unknown")
+
+        # the global layer is shared, not copied per component
+        assert resolver.getValues("web").parent is resolver.getValues("db").parent
+        with pytest.raises(TypeError):
+            resolver.getValues("web")["port"] = 1
+
+    def test_skip_asking_has_no_global_base(self):
+        resolver = Resolver(nuleculeBase({"general": {"namespace": "prod"}}), skip_asking=True)
+
+        assert dict(resolver.getValues("web")) == {"port": 80}
+
+    def test_write_answers(self):
+        nulecule_base = nuleculeBase({"general": {"namespace": "prod"}})
+        resolver = nulecule_base.getResolver()
+
+        assert nulecule_base.getResolver() is resolver
+        assert nulecule_base.answers_data["db"] == {"image": "mysql", "replicas": 1}
+
+        nulecule_base.loadAnswers({"db": {"image": "mariadb"}})
+        assert nulecule_base.getResolver().getValues("db")["image"] == "mariadb"
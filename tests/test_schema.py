@@ -0,0 +1,144 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import shutil
+import tempfile
+
+import anymarkup
+import pytest
+
+from atomicapp.run import Run
+from atomicapp.schema import SchemaError, checkApp, compileSchema
+
+tests_root = os.path.dirname(__file__)
+
+
+class TestSchemaSuite(object):
+
+    def setup_method(self, method):
+        self.tmpdir = tempfile.mkdtemp(prefix="atomicapp-test-")
+        self.app = os.path.join(self.tmpdir, "helloapache")
+        shutil.copytree(os.path.join(tests_root, "cached_nulecules", "helloapache"), self.app,
+                        ignore=shutil.ignore_patterns(".workdir"))
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    def writeNulecule(self, path, data):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        anymarkup.serialize_file(data, os.path.join(path, "Nulecule"), format="yaml")
+
+    def test_schema(self):
+        schema = compileSchema({"type": "object", "required": ["a"], "properties": {
+            "a": {"type": "array", "minItems": 2, "items": {"type": "string"}}}})
+        errors = []
+        schema.check({"a": ["x", 1]}, "", errors)
+        assert errors == [("a[1]", "has to be a string, not 1")]
+        errors = []
+        schema.check({"b": None}, "", errors)
+        assert errors == [("", "a is missing")]
+
+    def test_cached_apps_are_valid(self):
+        for app in ("helloapache", "wordpress-centos7-atomicapp"):
+            assert checkApp(os.path.join(tests_root, "cached_nulecules", app)) == []
+
+    def test_reports_every_error(self):
+        with open(os.path.join(self.app, "artifacts", "k8s", "nokind.json"), "w") as fp:
+            json.dump({"apiVersion": "v1"}, fp)
+        self.writeNulecule(self.app, {
+            "specversion": "0.0.2",
+            "params": [{"name": "namespace", "constraints": [{"allowed_pattern": "[a-z"}]}],
+            "graph": [
+                {"name": "web", "artifacts": {"kubernetes": [
+                    "file://artifacts/k8s/hello-apache-pod.json",
+                    "file://artifacts/k8s/missing.json",
+                    "file://artifacts/k8s/nokind.json",
+                    "artifacts/k8s/hello-apache-pod.json"],
+                    "openshift": [{"inherit": ["docker"]}]}},
+                {"name": "web"},
+                {"artifacts": {}},
+                {"name": "db", "source": "docker://db"}]})
+        self.writeNulecule(os.path.join(self.app, "external", "db"), {
+            "specversion": "0.0.1", "id": "db", "graph": []})
+
+        assert checkApp(self.app) == [
+            "Nulecule: top level: id is missing",
+            "Nulecule: graph[0].artifacts.kubernetes[3]: has to be a file:// URL or an "
+            "inherit list",
+            "Nulecule: graph[2]: name is missing",
+            "Nulecule: params[0].constraints[0].allowed_pattern: is not a valid pattern: "
+            "unexpected end of regular expression",
+            "Nulecule: graph[0].artifacts.kubernetes[1]: artifact "
+            "file://artifacts/k8s/missing.json does not exist",
+            "Nulecule: graph[0].artifacts.openshift[0]: inherits from docker which has no "
+            "artifacts in the component",
+            "Nulecule: graph[1]: component web is defined more than once",
+            "Nulecule: graph[1]: needs artifacts or an external source",
+            "external/db/Nulecule: specversion: \"0.0.1\" is not supported, use 0.0.2"]
+
+    def test_inherit_cycles(self):
+        self.writeNulecule(self.app, {"specversion": "0.0.2", "id": "app", "graph": [
+            {"name": "web", "artifacts": {
+                "docker": [{"inherit": ["docker"]}],
+                "kubernetes": [{"inherit": ["openshift"]}],
+                "openshift": [{"inherit": ["kubernetes"]}]}},
+            {"name": "db", "artifacts": {
+                "kubernetes": ["file://artifacts/k8s/hello-apache-pod.json"],
+                "openshift": [{"inherit": ["kubernetes"]}]}}]})
+
+        assert checkApp(self.app) == [
+            "Nulecule: graph[0].artifacts.docker[0]: inherit cycle docker -> docker",
+            "Nulecule: graph[0].artifacts.kubernetes[0]: inherit cycle kubernetes -> "
+            "openshift -> kubernetes"]
+
+    def test_artifacts_only_warn(self, caplog):
+        artifacts = os.path.join(self.app, "artifacts")
+        with open(os.path.join(artifacts, "k8s", "nokind.json"), "w") as fp:
+            json.dump({"apiVersion": "v1"}, fp)
+        with open(os.path.join(artifacts, "k8s", "param.json"), "w") as fp:
+            fp.write('{"kind": "${kind}", "apiVersion": "v1"}')
+        with open(os.path.join(artifacts, "run"), "w") as fp:
+            fp.write("/usr/bin/docker run -d centos/httpd")
+        with open(os.path.join(artifacts, "script"), "w") as fp:
+            fp.write("echo hello")
+        self.writeNulecule(self.app, {"specversion": "0.0.2", "id": "app", "graph": [
+            {"name": "web", "artifacts": {
+                "kubernetes": ["file://artifacts/k8s/nokind.json",
+                               "file://artifacts/k8s/param.json"],
+                "docker": ["file://artifacts/run", "file://artifacts/script"]}}]})
+
+        assert checkApp(self.app) == []
+        assert [record.getMessage() for record in caplog.records
+                if record.name == "atomicapp.schema"] == [
+            "Nulecule: graph[0].artifacts.docker[1]: artifact file://artifacts/script "
+            "does not run docker",
+            "Nulecule: graph[0].artifacts.kubernetes[0]: artifact "
+            "file://artifacts/k8s/nokind.json has no kind"]
+
+    def test_run_fails_before_anything_else(self):
+        self.writeNulecule(self.app, {"specversion": "0.0.2", "id": "app", "graph": [
+            {"name": "web", "artifacts": {"kubernetes": ["file://artifacts/missing.json"]}}]})
+
+        with pytest.raises(SchemaError) as exec_info:
+            Run(os.path.join(self.app, "answers.conf"), self.app, dryrun=True).run()
+        assert len(exec_info.value.errors) == 1
+        assert not os.path.exists(os.path.join(self.app, ".workdir", "web"))
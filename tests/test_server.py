@@ -0,0 +1,127 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import shutil
+import socket
+import tempfile
+import threading
+
+import anymarkup
+
+from atomicapp.cache import CACHE_SIZE
+from atomicapp.plugin import Provider
+from atomicapp.server import Server
+from atomicapp.utils import printStatus
+
+tests_root = os.path.dirname(os.path.dirname(__file__)) + '/tests/'
+
+
+class TestServerSuite(object):
+
+    def setup_method(self, method):
+        self.tmpdir = tempfile.mkdtemp(prefix="atomicapp-test-")
+        self.app = os.path.join(self.tmpdir, "helloapache")
+        shutil.copytree(tests_root + 'cached_nulecules/helloapache', self.app)
+
+        self.server = Server(os.path.join(self.tmpdir, "atomicapp.sock"))
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def teardown_method(self, method):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def request(self, data):
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(self.server.socket_path)
+        stream = client.makefile("rw")
+        stream.write(json.dumps(data) + "\n")
+        stream.flush()
+
+        events = []
+        for line in iter(stream.readline, ""):
+            events.append(json.loads(line))
+            if events[-1]["event"] == "result":
+                break
+        client.close()
+        return events
+
+    def test_run_streams_status_and_result(self):
+        events = self.request({"action": "run", "APP": self.app, "dryrun": True})
+
+        assert events[-1] == {"event": "result", "success": True}
+        messages = [e["message"] for e in events if e["event"] == "status"]
+        assert "Deploying component helloapache-app ..." in messages
+
+    def test_status_of_worker_threads(self, monkeypatch):
+        threads = []
+        execute = self.server.execute
+
+        def request_thread(request):
+            threads.append(threading.current_thread())
+            execute(request)
+
+        def deploy(provider):
+            threads.append(threading.current_thread())
+            printStatus("Deployed %s from a worker." % provider.key)
+
+        # A provider with only a synchronous deploy, run in an engine worker
+        kubernetes = self.server.plugin.getProvider("kubernetes")
+        monkeypatch.setattr(kubernetes, "deployAsync", Provider.__dict__["deployAsync"])
+        monkeypatch.setattr(kubernetes, "deploy", deploy)
+        monkeypatch.setattr(self.server, "execute", request_thread)
+        events = self.request({"action": "run", "APP": self.app, "dryrun": True})
+
+        assert events[-1] == {"event": "result", "success": True}
+        assert len(threads) == 2 and threads[0] is not threads[1]
+        messages = [e["message"] for e in events if e["event"] == "status"]
+        assert "Deployed kubernetes from a worker." in messages
+
+    def test_params_are_never_asked_for(self):
+        mainfile = os.path.join(self.app, "Nulecule")
+        nulecule = anymarkup.parse_file(mainfile)
+        for param in nulecule["graph"][0]["params"]:
+            del param["default"]
+        anymarkup.serialize_file(nulecule, mainfile, format="yaml")
+
+        events = self.request({"action": "run", "APP": self.app, "dryrun": True})
+
+        assert events[-1] == {
+            "event": "result", "success": False,
+            "error": "helloapache-app: 2 param(s) without a value in the answers or a "
+                     "default: helloapache-app/hostport, helloapache-app/image"}
+
+    def test_nulecule_is_parsed_once(self):
+        for _ in range(2):
+            events = self.request({"action": "run", "APP": self.app, "dryrun": True})
+            assert events[-1]["success"]
+
+        assert len(self.server.cache["mainfiles"]) == 1
+        # Bounded, the service runs for any number of apps
+        assert self.server.cache["mainfiles"].maxsize == CACHE_SIZE
+
+    def test_bad_request(self):
+        events = self.request({"action": "explode", "APP": self.app})
+
+        assert events == [{"event": "result", "success": False,
+                           "error": "Unknown action explode, use one of install, run, stop"}]
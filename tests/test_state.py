@@ -0,0 +1,366 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import shutil
+import tempfile
+
+import pytest
+
+from atomicapp.run import Run
+from atomicapp.state import StateStore
+from atomicapp.labels import injectLabels, instanceId, labelArtifact, objectLabels
+
+from test_archive import exec_cli
+
+tests_root = os.path.dirname(__file__)
+HELLOAPACHE = os.path.join(tests_root, "cached_nulecules", "helloapache")
+
+
+def makeKubectl(tmpdir):
+    """
+    kubectl stand-in logging its arguments to kubectl.log, "get KIND" prints
+    get-KIND.json if it exists
+    """
+    path = os.path.join(tmpdir, "kubectl")
+    with open(path, "w") as fp:
+        fp.write('#!/bin/sh\n'
+                 'echo "$@" >> %(dir)s/kubectl.log\n'
+                 'if [ "$1" = get ] && [ -f %(dir)s/get-$2.json ]; then cat %(dir)s/get-$2.json; fi\n'
+                 % {"dir": tmpdir})
+    os.chmod(path, 0755)
+    return path
+
+
+def makeApp(tmpdir, kubectl, namespace="test", name="helloapache"):
+    app_path = os.path.join(tmpdir, name)
+    shutil.copytree(HELLOAPACHE, app_path, ignore=shutil.ignore_patterns(".workdir"))
+    answers = os.path.join(app_path, "answers.conf")
+    with open(answers, "w") as fp:
+        fp.write("[general]\nprovider = kubernetes\nnamespace = %s\nprovider_cli = %s\n"
+                 % (namespace, kubectl))
+    return app_path, answers
+
+
+class TestStateSuite(object):
+
+    def setup_method(self, method):
+        self.tmpdir = tempfile.mkdtemp(prefix="atomicapp-test-")
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    def test_store(self):
+        state = StateStore.open(os.path.join(self.tmpdir, ".workdir"))
+        run_id = state.startRun("app", "deploy")
+        state.recordObject("app", "web", "kubernetes", "ns1", "service", "web", run_id=run_id)
+        state.recordObject("app", "web", "kubernetes", "ns1", "pod", "web", run_id=run_id)
+        state.recordObject("app", "db", "kubernetes", "ns2", "pod", "db", run_id=run_id)
+        # Deploying an object again replaces its record
+        state.recordObject("app", "db", "kubernetes", "ns2", "pod", "db", content_hash="sha256:1")
+        state.finishRun(run_id, "success")
+        state.close()
+
+        state = StateStore.open(os.path.join(self.tmpdir, ".workdir"))
+        assert [obj["name"] for obj in state.getObjects(app_id="app")] == ["web", "web", "db"]
+        assert [obj["target"] for obj in state.getObjects(kind="pod")] == ["ns1", "ns2"]
+        assert state.getObjects(component="db")[0]["hash"] == "sha256:1"
+        assert state.getRuns("app")[0]["status"] == "success"
+
+        state.removeObject("app", "web", "kubernetes", "ns1", "pod", "web")
+        assert len(state.getObjects(component="web")) == 1
+        with pytest.raises(ValueError):
+            state.getObjects(namespace="ns1")
+
+    def test_run_and_stop_record_objects(self):
+        app_path, answers = makeApp(self.tmpdir, makeKubectl(self.tmpdir))
+
+        Run(answers, app_path).run()
+        state = StateStore.open(os.path.join(app_path, ".workdir"))
+        objects = state.getObjects(app_id="helloapache-app")
+        assert [(obj["component"], obj["provider"], obj["target"], obj["kind"], obj["name"])
+                for obj in objects] == \
+            [("helloapache-app", "kubernetes", "test", "pod", "helloapache")]
+        assert objects[0]["artifact"] == "helloapache-app/artifacts/k8s/hello-apache-pod.json"
+        assert objects[0]["hash"].startswith("sha256:")
+        # Deployed artifacts carry the app, component, run and instance labels
+        with open(os.path.join(app_path, ".workdir", objects[0]["artifact"])) as fp:
+            assert json.load(fp)["metadata"]["labels"] == {
+                "app": "helloapache",
+                "io.projectatomic.nulecule/app": "helloapache-app",
+                "io.projectatomic.nulecule/component": "helloapache-app",
+                "io.projectatomic.nulecule/run": objects[0]["run_id"],
+                "io.projectatomic.nulecule/instance": instanceId(
+                    os.path.join(app_path, ".workdir"))}
+        assert state.getInstance() == instanceId(os.path.join(app_path, ".workdir"))
+
+        Run(answers, app_path, stop=True).run()
+        assert state.getObjects(app_id="helloapache-app") == []
+        assert [(run["action"], run["status"]) for run in state.getRuns()] == \
+            [("deploy", "success"), ("undeploy", "success")]
+
+    def test_fast_stop(self):
+        kubectl = makeKubectl(self.tmpdir)
+        app_path, answers = makeApp(self.tmpdir, kubectl)
+        Run(answers, app_path).run()
+        state = StateStore.open(os.path.join(app_path, ".workdir"))
+        state.recordObject("helloapache-app", "helloapache-app", "kubernetes", "test",
+                           "service", "helloapache")
+
+        # Stop works from the state, a param it would have to ask for is not used
+        artifact = os.path.join(app_path, "artifacts", "k8s", "hello-apache-pod.json")
+        with open(artifact, "a") as fp:
+            fp.write("$unknown_param")
+
+        Run(answers, app_path, dryrun=True, stop=True).run()
+        assert len(state.getObjects()) == 2
+        Run(answers, app_path, stop=True).run()
+        assert state.getObjects() == []
+        with open(os.path.join(self.tmpdir, "kubectl.log")) as fp:
+            calls = fp.read().splitlines()
+        # One call per kind deleting the labelled objects, in the reverse order of deploying
+        instance = instanceId(os.path.join(app_path, ".workdir"))
+        assert calls[1:] == [
+            "delete service --selector=io.projectatomic.nulecule/app=helloapache-app,"
+            "io.projectatomic.nulecule/instance=%s --namespace=test" % instance,
+            "delete pod --selector=io.projectatomic.nulecule/app=helloapache-app,"
+            "io.projectatomic.nulecule/instance=%s --namespace=test" % instance]
+
+    def test_stop_leaves_other_instances(self):
+        kubectl = makeKubectl(self.tmpdir)
+        first, first_answers = makeApp(self.tmpdir, kubectl, name="first")
+        second, second_answers = makeApp(self.tmpdir, kubectl, name="second")
+        Run(first_answers, first).run()
+        Run(second_answers, second).run()
+        # A state recorded before instances were, its objects are selected without
+        state = StateStore.open(os.path.join(second, ".workdir"))
+        state.connection.execute("DELETE FROM meta")
+        state.connection.commit()
+        state.close()
+        os.remove(os.path.join(self.tmpdir, "kubectl.log"))
+
+        Run(first_answers, first, stop=True).run()
+        Run(second_answers, second, stop=True).run()
+        with open(os.path.join(self.tmpdir, "kubectl.log")) as fp:
+            calls = fp.read().splitlines()
+        assert calls == [
+            "delete pod --selector=io.projectatomic.nulecule/app=helloapache-app,"
+            "io.projectatomic.nulecule/instance=%s --namespace=test"
+            % instanceId(os.path.join(first, ".workdir")),
+            "delete pod --selector=io.projectatomic.nulecule/app=helloapache-app "
+            "--namespace=test"]
+
+    def test_openshift_stop_deletes_each_kind(self, monkeypatch):
+        oc = os.path.join(self.tmpdir, "oc")
+        with open(oc, "w") as fp:
+            fp.write('#!/bin/sh\necho "$@" >> %s/oc.log\n' % self.tmpdir)
+        os.chmod(oc, 0755)
+        monkeypatch.setenv("PATH", "%s:%s" % (self.tmpdir, os.environ["PATH"]))
+        config = os.path.join(self.tmpdir, "config")
+        open(config, "w").close()
+        app_path, answers = makeApp(self.tmpdir, oc)
+        with open(answers, "w") as fp:
+            fp.write("[general]\nprovider = openshift\nopenshiftconfig = %s\n" % config)
+        with open(os.path.join(app_path, "artifacts", "secret.json"), "w") as fp:
+            json.dump({"kind": "List", "apiVersion": "v1", "items": [
+                {"kind": "Secret", "apiVersion": "v1", "metadata": {"name": "web"}},
+                {"kind": "PersistentVolumeClaim", "apiVersion": "v1",
+                 "metadata": {"name": "web"}}]}, fp)
+        with open(os.path.join(app_path, "Nulecule"), "a") as fp:
+            fp.write("      openshift:\n"
+                     "        - file://artifacts/k8s/hello-apache-pod.json\n"
+                     "        - file://artifacts/secret.json\n")
+
+        Run(answers, app_path).run()
+        # Stopping by rendering, without the recorded objects
+        os.remove(os.path.join(app_path, ".workdir", "state.db"))
+        Run(answers, app_path, stop=True).run()
+        with open(os.path.join(self.tmpdir, "oc.log")) as fp:
+            calls = [call for call in fp.read().splitlines() if " delete " in call]
+        selector = ("io.projectatomic.nulecule/app=helloapache-app,"
+                    "io.projectatomic.nulecule/component=helloapache-app,"
+                    "io.projectatomic.nulecule/instance=%s"
+                    % instanceId(os.path.join(app_path, ".workdir")))
+        assert calls == ["--config=%s delete %s --selector=%s" % (config, kind, selector)
+                         for kind in ("pod", "secret", "persistentvolumeclaim")]
+
+    def test_stop_scales_replication_controllers_down(self, caplog):
+        app_path, answers = makeApp(self.tmpdir, "kubectl")
+        state = StateStore.open(os.path.join(app_path, ".workdir"))
+        state.recordObject("helloapache-app", "helloapache-app", "kubernetes", "test",
+                           "replicationcontroller", "web")
+        state.recordObject("helloapache-app", "helloapache-app", "kubernetes", "test",
+                           "service", "web")
+        state.close()
+
+        Run(answers, app_path, stop=True, dryrun=True).run()
+        commands = [record.getMessage()[len("DRY-RUN: "):] for record in caplog.records
+                    if record.getMessage().startswith("DRY-RUN: ")]
+        # Before the controller is deleted, its pods would be left otherwise
+        assert commands[0].endswith("kubectl resize rc web --replicas=0 --namespace=test")
+        assert [command.split()[1:3] for command in commands[1:]] == [
+            ["delete", "service"], ["delete", "replicationcontroller"]]
+
+    def test_stop_by_rendering_deletes_by_selector(self):
+        app_path, answers = makeApp(self.tmpdir, makeKubectl(self.tmpdir))
+        Run(answers, app_path).run()
+        os.remove(os.path.join(app_path, ".workdir", "state.db"))
+
+        Run(answers, app_path, stop=True).run()
+        with open(os.path.join(self.tmpdir, "kubectl.log")) as fp:
+            calls = fp.read().splitlines()
+        assert calls[-1] == (
+            "delete pod --selector=io.projectatomic.nulecule/app=helloapache-app,"
+            "io.projectatomic.nulecule/component=helloapache-app,"
+            "io.projectatomic.nulecule/instance=%s --namespace=test"
+            % instanceId(os.path.join(app_path, ".workdir")))
+
+    def test_prune(self):
+        app_path, answers = makeApp(self.tmpdir, makeKubectl(self.tmpdir))
+        Run(answers, app_path).run()
+        # Objects of a component since removed from the Nulecule
+        state = StateStore.open(os.path.join(app_path, ".workdir"))
+        state.recordObject("helloapache-app", "old", "kubernetes", "test", "service", "old")
+        state.recordObject("other-app", "db", "kubernetes", "test", "pod", "db")
+
+        Run(answers, app_path).run()
+        assert len(state.getObjects(component="old")) == 1
+        Run(answers, app_path, prune=True).run()
+        assert [obj["component"] for obj in state.getObjects()] == ["db", "helloapache-app"]
+        with open(os.path.join(self.tmpdir, "kubectl.log")) as fp:
+            calls = fp.read().splitlines()
+        assert calls[-1] == (
+            "delete service --selector=io.projectatomic.nulecule/app=helloapache-app,"
+            "io.projectatomic.nulecule/component=old,"
+            "io.projectatomic.nulecule/instance=%s --namespace=test"
+            % instanceId(os.path.join(app_path, ".workdir")))
+
+    def test_inject_labels(self):
+        rc = {"kind": "ReplicationController", "apiVersion": "v1beta1", "id": "web",
+              "labels": {"name": "web"},
+              "desiredState": {"replicas": 2, "podTemplate": {"labels": {"name": "web"}}}}
+        injectLabels({"kind": "List", "items": [rc]}, objectLabels("my app", "web", "1"))
+        assert rc["labels"] == {"name": "web", "io.projectatomic.nulecule/app": "my-app",
+                                "io.projectatomic.nulecule/component": "web",
+                                "io.projectatomic.nulecule/run": "1"}
+        # Pods are selected by the app and component, the run label would
+        # make the pods of an updated controller differ
+        assert rc["desiredState"]["podTemplate"]["labels"] == {
+            "name": "web", "io.projectatomic.nulecule/app": "my-app",
+            "io.projectatomic.nulecule/component": "web"}
+        assert "metadata" not in rc
+
+        # Artifacts without objects to label keep their text
+        labels = objectLabels("app", "web")
+        for path, data in [("pod.json", '{"apiVersion": "v1"}\n'),
+                           ("list.yaml", "kind: List\nitems:\n  - apiVersion: v1\n"),
+                           ("run", "docker run centos/httpd\n")]:
+            assert labelArtifact(data, path, labels) is data
+
+    def test_resume(self):
+        kubectl = os.path.join(self.tmpdir, "kubectl")
+        with open(kubectl, "w") as fp:
+            fp.write('#!/bin/sh\n'
+                     'echo "$@" >> %(dir)s/kubectl.log\n'
+                     'case "$*" in *service*) [ -f %(dir)s/fail ] && exit 1;; esac\n'
+                     'exit 0\n' % {"dir": self.tmpdir})
+        os.chmod(kubectl, 0755)
+        app_path, answers = makeApp(self.tmpdir, kubectl)
+        with open(os.path.join(app_path, "artifacts", "k8s", "service.json"), "w") as fp:
+            json.dump({"kind": "Service", "apiVersion": "v1",
+                       "metadata": {"name": "helloapache"}}, fp)
+        with open(os.path.join(app_path, "Nulecule"), "a") as fp:
+            fp.write("  - name: service\n"
+                     "    artifacts:\n"
+                     "      kubernetes:\n"
+                     "        - file://artifacts/k8s/service.json\n")
+
+        def creates():
+            with open(os.path.join(self.tmpdir, "kubectl.log")) as fp:
+                calls = [call.split()[2] for call in fp.read().splitlines()
+                         if call.startswith("create")]
+            os.remove(os.path.join(self.tmpdir, "kubectl.log"))
+            return [os.path.basename(call) for call in calls]
+
+        open(os.path.join(self.tmpdir, "fail"), "w").close()
+        with pytest.raises(Exception):
+            Run(answers, app_path).run()
+        assert creates() == ["hello-apache-pod.json", "service.json"]
+
+        # The pod is not created again, the run label differs but not the content
+        os.remove(os.path.join(self.tmpdir, "fail"))
+        Run(answers, app_path, resume=True).run()
+        assert creates() == ["service.json"]
+        Run(answers, app_path, resume=True).run()
+        assert not os.path.exists(os.path.join(self.tmpdir, "kubectl.log"))
+
+        # A changed artifact is deployed again
+        with open(answers, "a") as fp:
+            fp.write("[helloapache-app]\nhostport = 8080\n")
+        Run(answers, app_path, resume=True).run()
+        assert creates() == ["hello-apache-pod.json"]
+
+    def test_dry_run_records_nothing(self):
+        app_path, answers = makeApp(self.tmpdir, makeKubectl(self.tmpdir))
+
+        Run(answers, app_path, dryrun=True).run()
+        assert not os.path.exists(os.path.join(app_path, ".workdir", "state.db"))
+
+    def test_status(self, capsys):
+        app_path, answers = makeApp(self.tmpdir, makeKubectl(self.tmpdir))
+        Run(answers, app_path).run()
+        state = StateStore.open(os.path.join(app_path, ".workdir"))
+        state.recordObject("helloapache-app", "helloapache-app", "kubernetes", "test",
+                           "pod", "other")
+        state.recordObject("helloapache-app", "helloapache-app", "kubernetes", "test",
+                           "service", "helloapache")
+        with open(os.path.join(self.tmpdir, "get-pod.json"), "w") as fp:
+            json.dump({"items": [
+                {"kind": "Pod", "metadata": {"name": "helloapache"}, "status": {"phase": "Running"}},
+                {"kind": "Pod", "metadata": {"name": "other"}, "status": {"phase": "Pending"}}]}, fp)
+        with open(os.path.join(self.tmpdir, "get-service.json"), "w") as fp:
+            json.dump({"items": [{"kind": "Service", "metadata": {"name": "helloapache"}}]}, fp)
+        capsys.readouterr()
+
+        assert exec_cli(["-a", answers, "status", "--json", app_path]) is True
+        report = json.loads(capsys.readouterr()[0])
+        assert report["health"] == "unhealthy"
+        assert report["components"] == [{"app": "helloapache-app", "component": "helloapache-app",
+                                          "health": "unhealthy", "healthy": 2, "objects": 3}]
+        assert [(obj["name"], obj["state"]) for obj in report["objects"]] == \
+            [("helloapache", "Running"), ("other", "Pending"), ("helloapache", "exists")]
+        # One list call per kind and namespace
+        with open(os.path.join(self.tmpdir, "kubectl.log")) as fp:
+            calls = fp.read().splitlines()
+        selector = "io.projectatomic.nulecule/app=helloapache-app," \
+            "io.projectatomic.nulecule/instance=%s" % instanceId(os.path.join(app_path, ".workdir"))
+        assert calls[1:] == [
+            "get pod --output=json --namespace=test --selector=%s" % selector,
+            "get service --output=json --namespace=test --selector=%s" % selector]
+
+        state.removeObject("helloapache-app", "helloapache-app", "kubernetes", "test",
+                           "pod", "other")
+        assert exec_cli(["-a", answers, "status", app_path]) is False
+        assert "App is healthy" in capsys.readouterr()[0]
+
+        # A mistyped path fails without creating it
+        missing = os.path.join(self.tmpdir, "typo")
+        assert exec_cli(["status", missing]) is True
+        assert not os.path.exists(missing)
@@ -0,0 +1,65 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import time
+import shutil
+import tempfile
+
+from atomicapp.run import Run
+
+from benchmark.synthetic import generate_app
+
+
+class TestSyntheticSuite(object):
+
+    def test_generated_app_runs(self):
+        tmpdir = tempfile.mkdtemp(prefix="atomicapp-test-")
+        try:
+            assert generate_app(tmpdir, components=3, depth=2, params=2, artifacts=2) == 3
+
+            Run({"general": {"namespace": "default"}}, tmpdir, dryrun=True).run()
+
+            rendered = os.path.join(
+                tmpdir, ".workdir", "synthetic-component-2", "artifacts", "kubernetes",
+                "synthetic-component-2-1.json")
+            with open(rendered) as fp:
+                assert "value-2-1" in fp.read()
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_components_deploy_concurrently(self):
+        tmpdir = tempfile.mkdtemp(prefix="atomicapp-test-")
+        try:
+            app_path = os.path.join(tmpdir, "app")
+            generate_app(app_path, components=4, params=1, artifacts=1)
+            kubectl = os.path.join(tmpdir, "kubectl")
+            with open(kubectl, "w") as fp:
+                fp.write('#!/bin/sh\nsleep 0.3\necho "$4" >> %s/kubectl.log\n' % tmpdir)
+            os.chmod(kubectl, 0755)
+
+            start = time.time()
+            Run({"general": {"namespace": "default", "provider_cli": kubectl}}, app_path).run()
+
+            # 4 components taking 0.3s each
+            assert time.time() - start < 1.0
+            with open(os.path.join(tmpdir, "kubectl.log")) as fp:
+                assert len(fp.readlines()) == 4
+        finally:
+            shutil.rmtree(tmpdir)
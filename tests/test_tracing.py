@@ -0,0 +1,38 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from atomicapp.tracing import Tracer
+
+
+def test_summary_counts_overlapping_spans_once():
+    tracer = Tracer()
+    tracer.enable()
+    # The run of an external app inside the run of its parent
+    tracer.addSpan("run", 10, 20, app="parent")
+    tracer.addSpan("run", 12, 15, app="external")
+    # Concurrent commands, then one more after a gap
+    tracer.addSpan("command", 12, 14)
+    tracer.addSpan("command", 13, 15)
+    tracer.addSpan("command", 17, 18)
+    tracer.addSpan("component", 12, 15, component="db")
+    tracer.addSpan("component", 15, 19, component="web")
+
+    assert tracer.summary() == [("run", 10.0, 2), ("component", 7.0, 2), ("command", 4.0, 3)]
+    assert tracer.summary("app", "run") == [("parent", 10.0, 1), ("external", 3.0, 1)]
+    assert tracer.summary("component", "component") == [("web", 4.0, 1), ("db", 3.0, 1)]
@@ -0,0 +1,83 @@
+"""
+ Copyright 2015 Red Hat, Inc.
+
+ This file is part of Atomic App.
+
+ Atomic App is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Lesser General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ Atomic App is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Lesser General Public License for more details.
+
+ You should have received a copy of the GNU Lesser General Public License
+ along with Atomic App. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import shutil
+import tempfile
+
+import anymarkup
+import pytest
+
+from atomicapp.run import Run
+from atomicapp.validator import Validator, ValidationError
+
+tests_root = os.path.dirname(__file__)
+
+PORT = {"allowed_pattern": "[0-9]+", "description": "Port has to be a number"}
+IMAGE = {"allowed_pattern": "[a-z0-9/]+", "description": "Image name is invalid"}
+
+
+def constrainedApp(path):
+    shutil.copytree(os.path.join(tests_root, "cached_nulecules", "helloapache"), path,
+                    ignore=shutil.ignore_patterns(".workdir"))
+    mainfile = os.path.join(path, "Nulecule")
+    data = anymarkup.parse_file(mainfile)
+    data["params"] = [{"name": "namespace", "constraints": [
+        {"allowed_pattern": "[a-z-]+", "description": "Namespace is invalid"}]}]
+    params = data["graph"][0]["params"]
+    params[0]["constraints"] = [IMAGE]
+    params[1]["constraints"] = [PORT]
+    anymarkup.serialize_file(data, mainfile, format="yaml")
+    return path
+
+
+class TestValidatorSuite(object):
+
+    def test_reports_all_violations(self):
+        validator = Validator({"id": "app", "params": [
+            {"name": "port", "constraints": [PORT]}],
+            "graph": [{"name": "web", "params": [
+                {"name": "image", "default": "x", "constraints": [IMAGE]}]}]})
+
+        # global constraints apply to components, unresolved values are skipped
+        assert validator.validate("web", {"port": 80, "image": "centos/httpd"}) == []
+        assert validator.validate("web", {"port": {"description": "Port"}}) == []
+        assert validator.validate("web", {"port": "http", "image": "Bad Image"}) == [
+            "app: image in component web: Image name is invalid",
+            "app: port in component web: Port has to be a number"]
+
+    def test_run_fails_before_deploy(self):
+        tmpdir = tempfile.mkdtemp(prefix="atomicapp-test-")
+        app = constrainedApp(os.path.join(tmpdir, "helloapache"))
+        answers = os.path.join(tmpdir, "answers.conf")
+        anymarkup.serialize_file(
+            {"general": {"namespace": "Bad_NS"},
+             "helloapache-app": {"hostport": "http", "image": "centos/httpd"}},
+            answers, format="ini")
+
+        with pytest.raises(ValidationError) as exec_info:
+            Run(answers, app, dryrun=True).run()
+
+        assert len(exec_info.value.violations) == 3
+        assert not os.path.exists(os.path.join(app, ".workdir", "helloapache-app"))
+
+        anymarkup.serialize_file(
+            {"general": {"namespace": "good-ns"}}, answers, format="ini")
+        Run(answers, app, dryrun=True).run()
+        shutil.rmtree(tmpdir)